@@ -0,0 +1,182 @@
+import argparse
+import logging
+import time
+import warnings
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from compact_history import CompactHistory, load_history
+from ohlcv_store import close_panel
+from profiler import profiled
+from quarterly_rollup import aggregate_quarters, quarterly_estimates
+from roe_data import ROE_CSV_FILE
+
+logger = logging.getLogger(__name__)
+
+# 與 recommend_v2 相同的條件
+MIN_ROE = 15
+MIN_QUARTERS = 16
+TOP_K = 10
+
+
+def _quarter_panel(history: CompactHistory) -> Dict[str, pd.DataFrame]:
+    """所有股票的季度估值，轉為 (季度 × 股票) 矩陣"""
+    df_q = quarterly_estimates(aggregate_quarters(history.frame()))
+    valid = df_q[["ROE", "BVPS", "推估EPS", "高股價", "正常股價", "低股價"]].notna().all(axis=1) & (df_q["prev_close"] > 0)
+    df_q = df_q[valid]
+    return {
+        column: df_q.pivot(index="quarter", columns="stock_id", values=column).sort_index()
+        for column in ["ROE", "PER_最低值", "BVPS", "PER"]
+    }
+
+
+def _expanding_mean(panel: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    """沿季度方向的累積平均（只含當季以前的資料）與累積季數"""
+    values = panel.to_numpy(dtype=np.float64)
+    present = ~np.isnan(values)
+    counts = np.cumsum(present, axis=0)
+    sums = np.cumsum(np.where(present, values, 0.0), axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return sums / counts, counts
+
+
+def _month_end_prices(history: CompactHistory, stock_ids: pd.Index, use_store: bool = False) -> pd.DataFrame:
+    """
+    每月最後一個交易日的收盤價 (月 × 股票)
+
+    :param use_store: 以本機 ohlcv 表的收盤價為主，CSV 的 close 只補缺漏
+    """
+    df = history.frame()[["date", "stock_id", "close"]]
+    df["stock_id"] = df["stock_id"].astype(str)
+    df = df[df["stock_id"].isin(stock_ids)]
+    daily = df.pivot(index="date", columns="stock_id", values="close")
+    if use_store:
+        daily = close_panel(list(stock_ids)).combine_first(daily)
+    return daily.reindex(columns=stock_ids).ffill().resample("ME").last()
+
+
+@profiled("backtest")
+def run_backtest(history: Optional[CompactHistory] = None, start: Optional[str] = None, end: Optional[str] = None,
+                 top_k: int = TOP_K, min_roe: float = MIN_ROE, min_quarters: int = MIN_QUARTERS,
+                 use_store: bool = False) -> Dict:
+    """
+    於每個月底重播 recommend_v2 的 value_score 排名（只使用當時已結束季度的資料），
+    持有前 top_k 名一個月（等權重），並與全體股票等權重報酬比較。
+
+    :param use_store: 月底股價改用本機 ohlcv 表（見 ohlcv_store）
+    :return: {"monthly": 每月報酬與持股, "summary": 統計摘要}
+    """
+    started = time.perf_counter()
+    if history is None:
+        history = load_history(ROE_CSV_FILE)
+
+    panels = _quarter_panel(history)
+    stock_ids = panels["ROE"].columns
+    quarters = panels["ROE"].index
+    avg_roe, counts = _expanding_mean(panels["ROE"])
+    avg_per_low, _ = _expanding_mean(panels["PER_最低值"])
+    latest_bvps = panels["BVPS"].ffill().to_numpy()
+    latest_per = panels["PER"].ffill().to_numpy()
+
+    prices = _month_end_prices(history, stock_ids, use_store)
+    if start:
+        prices = prices[prices.index >= pd.Timestamp(start)]
+    if end:
+        prices = prices[prices.index <= pd.Timestamp(end)]
+
+    # 每個月底可用的最後一個已結束季度
+    quarter_ends = quarters.end_time.normalize()
+    k = np.searchsorted(quarter_ends.values, prices.index.values, side="right") - 1
+    usable = k >= 0
+    prices = prices[usable]
+    k = k[usable]
+
+    price = prices.to_numpy(dtype=np.float64)
+    estimated_eps = latest_bvps[k] * (avg_roe[k] / 100)
+    low_price = estimated_eps * avg_per_low[k]
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        price_discount = (low_price - price) / low_price
+        per_discount = 1 / latest_per[k]
+        value_score = np.clip((price_discount * 0.6 + per_discount * 0.4) * 100, 0, 100)
+
+    # 季度需連續不中斷（累積季數 == 自第一季以來的季數）
+    contiguous = counts[k] == (k + 1)[:, None]
+    eligible = (
+        (avg_roe[k] >= min_roe) & (counts[k] >= min_quarters) & contiguous
+        & (price > 0) & (value_score > 0)
+    )
+    scores = np.where(eligible, value_score, -np.inf)
+
+    # 前 top_k 名（分數由高到低）
+    top = np.argsort(-scores, axis=1, kind="stable")[:, :top_k]
+    selected = np.take_along_axis(eligible, top, axis=1)
+
+    # 下個月底的報酬
+    with np.errstate(invalid="ignore", divide="ignore"):
+        forward = np.vstack([price[1:] / price[:-1] - 1, np.full((1, price.shape[1]), np.nan)])
+    picked_returns = np.where(selected, np.take_along_axis(forward, top, axis=1), np.nan)
+    with warnings.catch_warnings():
+        # 沒有持股的月份視為持有現金（報酬 0）
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        portfolio = np.nan_to_num(np.nanmean(picked_returns, axis=1))
+        benchmark = np.nanmean(forward, axis=1)
+
+    monthly = pd.DataFrame({
+        "date": prices.index,
+        "holdings": [list(stock_ids[row[sel]]) for row, sel in zip(top, selected)],
+        "portfolio": portfolio,
+        "benchmark": benchmark,
+    }).iloc[:-1]  # 最後一個月沒有下個月的報酬
+
+    summary = _summarize(monthly)
+    summary["elapsed_seconds"] = round(time.perf_counter() - started, 3)
+    summary["stocks"] = len(stock_ids)
+    logger.info(f"回測完成：{summary}")
+    return {"monthly": monthly, "summary": summary}
+
+
+def _summarize(monthly: pd.DataFrame) -> Dict:
+    """累積報酬、年化報酬、波動度、最大回撤與勝率"""
+    summary = {"months": len(monthly)}
+    for column in ["portfolio", "benchmark"]:
+        returns = monthly[column].fillna(0.0).to_numpy()
+        equity = np.cumprod(1 + returns)
+        years = len(returns) / 12
+        summary[column] = {
+            "total_return": float(equity[-1] - 1) if len(equity) else 0.0,
+            "cagr": float(equity[-1] ** (1 / years) - 1) if years > 0 else 0.0,
+            "volatility": float(returns.std() * np.sqrt(12)),
+            "max_drawdown": float((equity / np.maximum.accumulate(equity) - 1).min()) if len(equity) else 0.0,
+        }
+    summary["hit_rate"] = float((monthly["portfolio"] > monthly["benchmark"]).mean()) if len(monthly) else 0.0
+    summary["avg_holdings"] = float(monthly["holdings"].map(len).mean()) if len(monthly) else 0.0
+    return summary
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        level=logging.INFO,
+    )
+    parser = argparse.ArgumentParser(description="value_score 策略的逐月回測")
+    parser.add_argument("--start", help="起始月份 (YYYY-MM-DD)")
+    parser.add_argument("--end", help="結束月份 (YYYY-MM-DD)")
+    parser.add_argument("--top-k", type=int, default=TOP_K)
+    parser.add_argument("--min-roe", type=float, default=MIN_ROE)
+    parser.add_argument("--min-quarters", type=int, default=MIN_QUARTERS)
+    parser.add_argument("--ohlcv", action="store_true", help="月底股價使用本機 ohlcv 表")
+    args = parser.parse_args()
+
+    result = run_backtest(start=args.start, end=args.end, top_k=args.top_k,
+                          min_roe=args.min_roe, min_quarters=args.min_quarters, use_store=args.ohlcv)
+    summary = result["summary"]
+    print(result["monthly"].to_string(index=False))
+    for column, label in [("portfolio", "策略"), ("benchmark", "全體等權重")]:
+        stats = summary[column]
+        print(f"{label}: 累積報酬 {stats['total_return']:.2%}、年化 {stats['cagr']:.2%}、"
+              f"波動度 {stats['volatility']:.2%}、最大回撤 {stats['max_drawdown']:.2%}")
+    print(f"月數 {summary['months']}、勝率 {summary['hit_rate']:.2%}、平均持股 {summary['avg_holdings']:.1f} 支、"
+          f"耗時 {summary['elapsed_seconds']} 秒")
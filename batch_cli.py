@@ -0,0 +1,228 @@
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import math
+import os
+import sys
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 可執行的指令（與 Telegram 指令同名）
+COMMANDS = ["stock_estimate", "etf", "recommend_v2", "similar", "exdiv", "sync_stock_prices"]
+SEPARATOR = "+"  # 一次執行多個指令時的分隔符號
+
+
+class StageTimer:
+    """記錄各階段耗時"""
+
+    def __init__(self):
+        self.stages: List[Tuple[str, float]] = []
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.append((name, time.perf_counter() - started))
+
+    def report(self) -> str:
+        width = max(len(name) for name, _ in self.stages)
+        lines = [f"{name:<{width}}  {seconds:8.3f} 秒" for name, seconds in self.stages]
+        lines.append(f"{'total':<{width}}  {sum(seconds for _, seconds in self.stages):8.3f} 秒")
+        return "\n".join(lines)
+
+
+def split_commands(tokens: List[str]) -> List[Tuple[str, List[str]]]:
+    """
+    將 "stock_estimate 2330 2317 + etf 0056" 拆成 [(指令, 參數), ...]
+
+    :raises ValueError: 指令名稱不存在或缺少指令
+    """
+    commands, current = [], []
+    for token in tokens + [SEPARATOR]:
+        if token != SEPARATOR:
+            current.append(token)
+            continue
+        if not current:
+            raise ValueError(f"'{SEPARATOR}' 前後需要指令")
+        name, args = current[0], current[1:]
+        if name not in COMMANDS:
+            raise ValueError(f"未知的指令：{name}（可用：{', '.join(COMMANDS)}）")
+        commands.append((name, args))
+        current = []
+    return commands
+
+
+def _clean(value):
+    """NaN 轉為 None、numpy 型別轉為 Python 型別，方便輸出 JSON / CSV"""
+    if hasattr(value, "item"):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+class BatchSession:
+    """
+    同一程序內依序執行多個指令。
+    tg_robot 載入的 CSV、季度彙總與歷史資料快取由所有指令共用，
+    全市場最新股價也只查詢一次，相同參數的指令直接沿用先前的結果（sync_stock_prices 之後重新計算）。
+    """
+
+    def __init__(self, bot, top: Optional[int] = None):
+        self.bot = bot
+        self.top = top
+        self._market_prices: Optional[Dict[str, float]] = None
+        self._results: Dict[Tuple[str, ...], List[Dict]] = {}
+
+    async def market_prices(self) -> Dict[str, float]:
+        if self._market_prices is None:
+            self._market_prices = await self.bot.get_current_stock_prices()
+        return self._market_prices
+
+    async def run(self, name: str, args: List[str]) -> List[Dict]:
+        if name == "sync_stock_prices":
+            return await self._compute(name, args)
+        key = (name, *args)
+        if key not in self._results:
+            self._results[key] = await self._compute(name, args)
+        return self._results[key]
+
+    async def _compute(self, name: str, args: List[str]) -> List[Dict]:
+        if name == "stock_estimate":
+            stock_ids = self.bot._parse_tickers(args)
+            rows, failed = await self.bot.compute_stock_estimates(stock_ids, await self.market_prices())
+        elif name == "etf":
+            stock_ids = self.bot._parse_tickers(args)
+            rows, failed = await self.bot.compute_etf(stock_ids, await self.market_prices())
+        elif name == "similar":
+            if not args:
+                raise ValueError("similar 需要股票代號，例如：similar 2603 20")
+            rows = self.bot.compute_similar(args[0].strip().upper(), int(args[1]) if len(args) > 1 else self.bot.DEFAULT_TOP_K)
+            failed = []
+        elif name == "exdiv":
+            rows, failed = self.bot.compute_exdiv(*self.bot.parse_exdiv_args(args)), []
+        elif name == "recommend_v2":
+            outcome = await self.bot.compute_recommendations()
+            if outcome is None:
+                raise RuntimeError("找不到股價數據文件，請先執行 sync_stock_prices")
+            rows, failed = outcome["results"][:self.top], []
+            logger.info(f"recommend_v2：共 {outcome['total']} 支股票，無四季資料 {outcome['no_quarter_data']} 支，"
+                        f"符合條件 {outcome['filtered']} 支")
+        else:
+            total, prices = await self.bot.compute_sync_stock_prices()
+            if not total:
+                raise RuntimeError("無法獲取股票列表")
+            rows, failed = [{"stock_id": stock_id, "price": price} for stock_id, price in prices.items()], []
+            self._market_prices = None
+            self._results.clear()
+
+        if failed:
+            logger.warning(f"{name} 無法取得數據：{', '.join(failed)}")
+        return [{key: _clean(value) for key, value in row.items()} for row in rows]
+
+
+def write_csv(rows: List[Dict], stream) -> None:
+    columns = list(dict.fromkeys(key for row in rows for key in row))
+    writer = csv.DictWriter(stream, fieldnames=columns)
+    writer.writeheader()
+    writer.writerows(rows)
+
+
+def write_outputs(results: List[Tuple[str, List[Dict]]], output_format: str, output_dir: Optional[str]) -> None:
+    """
+    輸出各指令的結果：
+    指定 output_dir 時每個指令一個檔案，否則 JSON 輸出一個 {指令: 結果} 物件、CSV 以 "# 指令" 分段
+    """
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+        for label, rows in results:
+            path = os.path.join(output_dir, f"{label}.{output_format}")
+            with open(path, "w", encoding="utf-8", newline="") as f:
+                if output_format == "json":
+                    json.dump(rows, f, ensure_ascii=False, indent=2)
+                else:
+                    write_csv(rows, f)
+            logger.info(f"已輸出 {len(rows)} 筆到 {path}")
+        return
+
+    if output_format == "json":
+        json.dump({label: rows for label, rows in results}, sys.stdout, ensure_ascii=False, indent=2)
+        sys.stdout.write("\n")
+    else:
+        for i, (label, rows) in enumerate(results):
+            if len(results) > 1:
+                sys.stdout.write(("\n" if i else "") + f"# {label}\n")
+            write_csv(rows, sys.stdout)
+
+
+def _labels(commands: List[Tuple[str, List[str]]]) -> List[str]:
+    """同一指令執行多次時加上序號：etf、etf_2"""
+    seen: Dict[str, int] = {}
+    labels = []
+    for name, _ in commands:
+        seen[name] = seen.get(name, 0) + 1
+        labels.append(name if seen[name] == 1 else f"{name}_{seen[name]}")
+    return labels
+
+
+async def run_batch(commands: List[Tuple[str, List[str]]], timer: StageTimer, top: Optional[int] = None,
+                    quiet: bool = False) -> Tuple[List[Tuple[str, List[Dict]]], List[str]]:
+    """
+    載入資料一次後依序執行所有指令，所有指令讀取同一個 stock_roe_data 版本
+
+    :return: (各指令的結果, 執行失敗的指令)；失敗的指令結果為空，不影響後續指令
+    """
+    with timer.stage("load"):
+        import tg_robot
+        from roe_data import ROE_CSV_FILE
+        from snapshot_store import store
+    # tg_robot 匯入時會設定紀錄格式，之後才調整層級
+    if quiet:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    session = BatchSession(tg_robot, top)
+    results, errors = [], []
+    with store(ROE_CSV_FILE).pin():
+        for label, (name, args) in zip(_labels(commands), commands):
+            with timer.stage(label):
+                try:
+                    rows = await session.run(name, args)
+                except Exception as e:
+                    logger.error(f"{label} 執行失敗：{e}")
+                    rows = []
+                    errors.append(label)
+            results.append((label, rows))
+    return results, errors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="不經過 Telegram 直接執行 bot 的分析指令",
+        epilog=f"範例：python batch_cli.py --format csv stock_estimate 2330 2317 {SEPARATOR} etf 0056 00878",
+    )
+    parser.add_argument("--format", choices=["json", "csv"], default="json")
+    parser.add_argument("--output-dir", help="每個指令輸出一個檔案到此目錄（預設輸出到 stdout）")
+    parser.add_argument("--top", type=int, help="recommend_v2 只輸出前 N 名")
+    parser.add_argument("--quiet", action="store_true", help="只顯示警告以上的紀錄")
+    parser.add_argument("commands", nargs=argparse.REMAINDER,
+                        help=f"{' / '.join(COMMANDS)} 與其參數，多個指令以 '{SEPARATOR}' 分隔")
+    args = parser.parse_args()
+
+    try:
+        commands = split_commands(args.commands)
+    except ValueError as e:
+        parser.error(str(e))
+
+    timer = StageTimer()
+    results, errors = asyncio.run(run_batch(commands, timer, args.top, args.quiet))
+    with timer.stage("output"):
+        write_outputs(results, args.format, args.output_dir)
+    print(timer.report(), file=sys.stderr)
+    sys.exit(1 if errors else 0)
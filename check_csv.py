@@ -1,8 +1,10 @@
-import pandas as pd
 import numpy as np
 
-# 讀取 CSV 文件
-df = pd.read_csv('stock_roe_data.csv')
+from snapshot_store import store
+
+# 讀取 CSV 文件（目前的快照版本）
+with store('stock_roe_data.csv').pin() as snapshot:
+    df = snapshot.read_csv()
 
 # 顯示基本信息
 print("CSV 文件基本信息：")
@@ -0,0 +1,145 @@
+import logging
+import sys
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from roe_data import ROE_CSV_FILE
+from snapshot_store import Snapshot, store
+
+logger = logging.getLogger(__name__)
+
+HISTORY_COLUMNS = ["stock_id", "date", "PER", "PBR", "close"]
+_EPOCH = np.datetime64("1970-01-01", "D")
+
+
+def _restore(values: np.ndarray) -> np.ndarray:
+    """float32 轉回 float64；來源數值最多 2 位小數，四捨五入可還原原始值"""
+    return np.round(values.astype(np.float64), 4)
+
+
+class CompactHistory:
+    """
+    stock_roe_data 的精簡記憶體表示：
+    stock_id 以 int32 代碼表示、日期為 int32 日數、PER/PBR/close 為 float32，
+    並依 (代碼, 日期) 排序，每支股票的資料是連續的一段。
+    """
+
+    def __init__(self, stock_ids: np.ndarray, codes: np.ndarray, days: np.ndarray,
+                 per: np.ndarray, pbr: np.ndarray, close: np.ndarray):
+        order = np.lexsort((days, codes))
+        self.stock_ids = stock_ids
+        self.codes = codes[order]
+        self.days = days[order]
+        self.per = per[order]
+        self.pbr = pbr[order]
+        self.close = close[order]
+        # 第 i 支股票的資料位於 [offsets[i], offsets[i + 1])
+        self.offsets = np.searchsorted(self.codes, np.arange(len(stock_ids) + 1)).astype(np.int64)
+        self._code_of: Dict[str, int] = {stock_id: i for i, stock_id in enumerate(stock_ids)}
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> "CompactHistory":
+        df = df[pd.to_datetime(df["date"], errors="coerce").notna()]
+        stock_ids = df["stock_id"].astype(str)
+        categories = pd.Categorical(stock_ids)
+        dates = pd.to_datetime(df["date"], errors="coerce").to_numpy(dtype="datetime64[D]")
+        close = df["close"] if "close" in df.columns else pd.Series(np.nan, index=df.index)
+        return cls(
+            stock_ids=np.asarray(categories.categories, dtype=object),
+            codes=categories.codes.astype(np.int32),
+            days=(dates - _EPOCH).astype(np.int32),
+            per=pd.to_numeric(df["PER"], errors="coerce").to_numpy(dtype=np.float32),
+            pbr=pd.to_numeric(df["PBR"], errors="coerce").to_numpy(dtype=np.float32),
+            close=pd.to_numeric(close, errors="coerce").to_numpy(dtype=np.float32),
+        )
+
+    @classmethod
+    def from_snapshot(cls, snapshot: Snapshot) -> "CompactHistory":
+        """只讀取需要的欄位，並直接以精簡型別解析"""
+        df = snapshot.read_csv(
+            usecols=lambda col: col in HISTORY_COLUMNS,
+            dtype={"stock_id": "category", "PER": "float32", "PBR": "float32", "close": "float32"},
+        )
+        return cls.from_frame(df)
+
+    @classmethod
+    def from_csv(cls, csv_file: str = ROE_CSV_FILE) -> "CompactHistory":
+        """讀取資料集目前的版本"""
+        with store(csv_file).pin() as snapshot:
+            if snapshot is None:
+                raise FileNotFoundError(csv_file)
+            return cls.from_snapshot(snapshot)
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def block(self, stock_id: str) -> slice:
+        """回傳該股票資料的連續區段（查無資料時為空區段）"""
+        code = self._code_of.get(str(stock_id))
+        if code is None:
+            return slice(0, 0)
+        return slice(int(self.offsets[code]), int(self.offsets[code + 1]))
+
+    def frame(self, stock_id: Optional[str] = None, since: Optional[pd.Timestamp] = None) -> pd.DataFrame:
+        """
+        轉回既有函數使用的 DataFrame（stock_id, date, PER, PBR, close）。
+
+        :param stock_id: 只取單一股票，None 表示全部
+        :param since: 只取此日期（含）之後的資料
+        """
+        rows = self.block(stock_id) if stock_id is not None else slice(0, len(self))
+        codes, days = self.codes[rows], self.days[rows]
+        mask = slice(None)
+        if since is not None:
+            mask = days >= (np.datetime64(pd.Timestamp(since).date(), "D") - _EPOCH).astype(np.int32)
+        return pd.DataFrame({
+            "stock_id": pd.Categorical.from_codes(codes[mask], categories=self.stock_ids),
+            "date": (days[mask] + _EPOCH).astype("datetime64[ns]"),
+            "PER": _restore(self.per[rows][mask]),
+            "PBR": _restore(self.pbr[rows][mask]),
+            "close": _restore(self.close[rows][mask]),
+        })
+
+    def memory_bytes(self) -> int:
+        arrays = [self.codes, self.days, self.per, self.pbr, self.close, self.offsets]
+        return sum(a.nbytes for a in arrays) + sum(sys.getsizeof(s) for s in self.stock_ids)
+
+
+_cache: Dict[str, Tuple[int, CompactHistory]] = {}
+
+
+def load_history(csv_file: str = ROE_CSV_FILE) -> CompactHistory:
+    """依快照版本快取精簡歷史資料，有新版本後才重新載入"""
+    with store(csv_file).pin() as snapshot:
+        if snapshot is None:
+            raise FileNotFoundError(csv_file)
+        cached = _cache.get(csv_file)
+        if cached is None or cached[0] != snapshot.version:
+            cached = (snapshot.version, CompactHistory.from_snapshot(snapshot))
+            _cache[csv_file] = cached
+    return cached[1]
+
+
+def memory_report(csv_file: str = ROE_CSV_FILE) -> Dict[str, float]:
+    """比較預設 pandas 讀取與精簡表示的記憶體用量 (MB)"""
+    with store(csv_file).pin() as snapshot:
+        df = snapshot.read_csv()
+        compact_mb = CompactHistory.from_snapshot(snapshot).memory_bytes() / 1024 ** 2
+    default_mb = df.memory_usage(deep=True).sum() / 1024 ** 2
+    default_columns_mb = df[[c for c in HISTORY_COLUMNS if c in df.columns]].memory_usage(deep=True).sum() / 1024 ** 2
+    return {
+        "rows": len(df),
+        "default_all_columns_mb": round(float(default_mb), 1),
+        "default_history_columns_mb": round(float(default_columns_mb), 1),
+        "compact_mb": round(float(compact_mb), 1),
+    }
+
+
+if __name__ == "__main__":
+    report = memory_report(sys.argv[1] if len(sys.argv) > 1 else ROE_CSV_FILE)
+    print(f"筆數: {report['rows']}")
+    print(f"pandas 預設型別（全部欄位）: {report['default_all_columns_mb']} MB")
+    print(f"pandas 預設型別（stock_id/date/PER/PBR/close）: {report['default_history_columns_mb']} MB")
+    print(f"精簡表示: {report['compact_mb']} MB")
@@ -1,13 +1,29 @@
 import sqlite3
 import json
+import time
 
 DB_PATH = "stock_data.db"
+DB_TIMEOUT = 30  # 多個 worker 同時寫入時等待鎖的秒數
+
+# financial_reports 的個股指標欄位（TWSE BWIBBU）
+FINANCIAL_REPORT_COLUMNS = [
+    ("stock_name", "TEXT"),
+    ("close", "REAL"),
+    ("dividend_yield", "REAL"),
+    ("dividend_year", "TEXT"),
+    ("per", "REAL"),
+    ("pbr", "REAL"),
+    ("fiscal_period", "TEXT"),
+]
 
 def init_db():
     """初始化 SQLite 資料表"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(DB_PATH, timeout=DB_TIMEOUT)
     cursor = conn.cursor()
 
+    # WAL 模式讓讀取不會被寫入阻擋，多個 worker 共用資料庫
+    cursor.execute("PRAGMA journal_mode=WAL")
+
     # 建立財報數據表
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS financial_reports (
@@ -18,6 +34,13 @@ def init_db():
         )
     """)
 
+    # 舊版資料表只有 data 欄位，補上個股殖利率、本益比、股價淨值比欄位
+    cursor.execute("PRAGMA table_info(financial_reports)")
+    existing_columns = {row[1] for row in cursor.fetchall()}
+    for column, column_type in FINANCIAL_REPORT_COLUMNS:
+        if column not in existing_columns:
+            cursor.execute(f"ALTER TABLE financial_reports ADD COLUMN {column} {column_type}")
+
     # 建立股票列表表
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS stock_list (
@@ -28,12 +51,158 @@ def init_db():
         )
     """)
 
+    # 建立季度彙總表（PER/PBR 日資料依季度彙總，已結束的季度標記為 frozen）
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS quarterly_rollups (
+            stock_id TEXT,
+            quarter TEXT,
+            last_date TEXT,
+            per_mean REAL,
+            per_p95 REAL,
+            per_p5 REAL,
+            pbr_median REAL,
+            prev_close REAL,
+            n_days INTEGER,
+            frozen INTEGER DEFAULT 0,
+            PRIMARY KEY (stock_id, quarter)
+        )
+    """)
+
+    # 建立個股日 K 線表（TaiwanStockPrice）
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ohlcv (
+            stock_id TEXT,
+            date TEXT,
+            open REAL,
+            max REAL,
+            min REAL,
+            close REAL,
+            spread REAL,
+            Trading_Volume INTEGER,
+            Trading_money INTEGER,
+            Trading_turnover INTEGER,
+            PRIMARY KEY (stock_id, date)
+        )
+    """)
+
+    # 記錄每支股票已下載的日期區間（含頭尾，期間沒有資料代表休市）
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ohlcv_coverage (
+            stock_id TEXT,
+            start_date TEXT,
+            end_date TEXT,
+            PRIMARY KEY (stock_id, start_date)
+        )
+    """)
+
+    # 建立工作佇列（每支股票一個工作，多個 worker 以租約方式領取）
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT,
+            stock_id TEXT,
+            payload TEXT,
+            status TEXT DEFAULT 'pending',
+            attempts INTEGER DEFAULT 0,
+            max_attempts INTEGER DEFAULT 5,
+            available_at REAL,
+            lease_owner TEXT,
+            lease_until REAL,
+            last_error TEXT,
+            updated_at REAL,
+            UNIQUE (kind, stock_id, payload)
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, available_at)")
+
+    # 多個 worker 共用的 token bucket 速率限制
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS rate_limits (
+            name TEXT PRIMARY KEY,
+            tokens REAL,
+            updated_at REAL
+        )
+    """)
+
+    # 建立價格區間提醒訂閱表（target 為殖利率目標，價格區間為 0；last_side 為上次價格在門檻的哪一側）
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS watch_subscriptions (
+            chat_id INTEGER,
+            stock_id TEXT,
+            band TEXT,
+            target REAL DEFAULT 0,
+            last_side TEXT,
+            created_at TEXT,
+            PRIMARY KEY (chat_id, stock_id, band, target)
+        )
+    """)
+
+    # 建立查無資料的快取（依原因設定重新檢查時間）
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS negative_cache (
+            stock_id TEXT,
+            dataset TEXT,
+            reason TEXT,
+            failures INTEGER,
+            first_seen REAL,
+            last_checked REAL,
+            recheck_at REAL,
+            PRIMARY KEY (stock_id, dataset)
+        )
+    """)
+
+    # 建立基本面預測表（每支股票、每個指標未來各季的預測值與所選模型的回測誤差）
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS fundamental_forecasts (
+            stock_id TEXT,
+            metric TEXT,
+            horizon INTEGER,
+            quarter TEXT,
+            model TEXT,
+            forecast REAL,
+            mae REAL,
+            fitted_at TEXT,
+            PRIMARY KEY (stock_id, metric, horizon)
+        )
+    """)
+
+    # 建立產業相對估值表：每個產業、每季各指標的分布，以及每支股票在產業內的百分位
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS industry_valuation (
+            industry TEXT,
+            quarter TEXT,
+            metric TEXT,
+            n INTEGER,
+            p10 REAL,
+            p25 REAL,
+            p50 REAL,
+            p75 REAL,
+            p90 REAL,
+            built_at TEXT,
+            PRIMARY KEY (industry, quarter, metric)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS industry_percentiles (
+            stock_id TEXT,
+            quarter TEXT,
+            industry TEXT,
+            per REAL,
+            pbr REAL,
+            roe REAL,
+            per_pct REAL,
+            pbr_pct REAL,
+            roe_pct REAL,
+            PRIMARY KEY (stock_id, quarter)
+        )
+    """)
+
     conn.commit()
     conn.close()
 
 def save_stock_list(stock_list):
     """將股市列表存入資料庫 (只存一次)"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(DB_PATH, timeout=DB_TIMEOUT)
     cursor = conn.cursor()
 
     cursor.executemany("""
@@ -46,7 +215,7 @@ def save_stock_list(stock_list):
 
 def load_stock_list():
     """從資料庫加載股市列表"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(DB_PATH, timeout=DB_TIMEOUT)
     cursor = conn.cursor()
 
     cursor.execute("SELECT stock_no, name, industry, market FROM stock_list")
@@ -54,3 +223,571 @@ def load_stock_list():
     conn.close()
 
     return rows if rows else None
+
+
+def save_financial_reports(reports):
+    """
+    批次寫入個股殖利率、本益比、股價淨值比 (以 (stock_no, date) 為鍵)
+
+    :param reports: [(stock_no, date, data, stock_name, close, dividend_yield,
+                      dividend_year, per, pbr, fiscal_period), ...]
+    """
+    conn = sqlite3.connect(DB_PATH, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+
+    cursor.executemany("""
+        INSERT OR REPLACE INTO financial_reports
+            (stock_no, date, data, stock_name, close, dividend_yield, dividend_year, per, pbr, fiscal_period)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, reports)
+
+    conn.commit()
+    conn.close()
+
+def load_financial_report_dates():
+    """回傳 financial_reports 中已存在的日期"""
+    conn = sqlite3.connect(DB_PATH, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+
+    cursor.execute("SELECT DISTINCT date FROM financial_reports")
+    dates = {row[0] for row in cursor.fetchall()}
+    conn.close()
+
+    return dates
+
+
+QUARTERLY_ROLLUP_COLUMNS = [
+    "stock_id", "quarter", "last_date", "per_mean", "per_p95", "per_p5",
+    "pbr_median", "prev_close", "n_days", "frozen",
+]
+
+def save_quarterly_rollups(rollups):
+    """批次寫入季度彙總 (以 (stock_id, quarter) 為鍵，欄位順序同 QUARTERLY_ROLLUP_COLUMNS)"""
+    conn = sqlite3.connect(DB_PATH, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+
+    cursor.executemany(f"""
+        INSERT OR REPLACE INTO quarterly_rollups ({", ".join(QUARTERLY_ROLLUP_COLUMNS)})
+        VALUES ({", ".join("?" * len(QUARTERLY_ROLLUP_COLUMNS))})
+    """, rollups)
+
+    conn.commit()
+    conn.close()
+
+def load_quarterly_rollups(stock_ids=None):
+    """讀取季度彙總，stock_ids 為 None 時讀取全部"""
+    conn = sqlite3.connect(DB_PATH, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+
+    query = f"SELECT {', '.join(QUARTERLY_ROLLUP_COLUMNS)} FROM quarterly_rollups"
+    if stock_ids is None:
+        cursor.execute(query + " ORDER BY stock_id, quarter")
+    else:
+        stock_ids = list(stock_ids)
+        placeholders = ", ".join("?" * len(stock_ids))
+        cursor.execute(query + f" WHERE stock_id IN ({placeholders}) ORDER BY stock_id, quarter", stock_ids)
+    rows = cursor.fetchall()
+    conn.close()
+
+    return rows
+
+def load_frozen_quarters():
+    """回傳已凍結（季度已結束且資料完整）的 {(stock_id, quarter), ...}"""
+    conn = sqlite3.connect(DB_PATH, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+
+    cursor.execute("SELECT stock_id, quarter FROM quarterly_rollups WHERE frozen = 1")
+    frozen = set(cursor.fetchall())
+    conn.close()
+
+    return frozen
+
+
+OHLCV_COLUMNS = [
+    "stock_id", "date", "open", "max", "min", "close", "spread",
+    "Trading_Volume", "Trading_money", "Trading_turnover",
+]
+
+def save_ohlcv(rows):
+    """批次寫入日 K 線 (以 (stock_id, date) 為鍵，欄位順序同 OHLCV_COLUMNS)"""
+    conn = sqlite3.connect(DB_PATH, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+
+    cursor.executemany(f"""
+        INSERT OR REPLACE INTO ohlcv ({", ".join(OHLCV_COLUMNS)})
+        VALUES ({", ".join("?" * len(OHLCV_COLUMNS))})
+    """, rows)
+
+    conn.commit()
+    conn.close()
+
+def load_ohlcv(stock_ids=None, start_date=None, end_date=None, columns=None):
+    """讀取日 K 線，可限定股票與日期區間 (YYYY-MM-DD，含頭尾)"""
+    conn = sqlite3.connect(DB_PATH, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+
+    conditions, params = [], []
+    if stock_ids is not None:
+        stock_ids = list(stock_ids)
+        conditions.append(f"stock_id IN ({', '.join('?' * len(stock_ids))})")
+        params.extend(stock_ids)
+    if start_date is not None:
+        conditions.append("date >= ?")
+        params.append(start_date)
+    if end_date is not None:
+        conditions.append("date <= ?")
+        params.append(end_date)
+
+    query = f"SELECT {', '.join(columns or OHLCV_COLUMNS)} FROM ohlcv"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    cursor.execute(query + " ORDER BY stock_id, date", params)
+    rows = cursor.fetchall()
+    conn.close()
+
+    return rows
+
+def load_ohlcv_coverage(stock_id):
+    """回傳該股票已下載的日期區間 [(start_date, end_date), ...]"""
+    conn = sqlite3.connect(DB_PATH, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+
+    cursor.execute(
+        "SELECT start_date, end_date FROM ohlcv_coverage WHERE stock_id = ? ORDER BY start_date",
+        (stock_id,),
+    )
+    rows = cursor.fetchall()
+    conn.close()
+
+    return rows
+
+def add_ohlcv_coverage(stock_id, intervals, merge):
+    """
+    加入新下載的日期區間：在同一個 BEGIN IMMEDIATE 交易內讀取既有區間並合併後取代，
+    多個 worker 同時更新同一支股票時不會遺失其他 worker 寫入的區間
+
+    :param intervals: 新增的 [(start_date, end_date), ...]
+    :param merge: 合併函數，接收全部區間並回傳合併後的區間
+    """
+    conn = sqlite3.connect(DB_PATH, timeout=DB_TIMEOUT, isolation_level=None)
+    conn.execute("BEGIN IMMEDIATE")
+    cursor = conn.cursor()
+
+    cursor.execute("SELECT start_date, end_date FROM ohlcv_coverage WHERE stock_id = ?", (stock_id,))
+    merged = merge(cursor.fetchall() + list(intervals))
+    cursor.execute("DELETE FROM ohlcv_coverage WHERE stock_id = ?", (stock_id,))
+    cursor.executemany(
+        "INSERT INTO ohlcv_coverage (stock_id, start_date, end_date) VALUES (?, ?, ?)",
+        [(stock_id, start, end) for start, end in merged],
+    )
+
+    conn.execute("COMMIT")
+    conn.close()
+
+
+JOB_COLUMNS = [
+    "id", "kind", "stock_id", "payload", "status", "attempts", "max_attempts",
+    "available_at", "lease_owner", "lease_until", "last_error", "updated_at",
+]
+
+def _connect_immediate():
+    """自行控制交易的連線；BEGIN IMMEDIATE 先取得寫入鎖，避免多個程序同時領取同一個工作"""
+    conn = sqlite3.connect(DB_PATH, timeout=DB_TIMEOUT, isolation_level=None)
+    conn.execute("BEGIN IMMEDIATE")
+    return conn
+
+def enqueue_jobs(jobs, max_attempts=5):
+    """
+    批次加入工作；已存在的 (kind, stock_id, payload) 若已完成或失敗則重新排入，
+    尚在等待或執行中的不受影響
+
+    :param jobs: [(kind, stock_id, payload), ...]
+    :return: 排入的工作數
+    """
+    conn = sqlite3.connect(DB_PATH, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+
+    now = time.time()
+    before = conn.total_changes
+    cursor.executemany("""
+        INSERT INTO jobs (kind, stock_id, payload, status, attempts, max_attempts, available_at, updated_at)
+        VALUES (?, ?, ?, 'pending', 0, ?, ?, ?)
+        ON CONFLICT (kind, stock_id, payload) DO UPDATE SET
+            status = 'pending', attempts = 0, max_attempts = excluded.max_attempts,
+            available_at = excluded.available_at, last_error = NULL, updated_at = excluded.updated_at
+        WHERE status IN ('done', 'failed')
+    """, [(kind, stock_id, payload, max_attempts, now, now) for kind, stock_id, payload in jobs])
+    added = conn.total_changes - before
+
+    conn.commit()
+    conn.close()
+
+    return added
+
+def lease_job(owner, lease_seconds, kinds=None):
+    """
+    領取一個可執行的工作（待執行且已到重試時間，或租約已過期），並標記租約
+
+    :return: JOB_COLUMNS 順序的 tuple，沒有工作時回傳 None
+    """
+    conn = _connect_immediate()
+    cursor = conn.cursor()
+
+    now = time.time()
+    query = f"""
+        SELECT {", ".join(JOB_COLUMNS)} FROM jobs
+        WHERE ((status = 'pending' AND available_at <= ?) OR (status = 'leased' AND lease_until < ?))
+    """
+    params = [now, now]
+    if kinds:
+        kinds = list(kinds)
+        query += f" AND kind IN ({', '.join('?' * len(kinds))})"
+        params.extend(kinds)
+    cursor.execute(query + " ORDER BY available_at, id LIMIT 1", params)
+    row = cursor.fetchone()
+
+    if row is not None:
+        cursor.execute("""
+            UPDATE jobs SET status = 'leased', lease_owner = ?, lease_until = ?, attempts = attempts + 1, updated_at = ?
+            WHERE id = ?
+        """, (owner, now + lease_seconds, now, row[0]))
+    conn.execute("COMMIT")
+    conn.close()
+
+    return row
+
+def renew_lease(job_id, owner, lease_seconds):
+    """
+    延長租約到 lease_seconds 秒後
+
+    :return: 是否仍持有租約（已被其他 worker 接手時為 False）
+    """
+    conn = sqlite3.connect(DB_PATH, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+
+    now = time.time()
+    cursor.execute("""
+        UPDATE jobs SET lease_until = ?, updated_at = ?
+        WHERE id = ? AND status = 'leased' AND lease_owner = ?
+    """, (now + lease_seconds, now, job_id, owner))
+    renewed = cursor.rowcount > 0
+
+    conn.commit()
+    conn.close()
+    return renewed
+
+def ack_job(job_id, owner):
+    """
+    標記工作完成（租約已被其他 worker 接手時不處理）
+
+    :return: 是否仍持有租約並已標記完成
+    """
+    conn = sqlite3.connect(DB_PATH, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+
+    cursor.execute("""
+        UPDATE jobs SET status = 'done', lease_owner = NULL, lease_until = NULL, last_error = NULL, updated_at = ?
+        WHERE id = ? AND lease_owner = ?
+    """, (time.time(), job_id, owner))
+    acked = cursor.rowcount > 0
+
+    conn.commit()
+    conn.close()
+    return acked
+
+def fail_job(job_id, owner, error, retry_delay):
+    """
+    記錄失敗；未達最大嘗試次數時於 retry_delay 秒後重新排入，否則標記為 failed
+
+    :return: 新的狀態 'pending'（會重試）或 'failed'；租約已被其他 worker 接手時為 None
+    """
+    conn = _connect_immediate()
+    cursor = conn.cursor()
+
+    now = time.time()
+    cursor.execute("SELECT attempts, max_attempts FROM jobs WHERE id = ? AND lease_owner = ?", (job_id, owner))
+    row = cursor.fetchone()
+    status = None
+    if row is not None:
+        status = "pending" if row[0] < row[1] else "failed"
+        cursor.execute("""
+            UPDATE jobs SET status = ?, available_at = ?, lease_owner = NULL, lease_until = NULL,
+                            last_error = ?, updated_at = ?
+            WHERE id = ?
+        """, (status, now + retry_delay, error, now, job_id))
+    conn.execute("COMMIT")
+    conn.close()
+
+    return status
+
+def retry_failed_jobs(kinds=None):
+    """將 failed 的工作重新排入（嘗試次數歸零）"""
+    conn = sqlite3.connect(DB_PATH, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+
+    query = "UPDATE jobs SET status = 'pending', attempts = 0, available_at = ?, updated_at = ? WHERE status = 'failed'"
+    params = [time.time(), time.time()]
+    if kinds:
+        kinds = list(kinds)
+        query += f" AND kind IN ({', '.join('?' * len(kinds))})"
+        params.extend(kinds)
+    cursor.execute(query, params)
+    count = cursor.rowcount
+
+    conn.commit()
+    conn.close()
+
+    return count
+
+def count_jobs():
+    """回傳 {(kind, status): 數量}"""
+    conn = sqlite3.connect(DB_PATH, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+
+    cursor.execute("SELECT kind, status, COUNT(*) FROM jobs GROUP BY kind, status")
+    counts = {(kind, status): count for kind, status, count in cursor.fetchall()}
+    conn.close()
+
+    return counts
+
+def take_rate_token(name, rate, burst):
+    """
+    由共用的 token bucket 取得一個額度
+
+    :param rate: 每秒補充的額度
+    :param burst: 最多累積的額度
+    :return: 0 表示已取得，否則為需要等待的秒數
+    """
+    conn = _connect_immediate()
+    cursor = conn.cursor()
+
+    now = time.time()
+    cursor.execute("SELECT tokens, updated_at FROM rate_limits WHERE name = ?", (name,))
+    row = cursor.fetchone()
+    tokens = burst if row is None else min(burst, row[0] + (now - row[1]) * rate)
+
+    wait = 0.0
+    if tokens >= 1:
+        tokens -= 1
+    else:
+        wait = (1 - tokens) / rate
+    cursor.execute("INSERT OR REPLACE INTO rate_limits (name, tokens, updated_at) VALUES (?, ?, ?)",
+                   (name, tokens, now))
+    conn.execute("COMMIT")
+    conn.close()
+
+    return wait
+
+
+WATCH_COLUMNS = ["chat_id", "stock_id", "band", "target", "last_side", "created_at"]
+
+def save_watch_subscription(chat_id, stock_id, band, target, last_side, created_at):
+    """新增或更新一筆價格區間提醒訂閱"""
+    conn = sqlite3.connect(DB_PATH, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+
+    cursor.execute(f"""
+        INSERT OR REPLACE INTO watch_subscriptions ({", ".join(WATCH_COLUMNS)})
+        VALUES ({", ".join("?" * len(WATCH_COLUMNS))})
+    """, (chat_id, stock_id, band, target, last_side, created_at))
+
+    conn.commit()
+    conn.close()
+
+def delete_watch_subscriptions(chat_id, stock_id, band=None):
+    """刪除訂閱，band 為 None 時刪除該股票的全部訂閱；回傳刪除筆數"""
+    conn = sqlite3.connect(DB_PATH, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+
+    if band is None:
+        cursor.execute("DELETE FROM watch_subscriptions WHERE chat_id = ? AND stock_id = ?", (chat_id, stock_id))
+    else:
+        cursor.execute("DELETE FROM watch_subscriptions WHERE chat_id = ? AND stock_id = ? AND band = ?",
+                       (chat_id, stock_id, band))
+    count = cursor.rowcount
+
+    conn.commit()
+    conn.close()
+
+    return count
+
+def load_watch_subscriptions():
+    """讀取全部訂閱（欄位順序同 WATCH_COLUMNS）"""
+    conn = sqlite3.connect(DB_PATH, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+
+    cursor.execute(f"SELECT {', '.join(WATCH_COLUMNS)} FROM watch_subscriptions")
+    rows = cursor.fetchall()
+    conn.close()
+
+    return rows
+
+def update_watch_sides(sides):
+    """
+    批次更新門檻的目前側別（同一個 (stock_id, band, target) 的所有訂閱一起更新）
+
+    :param sides: [(last_side, stock_id, band, target), ...]
+    """
+    conn = sqlite3.connect(DB_PATH, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+
+    cursor.executemany("""
+        UPDATE watch_subscriptions SET last_side = ? WHERE stock_id = ? AND band = ? AND target = ?
+    """, sides)
+
+    conn.commit()
+    conn.close()
+
+
+NEGATIVE_CACHE_COLUMNS = ["stock_id", "dataset", "reason", "failures", "first_seen", "last_checked", "recheck_at"]
+
+def save_negative_entries(entries):
+    """批次寫入查無資料的快取 (以 (stock_id, dataset) 為鍵，欄位順序同 NEGATIVE_CACHE_COLUMNS)"""
+    conn = sqlite3.connect(DB_PATH, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+
+    cursor.executemany(f"""
+        INSERT OR REPLACE INTO negative_cache ({", ".join(NEGATIVE_CACHE_COLUMNS)})
+        VALUES ({", ".join("?" * len(NEGATIVE_CACHE_COLUMNS))})
+    """, entries)
+
+    conn.commit()
+    conn.close()
+
+def load_negative_entries(dataset, stock_ids=None):
+    """讀取該資料集的查無資料快取，可限定股票"""
+    conn = sqlite3.connect(DB_PATH, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+
+    query = f"SELECT {', '.join(NEGATIVE_CACHE_COLUMNS)} FROM negative_cache WHERE dataset = ?"
+    params = [dataset]
+    if stock_ids is not None:
+        stock_ids = list(stock_ids)
+        query += f" AND stock_id IN ({', '.join('?' * len(stock_ids))})"
+        params.extend(stock_ids)
+    cursor.execute(query, params)
+    rows = cursor.fetchall()
+    conn.close()
+
+    return rows
+
+def delete_negative_entries(dataset, stock_ids):
+    """移除已取得資料的股票"""
+    conn = sqlite3.connect(DB_PATH, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+
+    cursor.executemany("DELETE FROM negative_cache WHERE stock_id = ? AND dataset = ?",
+                       [(stock_id, dataset) for stock_id in stock_ids])
+
+    conn.commit()
+    conn.close()
+
+
+FORECAST_COLUMNS = ["stock_id", "metric", "horizon", "quarter", "model", "forecast", "mae", "fitted_at"]
+
+def replace_forecasts(forecasts, stock_ids=None):
+    """
+    以新一次預測取代舊預測 (欄位順序同 FORECAST_COLUMNS)，讀取端不會看到一半新一半舊的結果；
+    stock_ids 為 None 時取代全部，否則只取代這些股票的預測
+    """
+    conn = sqlite3.connect(DB_PATH, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+
+    if stock_ids is None:
+        cursor.execute("DELETE FROM fundamental_forecasts")
+    else:
+        stock_ids = list(stock_ids)
+        placeholders = ", ".join("?" * len(stock_ids))
+        cursor.execute(f"DELETE FROM fundamental_forecasts WHERE stock_id IN ({placeholders})", stock_ids)
+    cursor.executemany(f"""
+        INSERT INTO fundamental_forecasts ({", ".join(FORECAST_COLUMNS)})
+        VALUES ({", ".join("?" * len(FORECAST_COLUMNS))})
+    """, forecasts)
+
+    conn.commit()
+    conn.close()
+
+def load_forecasts(stock_ids=None):
+    """讀取基本面預測，stock_ids 為 None 時讀取全部"""
+    conn = sqlite3.connect(DB_PATH, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+
+    query = f"SELECT {', '.join(FORECAST_COLUMNS)} FROM fundamental_forecasts"
+    if stock_ids is None:
+        cursor.execute(query + " ORDER BY stock_id, metric, horizon")
+    else:
+        stock_ids = list(stock_ids)
+        placeholders = ", ".join("?" * len(stock_ids))
+        cursor.execute(query + f" WHERE stock_id IN ({placeholders}) ORDER BY stock_id, metric, horizon", stock_ids)
+    rows = cursor.fetchall()
+    conn.close()
+
+    return rows
+
+
+INDUSTRY_VALUATION_COLUMNS = ["industry", "quarter", "metric", "n", "p10", "p25", "p50", "p75", "p90", "built_at"]
+INDUSTRY_PERCENTILE_COLUMNS = ["stock_id", "quarter", "industry", "per", "pbr", "roe", "per_pct", "pbr_pct", "roe_pct"]
+
+def replace_industry_cube(distributions, percentiles):
+    """
+    以新建立的產業估值取代全部資料 (欄位順序同 INDUSTRY_VALUATION_COLUMNS / INDUSTRY_PERCENTILE_COLUMNS)，
+    兩張表在同一個交易內更新，讀取端不會看到分布與百分位不一致
+    """
+    conn = sqlite3.connect(DB_PATH, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+
+    cursor.execute("DELETE FROM industry_valuation")
+    cursor.executemany(f"""
+        INSERT INTO industry_valuation ({", ".join(INDUSTRY_VALUATION_COLUMNS)})
+        VALUES ({", ".join("?" * len(INDUSTRY_VALUATION_COLUMNS))})
+    """, distributions)
+    cursor.execute("DELETE FROM industry_percentiles")
+    cursor.executemany(f"""
+        INSERT INTO industry_percentiles ({", ".join(INDUSTRY_PERCENTILE_COLUMNS)})
+        VALUES ({", ".join("?" * len(INDUSTRY_PERCENTILE_COLUMNS))})
+    """, percentiles)
+
+    conn.commit()
+    conn.close()
+
+def load_latest_industry_percentiles(stock_ids=None):
+    """讀取每支股票最新一季的產業百分位，stock_ids 為 None 時讀取全部"""
+    conn = sqlite3.connect(DB_PATH, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+
+    query = f"""
+        SELECT {", ".join(f"p.{column}" for column in INDUSTRY_PERCENTILE_COLUMNS)}
+        FROM industry_percentiles p
+        JOIN (SELECT stock_id, MAX(quarter) AS quarter FROM industry_percentiles GROUP BY stock_id) latest
+          ON p.stock_id = latest.stock_id AND p.quarter = latest.quarter
+    """
+    if stock_ids is None:
+        cursor.execute(query + " ORDER BY p.stock_id")
+    else:
+        stock_ids = list(stock_ids)
+        placeholders = ", ".join("?" * len(stock_ids))
+        cursor.execute(query + f" WHERE p.stock_id IN ({placeholders}) ORDER BY p.stock_id", stock_ids)
+    rows = cursor.fetchall()
+    conn.close()
+
+    return rows
+
+def load_industry_valuation(industry=None, quarter=None):
+    """讀取產業估值分布，可依產業與季度篩選"""
+    conn = sqlite3.connect(DB_PATH, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+
+    conditions, params = [], []
+    if industry is not None:
+        conditions.append("industry = ?")
+        params.append(industry)
+    if quarter is not None:
+        conditions.append("quarter = ?")
+        params.append(quarter)
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    cursor.execute(f"SELECT {', '.join(INDUSTRY_VALUATION_COLUMNS)} FROM industry_valuation{where}"
+                   " ORDER BY industry, quarter, metric", params)
+    rows = cursor.fetchall()
+    conn.close()
+
+    return rows
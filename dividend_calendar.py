@@ -0,0 +1,266 @@
+import argparse
+import io
+import logging
+import os
+import re
+import time
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from price_table import load_prices
+
+logger = logging.getLogger(__name__)
+
+DIVIDEND_CSV_FILE = "all_stock_dividends.csv"
+DEFAULT_DAYS = 7
+MAX_DAYS = 365
+
+# 日期索引種類 → 配息資料的日期欄位
+DATE_COLUMNS = {
+    "cash_ex": "CashExDividendTradingDate",  # 除息交易日
+    "stock_ex": "StockExDividendTradingDate",  # 除權交易日
+    "payment": "CashDividendPaymentDate",  # 現金股利發放日
+}
+KIND_LABELS = {"cash_ex": "除息", "stock_ex": "除權", "payment": "發放"}
+# /exdiv 的查詢種類 → 使用的日期索引
+QUERY_KINDS = {"ex": ["cash_ex", "stock_ex"], "cash": ["cash_ex"], "stock": ["stock_ex"], "pay": ["payment"]}
+
+_CONDITION_PATTERN = re.compile(r"^(?:yield|殖利率)(?P<op>>=|>)(?P<value>\d+(?:\.\d+)?)%?$", re.IGNORECASE)
+
+
+class CalendarError(ValueError):
+    """/exdiv 參數格式錯誤"""
+
+
+class _DateIndex:
+    """單一日期欄位的排序索引：區間查詢只需兩次二分搜尋與一次切片"""
+
+    def __init__(self):
+        self.dates = np.empty(0, dtype="datetime64[D]")
+        self.rows = np.empty(0, dtype=np.int64)
+
+    def insert(self, dates: np.ndarray, rows: np.ndarray) -> None:
+        """插入新的 (日期, 列號)；只排序新資料，再以二分搜尋找出插入位置"""
+        valid = ~np.isnat(dates)
+        dates, rows = dates[valid], rows[valid]
+        if len(dates) == 0:
+            return
+        order = np.argsort(dates, kind="stable")
+        dates, rows = dates[order], rows[order]
+        positions = np.searchsorted(self.dates, dates, side="right")
+        self.dates = np.insert(self.dates, positions, dates)
+        self.rows = np.insert(self.rows, positions, rows)
+
+    def between(self, start: np.datetime64, end: np.datetime64) -> Tuple[np.ndarray, np.ndarray]:
+        """start <= 日期 <= end 的 (日期, 列號)，依日期排序"""
+        lo = np.searchsorted(self.dates, start, side="left")
+        hi = np.searchsorted(self.dates, end, side="right")
+        return self.dates[lo:hi], self.rows[lo:hi]
+
+
+class DividendCalendar:
+    """
+    all_stock_dividends.csv 的除權息與發放日行事曆。
+
+    CSV 只會被追加寫入，refresh() 依檔案大小只讀取新增的列並插入既有的排序索引；
+    檔案被整份改寫（變小或換了 inode）時才重建。
+    """
+
+    def __init__(self, csv_file: str = DIVIDEND_CSV_FILE):
+        self.csv_file = csv_file
+        self._reset()
+
+    def _reset(self) -> None:
+        # 配息資料以欄位陣列保存，索引中的列號指向這些陣列
+        self.records: Dict[str, np.ndarray] = {
+            "stock_id": np.empty(0, dtype=object),
+            "year": np.empty(0, dtype=object),
+            "cash": np.empty(0, dtype="float64"),
+            "stock": np.empty(0, dtype="float64"),
+        }
+        self.indexes: Dict[str, _DateIndex] = {kind: _DateIndex() for kind in DATE_COLUMNS}
+        self._keys = set()
+        self._columns: Optional[List[str]] = None
+        self._offset = 0
+        self._inode: Optional[int] = None
+
+    def __len__(self) -> int:
+        return len(self.records["stock_id"])
+
+    def refresh(self) -> int:
+        """
+        讀取上次之後追加的配息資料
+
+        :return: 新增的配息筆數
+        """
+        try:
+            stat = os.stat(self.csv_file)
+        except FileNotFoundError:
+            self._reset()
+            return 0
+        if stat.st_ino != self._inode or stat.st_size < self._offset:
+            if self._inode is not None:
+                logger.info(f"{self.csv_file} 已被改寫，重建配息行事曆")
+            self._reset()
+            self._inode = stat.st_ino
+        if stat.st_size == self._offset:
+            return 0
+
+        with open(self.csv_file, "rb") as f:
+            f.seek(self._offset)
+            chunk = f.read(stat.st_size - self._offset)
+        # 只處理完整的列，寫到一半的列留到下次
+        end = chunk.rfind(b"\n") + 1
+        if end == 0:
+            return 0
+        text = chunk[:end].decode("utf-8-sig")
+        self._offset += end
+
+        if self._columns is None:
+            header, _, text = text.partition("\n")
+            self._columns = list(pd.read_csv(io.StringIO(header), nrows=0).columns)
+        if not text.strip():
+            return 0
+        new = pd.read_csv(io.StringIO(text), header=None, names=self._columns, dtype=str)
+        return self._append(new)
+
+    def _append(self, new: pd.DataFrame) -> int:
+        def number(*columns: str) -> np.ndarray:
+            total = np.zeros(len(new))
+            for column in columns:
+                if column in new.columns:
+                    total += pd.to_numeric(new[column], errors="coerce").fillna(0.0).to_numpy()
+            return total
+
+        stock_ids = new["stock_id"].astype(str).to_numpy(dtype=object)
+        cash = number("CashEarningsDistribution", "CashStatutorySurplus")
+        stock = number("StockEarningsDistribution", "StockStatutorySurplus")
+        dates = {
+            kind: pd.to_datetime(new[column], errors="coerce", format="%Y-%m-%d").to_numpy("datetime64[D]")
+            if column in new.columns else np.full(len(new), np.datetime64("NaT"), dtype="datetime64[D]")
+            for kind, column in DATE_COLUMNS.items()
+        }
+
+        # 同一次配息可能在多個公告日各有一筆，以 (代號, 各日期, 股利) 去重
+        keep = np.zeros(len(new), dtype=bool)
+        # NaT 彼此不相等，以整數表示日期才能比對
+        day_numbers = [kind_dates.view("int64") for kind_dates in dates.values()]
+        for i, key in enumerate(zip(stock_ids, *day_numbers, cash, stock)):
+            if key not in self._keys:
+                self._keys.add(key)
+                keep[i] = True
+        if not keep.any():
+            return 0
+
+        rows = np.arange(len(self), len(self) + int(keep.sum()))
+        for kind, kind_dates in dates.items():
+            self.indexes[kind].insert(kind_dates[keep], rows)
+        additions = {
+            "stock_id": stock_ids[keep],
+            "year": new["year"].to_numpy(dtype=object)[keep] if "year" in new.columns else np.full(len(rows), None),
+            "cash": cash[keep],
+            "stock": stock[keep],
+        }
+        self.records = {column: np.concatenate([self.records[column], additions[column]]) for column in self.records}
+        return len(rows)
+
+    def between(self, start: date, end: date, kinds: List[str]) -> pd.DataFrame:
+        """
+        :param kinds: DATE_COLUMNS 的種類
+        :return: 日期介於 [start, end] 的事件（date, kind, stock_id, year, cash, stock），依日期排序
+        """
+        slices = [(kind, *self.indexes[kind].between(np.datetime64(start, "D"), np.datetime64(end, "D")))
+                  for kind in kinds]
+        dates = np.concatenate([dates for _, dates, _ in slices])
+        rows = np.concatenate([rows for _, _, rows in slices])
+        labels = np.concatenate([np.full(len(dates), kind, dtype=object) for kind, dates, _ in slices])
+        if len(slices) > 1:
+            order = np.argsort(dates, kind="stable")
+            dates, rows, labels = dates[order], rows[order], labels[order]
+        return pd.DataFrame({
+            "date": dates,
+            "kind": labels,
+            **{column: values[rows] for column, values in self.records.items()},
+        })
+
+
+_calendars: Dict[str, DividendCalendar] = {}
+
+
+def load_calendar(csv_file: str = DIVIDEND_CSV_FILE) -> DividendCalendar:
+    """取得配息行事曆，並載入上次之後追加的配息資料"""
+    if csv_file not in _calendars:
+        _calendars[csv_file] = DividendCalendar(csv_file)
+    calendar = _calendars[csv_file]
+    started = time.perf_counter()
+    added = calendar.refresh()
+    if added:
+        logger.info(f"配息行事曆新增 {added} 筆，耗時 {(time.perf_counter() - started) * 1000:.1f} ms")
+    return calendar
+
+
+def parse_exdiv_args(args: List[str]) -> Tuple[int, Optional[float], str, bool]:
+    """
+    解析 /exdiv 參數，例如：14 yield>5 cash
+
+    :return: (未來天數, 最低現金殖利率, 查詢種類, 是否不含最低殖利率本身)；yield>5 不含 5%，yield>=5 含 5%
+    """
+    days, min_yield, kind, strict = DEFAULT_DAYS, None, "ex", False
+    for arg in args:
+        match = _CONDITION_PATTERN.match(arg)
+        if match:
+            min_yield = float(match.group("value"))
+            strict = match.group("op") == ">"
+        elif arg.isdigit():
+            days = int(arg)
+            if not 0 < days <= MAX_DAYS:
+                raise CalendarError(f"天數需介於 1 ~ {MAX_DAYS}")
+        elif arg.lower() in QUERY_KINDS:
+            kind = arg.lower()
+        else:
+            raise CalendarError(f"無法解析參數：{arg}")
+    return days, min_yield, kind, strict
+
+
+def upcoming(days: int = DEFAULT_DAYS, min_yield: Optional[float] = None, kind: str = "ex",
+             start: Optional[date] = None, csv_file: str = DIVIDEND_CSV_FILE, strict: bool = False) -> pd.DataFrame:
+    """
+    未來 days 天內（含今天）的除權息或發放事件，附股價表中的最新股價與現金殖利率
+
+    :param min_yield: 只保留現金殖利率 (%) 不低於此值的事件
+    :param strict: 為 True 時只保留現金殖利率高於 min_yield 的事件（不含等於）
+    :return: 欄位 date, kind, stock_id, year, cash, stock, price, cash_yield
+    """
+    start = start or date.today()
+    events = load_calendar(csv_file).between(start, start + timedelta(days=days - 1), QUERY_KINDS[kind])
+    if events.empty:
+        return events.assign(price=pd.Series(dtype=float), cash_yield=pd.Series(dtype=float))
+
+    prices = load_prices(events["stock_id"].unique())
+    events["price"] = events["stock_id"].map(prices).astype(float)
+    events["cash_yield"] = (events["cash"] / events["price"].where(events["price"] > 0)) * 100
+    if min_yield is not None:
+        passed = events["cash_yield"] > min_yield if strict else events["cash_yield"] >= min_yield
+        events = events[passed].reset_index(drop=True)
+    return events
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        level=logging.INFO,
+    )
+    parser = argparse.ArgumentParser(description="除權息與股利發放行事曆")
+    parser.add_argument("args", nargs="*", help="同 /exdiv 參數，例如：14 yield>5 cash")
+    parser.add_argument("--start", type=date.fromisoformat, help="起始日期（預設今天）")
+    parser.add_argument("--csv", default=DIVIDEND_CSV_FILE)
+    cli_args = parser.parse_args()
+
+    days, min_yield, kind, strict = parse_exdiv_args(cli_args.args)
+    started = time.perf_counter()
+    result = upcoming(days, min_yield, kind, cli_args.start, cli_args.csv, strict)
+    print(result.to_string(index=False) if len(result) else "沒有符合條件的事件")
+    print(f"查詢耗時 {(time.perf_counter() - started) * 1000:.2f} ms")
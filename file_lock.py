@@ -0,0 +1,16 @@
+import fcntl
+from contextlib import contextmanager
+
+
+@contextmanager
+def locked(path: str):
+    """
+    以 <path>.lock 的 flock 排他鎖保護檔案，
+    多個程序同時追加同一個 CSV 時不會交錯寫入或重複寫表頭。
+    """
+    with open(f"{path}.lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
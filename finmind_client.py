@@ -0,0 +1,270 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+import aiohttp
+import pandas as pd
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+FINMIND_API_KEY = os.getenv("FINMIND_API_KEY")
+FINMIND_URL = "https://api.finmindtrade.com/api/v4/data"
+
+
+class FinMindAPIError(Exception):
+    """FinMind API 回傳非 200 狀態碼"""
+
+    def __init__(self, status: int, message: str = ""):
+        super().__init__(f"FinMind API 請求失敗，狀態碼：{status} {message}".strip())
+        self.status = status
+
+
+def build_parameter(dataset: str, data_id: Optional[str] = None,
+                    start_date: Optional[str] = None, end_date: Optional[str] = None) -> Dict:
+    """組合 FinMind API 查詢參數（未指定 data_id 時查詢全市場）"""
+    parameter = {"dataset": dataset, "token": FINMIND_API_KEY}
+    if data_id is not None:
+        parameter["data_id"] = data_id
+    if start_date is not None:
+        parameter["start_date"] = start_date
+    if end_date is not None:
+        parameter["end_date"] = end_date
+    return parameter
+
+
+# 相同查詢的合併：進行中的請求由後到的呼叫者共用，完成後 SINGLE_FLIGHT_GRACE 秒內直接沿用結果
+SINGLE_FLIGHT_GRACE = float(os.getenv("FINMIND_SINGLE_FLIGHT_GRACE", "2"))
+
+RequestKey = Tuple[str, Optional[str], Optional[str], Optional[str]]
+_in_flight: Dict[RequestKey, asyncio.Future] = {}
+_recent: Dict[RequestKey, Tuple[float, List[Dict]]] = {}
+coalesce_stats = {"requests": 0, "coalesced": 0}
+
+
+async def fetch_dataset(dataset: str, data_id: Optional[str] = None,
+                        start_date: Optional[str] = None, end_date: Optional[str] = None,
+                        session: Optional[aiohttp.ClientSession] = None) -> List[Dict]:
+    """
+    查詢 FinMind 資料集。
+    同時進行的相同查詢 (dataset, data_id, start_date, end_date) 只送出一次請求，
+    回傳的 list 為共用物件，呼叫端不應修改。
+
+    :param dataset: 資料集名稱 (如 TaiwanStockPER)
+    :param data_id: 股票代碼，None 表示查詢全市場
+    :param start_date: 起始日期 (YYYY-MM-DD)
+    :param end_date: 結束日期 (YYYY-MM-DD)
+    :param session: 可共用的 aiohttp session，None 時自行建立
+    :return: 資料列 (list of dict)，沒有資料時回傳空 list
+    :raises FinMindAPIError: HTTP 狀態碼不是 200
+    """
+    key = (dataset, data_id, start_date, end_date)
+    coalesce_stats["requests"] += 1
+
+    recent = _recent.get(key)
+    if recent is not None:
+        if time.monotonic() - recent[0] <= SINGLE_FLIGHT_GRACE:
+            coalesce_stats["coalesced"] += 1
+            return recent[1]
+        del _recent[key]
+
+    future = _in_flight.get(key)
+    if future is not None:
+        coalesce_stats["coalesced"] += 1
+        return await asyncio.shield(future)
+
+    future = asyncio.ensure_future(_fetch(build_parameter(dataset, data_id, start_date, end_date), session))
+    _in_flight[key] = future
+    future.add_done_callback(lambda done: _finish(key, done))
+    return await asyncio.shield(future)
+
+
+def _finish(key: RequestKey, future: asyncio.Future) -> None:
+    """請求完成：成功的結果保留一段時間，失敗不保留（下一次呼叫重新請求）"""
+    _in_flight.pop(key, None)
+    if not future.cancelled() and future.exception() is None and SINGLE_FLIGHT_GRACE > 0:
+        now = time.monotonic()
+        # 順便清除過期的結果
+        for expired in [k for k, (finished, _) in _recent.items() if now - finished > SINGLE_FLIGHT_GRACE]:
+            del _recent[expired]
+        _recent[key] = (now, future.result())
+
+
+# FinMind 每個 token 每小時的請求上限，以及額度用完 (402) 或過於頻繁 (429) 的狀態碼
+HOURLY_QUOTA = int(os.getenv("FINMIND_HOURLY_QUOTA", "600"))
+QUOTA_WINDOW = 3600
+QUOTA_STATUSES = (402, 429)
+QUOTA_PROBE_INTERVAL = 300  # 額度計數與 API 不一致時，最多暫停這麼久再試探一次
+MAX_QUOTA_RETRIES = 24
+
+
+class RateController:
+    """
+    所有 FinMind 請求共用的速率控制：
+    - 記錄目前額度視窗（整點起算的一小時）已使用的請求數，用完時暫停到下一個視窗再繼續
+    - 同時請求數以 AIMD 調整：回應正常時每次 +1/limit，延遲過高時 ×0.7，收到 402/429 時減半並暫停
+    """
+
+    def __init__(self, hourly_quota: int = HOURLY_QUOTA, initial_limit: float = 4, min_limit: float = 1,
+                 max_limit: float = 16, target_latency: float = 3.0, window: int = QUOTA_WINDOW):
+        self.hourly_quota = hourly_quota
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency = target_latency
+        self.window = window
+        self.window_start = self._current_window()
+        self.used = 0
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._condition: Optional[asyncio.Condition] = None
+        self._loop = None
+        self._announced = None
+
+    def set_max_limit(self, max_limit: float) -> None:
+        """調整同時請求數上限，目前的 limit 超過上限時一併降低"""
+        self.max_limit = max_limit
+        self.limit = min(self.limit, max_limit)
+
+    def _current_window(self) -> float:
+        return time.time() // self.window * self.window
+
+    def _get_condition(self) -> asyncio.Condition:
+        # asyncio 物件綁定 event loop，每個 asyncio.run() 重新建立
+        loop = asyncio.get_running_loop()
+        if self._condition is None or self._loop is not loop:
+            self._condition = asyncio.Condition()
+            self._loop = loop
+            self.in_flight = 0
+        return self._condition
+
+    def _wait_time(self) -> float:
+        now = time.time()
+        window = self._current_window()
+        if window != self.window_start:
+            self.window_start = window
+            self.used = 0
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.used >= self.hourly_quota:
+            return self.window_start + self.window - now
+        return 0.0
+
+    async def acquire(self) -> None:
+        """等待可用的額度與同時請求數"""
+        condition = self._get_condition()
+        async with condition:
+            while True:
+                wait = self._wait_time()
+                if wait > 0:
+                    # 同一次暫停只記錄一次
+                    pause = (self.window_start, self.paused_until)
+                    if self._announced != pause:
+                        self._announced = pause
+                        logger.warning(f"FinMind 請求額度已用完（本小時 {self.used} 次），暫停 {wait:.0f} 秒後繼續")
+                    try:
+                        await asyncio.wait_for(condition.wait(), timeout=wait)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                if self.in_flight < max(int(self.limit), 1):
+                    break
+                await condition.wait()
+            self.in_flight += 1
+            self.used += 1
+
+    async def release(self, latency: float, status: int) -> None:
+        """
+        :param latency: 請求耗時（秒）
+        :param status: HTTP 狀態碼，連線錯誤為 0
+        """
+        condition = self._get_condition()
+        async with condition:
+            self.in_flight = max(self.in_flight - 1, 0)
+            if status in QUOTA_STATUSES:
+                self.limit = max(self.min_limit, self.limit / 2)
+                window_end = self.window_start + self.window
+                self.paused_until = time.time() + min(max(window_end - time.time(), 1), QUOTA_PROBE_INTERVAL)
+            elif status != 200 or latency > self.target_latency:
+                self.limit = max(self.min_limit, self.limit * 0.7)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            condition.notify_all()
+
+    def status(self) -> Dict:
+        return {"used": self.used, "quota": self.hourly_quota, "limit": round(self.limit, 2),
+                "in_flight": self.in_flight, "paused_until": self.paused_until}
+
+
+rate_controller = RateController()
+
+
+async def _fetch(parameter: Dict, session: Optional[aiohttp.ClientSession]) -> List[Dict]:
+    """經過 rate_controller 送出請求；額度用完時暫停後重試，不當成失敗"""
+    for attempt in range(MAX_QUOTA_RETRIES + 1):
+        await rate_controller.acquire()
+        started = time.monotonic()
+        status = 0
+        try:
+            if session is None or session.closed:
+                async with aiohttp.ClientSession() as own_session:
+                    rows = await _get(own_session, parameter)
+            else:
+                rows = await _get(session, parameter)
+            status = 200
+            return rows
+        except FinMindAPIError as e:
+            status = e.status
+            if status in QUOTA_STATUSES and attempt < MAX_QUOTA_RETRIES:
+                logger.warning(f"FinMind 回應 {status}（額度限制），暫停後重試 {parameter.get('dataset')} {parameter.get('data_id', '')}")
+                continue
+            raise
+        finally:
+            await rate_controller.release(time.monotonic() - started, status)
+
+
+async def _get(session: aiohttp.ClientSession, parameter: Dict) -> List[Dict]:
+    async with session.get(FINMIND_URL, params=parameter) as response:
+        if response.status != 200:
+            raise FinMindAPIError(response.status)
+        data = await response.json()
+        if "data" in data and isinstance(data["data"], list):
+            return data["data"]
+        return []
+
+
+async def get_taiwan_stock_list(session: Optional[aiohttp.ClientSession] = None) -> List[str]:
+    """從 FinMind API 獲取台股代號列表（經由 fetch_dataset，與其他請求共用速率控制與額度）"""
+    try:
+        rows = await fetch_dataset("TaiwanStockInfo", session=session)
+        if not rows:
+            logger.error("無法從 FinMind API 獲取股票列表")
+            return []
+
+        # 轉換為 DataFrame
+        df_stocks = pd.DataFrame(rows)
+
+        # 確保 stock_id 欄位為字串；同一代號可能出現多次（不同產業別），保留原順序去重
+        df_stocks["stock_id"] = df_stocks["stock_id"].astype(str)
+        df_stocks = df_stocks.drop_duplicates("stock_id")
+
+        # 過濾掉非上市股票（通常股票代碼長度為 4 位）
+        df_stocks = df_stocks[df_stocks["stock_id"].str.len() == 4]
+
+        # 過濾掉特殊股票（如權證、期貨等）
+        df_stocks = df_stocks[~df_stocks["stock_id"].str.startswith(('0', '9'))]
+
+        # 添加日誌記錄
+        logger.info(f"從 API 獲取的股票總數：{len(df_stocks)}")
+        logger.info(f"股票代碼範圍：{df_stocks['stock_id'].min()} 到 {df_stocks['stock_id'].max()}")
+
+        stock_list = df_stocks["stock_id"].tolist()
+        logger.info(f"成功獲取 {len(stock_list)} 支上市股票")
+        return stock_list
+
+    except Exception as e:
+        logger.error(f"獲取股票列表時發生錯誤: {str(e)}")
+        return []
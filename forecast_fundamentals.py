@@ -0,0 +1,237 @@
+import argparse
+import logging
+import time
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from utilsforecast.evaluation import evaluate
+from utilsforecast.losses import mae, smape
+
+from dbHelper import FORECAST_COLUMNS, init_db, load_forecasts, replace_forecasts
+from profiler import profiled
+from quarterly_rollup import load_rollups, quarterly_estimates
+
+logger = logging.getLogger(__name__)
+
+# 預測的指標 → quarterly_estimates 的欄位
+METRICS = {"ROE": "ROE", "EPS": "推估EPS"}
+HORIZON = 4  # 預測未來 4 季；同時作為回測保留的季數
+SEASON_LENGTH = 4
+MIN_QUARTERS = 8  # 至少需要的季數（含回測保留的季度）
+MAX_STALE_QUARTERS = 4  # 最新數據距今超過一年的股票不預測
+SES_ALPHAS = np.arange(0.1, 1.0, 0.1)
+
+MODELS = ["Naive", "SeasonalNaive", "HistoricAverage", "WindowAverage", "Drift", "SES"]
+
+
+def build_panel(estimates: pd.DataFrame, column: str) -> pd.DataFrame:
+    """
+    將季度估值轉為 股票 × 季度 的矩陣，中間缺少的季度沿用前一季的值；
+    最後一次觀測之後的季度維持 NaN，不會把舊值延伸成新的觀測
+
+    :return: 以 stock_id 為索引、季度 (Period) 為欄位的 DataFrame
+    """
+    panel = estimates.pivot_table(index="stock_id", columns="quarter", values=column, aggfunc="last")
+    panel = panel.reindex(columns=pd.period_range(panel.columns.min(), panel.columns.max(), freq="Q"))
+
+    counts = panel.notna().sum(axis=1)
+    fresh = panel.iloc[:, -MAX_STALE_QUARTERS:].notna().any(axis=1)
+    return panel[(counts >= MIN_QUARTERS) & fresh].ffill(axis=1, limit_area="inside")
+
+
+def _last_index(values: np.ndarray) -> np.ndarray:
+    """每支股票最後一個非 NaN 值的欄位位置"""
+    return values.shape[1] - 1 - np.argmax(~np.isnan(values[:, ::-1]), axis=1)
+
+
+def _ses(values: np.ndarray, horizon: int) -> np.ndarray:
+    """簡單指數平滑：每支股票各自以一步預測誤差平方和最小的 alpha 擬合"""
+    n, length = values.shape
+    levels = np.full((len(SES_ALPHAS), n), np.nan)
+    sse = np.zeros((len(SES_ALPHAS), n))
+    alphas = SES_ALPHAS[:, None]
+    for t in range(length):
+        y = values[:, t]
+        observed = ~np.isnan(y)
+        started = ~np.isnan(levels)
+        error = np.where(observed & started, y - levels, 0.0)
+        sse += error ** 2
+        levels = np.where(observed & ~started, y, levels + alphas * error)
+    best = np.argmin(sse, axis=0)
+    return np.repeat(levels[best, np.arange(n)][:, None], horizon, axis=1)
+
+
+def fit_predict(values: np.ndarray, horizon: int = HORIZON) -> Dict[str, np.ndarray]:
+    """
+    以整個矩陣一次計算所有股票的各模型預測（不逐支迴圈）
+
+    :param values: 股票 × 季度，開頭（上市較晚）與結尾（尚未公布）可為 NaN，中間已補值
+    :return: {模型名稱: 股票 × horizon 的預測}，各股票從自己最後一個觀測值往後預測
+    """
+    n, length = values.shape
+    rows = np.arange(n)
+    steps = np.arange(1, horizon + 1)
+    columns = np.arange(length)
+    first_index = np.argmax(~np.isnan(values), axis=1)
+    last_index = _last_index(values)
+    first = values[rows, first_index]
+    last = values[rows, last_index]
+    observations = last_index - first_index + 1
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        slope = np.where(observations > 1, (last - first) / (observations - 1), 0.0)
+    seasonal_index = last_index[:, None] - SEASON_LENGTH + 1 + (steps - 1) % SEASON_LENGTH
+    seasonal = np.where(seasonal_index >= first_index[:, None],
+                        values[rows[:, None], np.maximum(seasonal_index, 0)], np.nan)
+    window = np.where(columns > last_index[:, None] - SEASON_LENGTH, values, np.nan)
+    return {
+        "Naive": np.repeat(last[:, None], horizon, axis=1),
+        "SeasonalNaive": np.where(np.isnan(seasonal), last[:, None], seasonal),
+        "HistoricAverage": np.repeat(np.nanmean(values, axis=1)[:, None], horizon, axis=1),
+        "WindowAverage": np.repeat(np.nanmean(window, axis=1)[:, None], horizon, axis=1),
+        "Drift": last[:, None] + slope[:, None] * steps,
+        "SES": _ses(values, horizon),
+    }
+
+
+def _long_frame(panel: pd.DataFrame, positions: np.ndarray, predictions: Dict[str, np.ndarray],
+                actuals: Optional[np.ndarray] = None) -> pd.DataFrame:
+    """
+    轉為 utilsforecast 使用的長表 (unique_id, ds, y, 各模型)
+
+    :param positions: 股票 × horizon，各預測對應的季度欄位位置
+    """
+    quarters = panel.columns[positions.ravel()]
+    frame = pd.DataFrame({
+        "unique_id": np.repeat(panel.index.to_numpy(), positions.shape[1]),
+        "ds": quarters.to_timestamp(how="end").normalize(),
+    })
+    if actuals is not None:
+        frame["y"] = actuals.ravel()
+    for model, values in predictions.items():
+        frame[model] = values.ravel()
+    return frame
+
+
+def select_models(panel: pd.DataFrame, horizon: int = HORIZON) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    每支股票保留自己最後 horizon 個觀測季度回測，選擇 MAE 最小的模型
+
+    :return: (每支股票的 model 與 mae, 回測長表)
+    """
+    values = panel.to_numpy(dtype=float)
+    rows = np.arange(len(values))
+    cutoff = np.maximum(_last_index(values) - horizon + 1, 0)
+    train = np.where(np.arange(values.shape[1]) < cutoff[:, None], values, np.nan)
+    positions = np.minimum(cutoff[:, None] + np.arange(horizon), values.shape[1] - 1)
+    test = values[rows[:, None], positions]
+    holdout = _long_frame(panel, positions, fit_predict(train, horizon), test)
+    holdout = holdout.dropna(subset=["y"])
+
+    scores = evaluate(holdout, metrics=[mae], models=MODELS).set_index("unique_id")[MODELS]
+    scores = scores.dropna(how="all")
+    choice = pd.DataFrame({"model": scores.idxmin(axis=1), "mae": scores.min(axis=1)})
+    return choice.reindex(panel.index).fillna({"model": "HistoricAverage"}), holdout
+
+
+def forecast_metric(estimates: pd.DataFrame, metric: str, horizon: int = HORIZON) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    單一指標的全市場預測
+
+    :return: (長表 stock_id, horizon, quarter, model, forecast, mae；回測長表)
+    """
+    panel = build_panel(estimates, METRICS[metric])
+    if panel.empty:
+        return pd.DataFrame(columns=["stock_id", "horizon", "quarter", "model", "forecast", "mae"]), pd.DataFrame()
+
+    choice, holdout = select_models(panel, horizon)
+    predictions = fit_predict(panel.to_numpy(dtype=float), horizon)
+    model_index = choice["model"].map({model: i for i, model in enumerate(MODELS)}).to_numpy()
+    stacked = np.stack([predictions[model] for model in MODELS])  # 模型 × 股票 × horizon
+    chosen = stacked[model_index, np.arange(len(panel))]
+
+    last_quarters = panel.columns[_last_index(panel.to_numpy(dtype=float))]
+    result = pd.DataFrame({
+        "stock_id": np.repeat(panel.index.to_numpy(), horizon),
+        "horizon": np.tile(np.arange(1, horizon + 1), len(panel)),
+        "forecast": chosen.ravel(),
+        "model": np.repeat(choice["model"].to_numpy(), horizon),
+        "mae": np.repeat(choice["mae"].to_numpy(), horizon),
+    })
+    result["quarter"] = [str(quarter + h) for quarter, h in zip(np.repeat(last_quarters, horizon), result["horizon"])]
+    return result, holdout
+
+
+@profiled("forecast_fundamentals")
+def run_forecasts(horizon: int = HORIZON, stock_ids: Optional[Iterable[str]] = None) -> int:
+    """
+    以全部股票的季度彙總擬合並儲存 ROE 與推估 EPS 的預測
+
+    :return: 預測的股票數
+    """
+    init_db()
+    started = time.perf_counter()
+    stock_ids = None if stock_ids is None else list(stock_ids)
+    estimates = quarterly_estimates(load_rollups(stock_ids))
+    fitted_at = datetime.now().isoformat(timespec="seconds")
+
+    frames = []
+    for metric in METRICS:
+        result, holdout = forecast_metric(estimates, metric, horizon)
+        result["metric"] = metric
+        frames.append(result)
+        if not holdout.empty:
+            overall = evaluate(holdout, metrics=[smape], models=MODELS, agg_fn="mean")
+            logger.info(f"{metric} 回測 sMAPE：" + "、".join(f"{model} {overall[model].iloc[0]:.3f}" for model in MODELS))
+            logger.info(f"{metric} 選用模型：" + "、".join(
+                f"{model} {count}" for model, count in result.drop_duplicates("stock_id")["model"].value_counts().items()))
+
+    forecasts = pd.concat(frames, ignore_index=True)
+    forecasts["fitted_at"] = fitted_at
+    forecasts = forecasts[FORECAST_COLUMNS]
+    replace_forecasts(list(forecasts.astype(object).where(forecasts.notna(), None).itertuples(index=False, name=None)),
+                      stock_ids)
+
+    stock_count = forecasts["stock_id"].nunique()
+    logger.info(f"已預測 {stock_count} 支股票的 {', '.join(METRICS)}，耗時 {time.perf_counter() - started:.2f} 秒")
+    return stock_count
+
+
+def load_forward_estimates(stock_ids: Optional[Iterable[str]] = None, horizon: Optional[int] = None) -> pd.DataFrame:
+    """
+    讀取第 horizon 季的預測，None 時取各股票最遠一季（run_forecasts 可用 --horizon 改變預測季數）
+
+    :return: 以 stock_id 為索引，欄位 roe_forecast, eps_forecast, eps_mae, eps_model, quarter, fitted_at
+    """
+    init_db()
+    forecasts = pd.DataFrame(load_forecasts(stock_ids), columns=FORECAST_COLUMNS)
+    if horizon is None:
+        horizon = forecasts.groupby(["stock_id", "metric"])["horizon"].transform("max")
+    forecasts = forecasts[forecasts["horizon"] == horizon]
+    if forecasts.empty:
+        return pd.DataFrame()
+    wide = forecasts.pivot(index="stock_id", columns="metric")
+    forward = pd.DataFrame(index=wide.index)
+    if "ROE" in wide["forecast"]:
+        forward["roe_forecast"] = wide["forecast"]["ROE"]
+    if "EPS" in wide["forecast"]:
+        forward["eps_forecast"] = wide["forecast"]["EPS"]
+        forward["eps_mae"] = wide["mae"]["EPS"]
+        forward["eps_model"] = wide["model"]["EPS"]
+        forward["quarter"] = wide["quarter"]["EPS"]
+        forward["fitted_at"] = wide["fitted_at"]["EPS"]
+    return forward
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        level=logging.INFO,
+    )
+    parser = argparse.ArgumentParser(description="以本機統計模型批次預測全市場季度 ROE 與 EPS")
+    parser.add_argument("--horizon", type=int, default=HORIZON, help="預測季數")
+    parser.add_argument("--stocks", nargs="+", help="只預測指定股票（預設全部）")
+    args = parser.parse_args()
+    run_forecasts(args.horizon, args.stocks)
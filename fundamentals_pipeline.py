@@ -0,0 +1,110 @@
+import argparse
+import logging
+import os
+
+import pandas as pd
+
+from profiler import profiled
+from stock_list_loader import load_stock_list_csv
+
+logger = logging.getLogger(__name__)
+
+PER_CSV_FILE = "StockListPer.csv"
+FINANCE_CSV_FILE = "StockList.csv"
+OUTPUT_CSV_FILE = "Calculated_Stock_Values.csv"
+FINGERPRINT_FILE = "Calculated_Stock_Values.fingerprint.csv"
+
+# 由輸入欄位計算出的欄位
+DERIVED_COLUMNS = ["計算EPS", "最低合理股價", "平均合理股價", "最高合理股價"]
+
+
+def atomic_write_csv(df: pd.DataFrame, path: str) -> None:
+    """先寫入暫存檔再以 os.replace 置換，讀取端不會看到寫到一半的檔案"""
+    tmp_path = f"{path}.tmp"
+    df.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+def load_joined_inputs(per_csv: str = PER_CSV_FILE, finance_csv: str = FINANCE_CSV_FILE) -> pd.DataFrame:
+    """合併 StockListPer（本益比）與 StockList（財報），並整理成輸出欄位順序"""
+    df_per = load_stock_list_csv(per_csv)
+    df_finance = load_stock_list_csv(finance_csv)
+    df = pd.merge(df_per, df_finance, on="代號", how="inner")
+
+    # 移除 "排名" 欄位（如果存在）
+    if "排名" in df.columns:
+        df = df.drop(columns=["排名"])
+
+    # 名稱、成交優先使用 _x，若無則使用 _y
+    df["名稱"] = df["名稱_x"].fillna(df["名稱_y"])
+    df["成交"] = df["成交_x"].fillna(df["成交_y"])
+    return df.drop(columns=["名稱_x", "名稱_y", "成交_x", "成交_y"])
+
+
+def compute_fair_prices(df: pd.DataFrame) -> pd.DataFrame:
+    """計算 EPS（根據 PBR 和股價）與合理股價範圍"""
+    result = pd.DataFrame(index=df.index)
+    result["計算EPS"] = df["平均ROE(%)"] * (df["成交"] / df["目前PBR"]) / 100
+    result["最低合理股價"] = (result["計算EPS"] * df["平均最低PER"]).round(2)
+    result["平均合理股價"] = (result["計算EPS"] * df["平均PER"]).round(2)
+    result["最高合理股價"] = (result["計算EPS"] * df["平均最高PER"]).round(2)
+    return result
+
+
+def row_fingerprints(df: pd.DataFrame) -> pd.Series:
+    """以整列輸入欄位計算每列的雜湊值"""
+    return pd.util.hash_pandas_object(df, index=False).astype("uint64")
+
+
+def _load_previous(output_csv: str, fingerprint_file: str):
+    if not (os.path.exists(output_csv) and os.path.exists(fingerprint_file)):
+        return None, None
+    previous = pd.read_csv(output_csv, dtype={"代號": str}, float_precision="round_trip")
+    fingerprints = pd.read_csv(fingerprint_file, dtype={"代號": str, "fingerprint": "uint64"})
+    return previous.set_index("代號"), fingerprints.set_index("代號")["fingerprint"]
+
+
+@profiled("fundamentals_pipeline")
+def run_pipeline(full: bool = False, per_csv: str = PER_CSV_FILE, finance_csv: str = FINANCE_CSV_FILE,
+                 output_csv: str = OUTPUT_CSV_FILE, fingerprint_file: str = FINGERPRINT_FILE) -> int:
+    """
+    產生 Calculated_Stock_Values.csv，只重新計算輸入有變動的列。
+
+    :param full: 忽略上次的指紋，全部重新計算
+    :return: 本次重新計算的列數
+    """
+    df = load_joined_inputs(per_csv, finance_csv)
+    fingerprints = row_fingerprints(df)
+
+    previous, previous_fingerprints = (None, None) if full else _load_previous(output_csv, fingerprint_file)
+    if previous is None:
+        changed = pd.Series(True, index=df.index)
+    else:
+        old = df["代號"].map(previous_fingerprints)
+        changed = old.isna() | (old != fingerprints)
+        removed = len(previous_fingerprints) - (~changed).sum()
+        if not changed.any() and removed == 0:
+            logger.info("輸入資料沒有變動，略過計算")
+            return 0
+
+    derived = pd.DataFrame(index=df.index, columns=DERIVED_COLUMNS, dtype="float64")
+    if previous is not None and (~changed).any():
+        derived.loc[~changed] = previous.loc[df.loc[~changed, "代號"], DERIVED_COLUMNS].to_numpy()
+    derived.loc[changed] = compute_fair_prices(df.loc[changed])
+
+    atomic_write_csv(pd.concat([df, derived], axis=1), output_csv)
+    atomic_write_csv(pd.DataFrame({"代號": df["代號"], "fingerprint": fingerprints}), fingerprint_file)
+
+    logger.info(f"已更新 {output_csv}：共 {len(df)} 筆，重新計算 {int(changed.sum())} 筆")
+    return int(changed.sum())
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        level=logging.INFO,
+    )
+    parser = argparse.ArgumentParser(description="合併 StockListPer 與 StockList 並計算合理股價")
+    parser.add_argument("--full", action="store_true", help="忽略上次的指紋，全部重新計算")
+    args = parser.parse_args()
+    run_pipeline(full=args.full)
@@ -2,7 +2,11 @@ import requests
 import pandas as pd
 import unittest
 import json
-from dbHelper import save_stock_list, load_stock_list, init_db
+import sys
+import time
+from datetime import datetime, timedelta
+from dbHelper import save_stock_list, load_stock_list, init_db, save_financial_reports, load_financial_report_dates
+from profiler import profiled
 
 
 def fetch_stock_data(date: str, stock_no: str):
@@ -27,10 +31,6 @@ def fetch_stock_data(date: str, stock_no: str):
 
     data = response.json()
 
-    # 🔹 Debug: 印出 API 回應內容
-    print("🔍 API 回應內容:")
-    print(json.dumps(data, indent=4, ensure_ascii=False))  # 讓 JSON 更易讀
-    
     if "data" not in data or not data["data"]:
         print("⚠️ 找不到符合條件的資料")
         return None
@@ -82,6 +82,92 @@ def fetch_latest_financial_report(stock_no: str, year: int, month: int):
     return first_new_financial_report.to_frame().T  # 回傳 DataFrame (單筆)
 
 
+def _to_float(value):
+    """將 TWSE 的數字字串 (如 "1,234.5"、"-") 轉為 float，無效值回傳 None"""
+    try:
+        return float(str(value).replace(",", "").strip())
+    except ValueError:
+        return None
+
+
+def fetch_all_stock_bwibbu(date: str):
+    """
+    取得指定日期全部上市股票的殖利率、本益比、股價淨值比 (一次請求)
+
+    :param date: 查詢日期 (格式: YYYYMMDD)
+    :return: financial_reports 的資料列 list，非交易日回傳空 list，請求失敗回傳 None
+    """
+    url = f"https://www.twse.com.tw/rwd/zh/afterTrading/BWIBBU_d?date={date}&selectType=ALL&response=json"
+    headers = {"User-Agent": "Mozilla/5.0"}
+
+    response = requests.get(url, headers=headers)
+
+    if response.status_code != 200:
+        print(f"⚠️ 無法取得 {date} 的資料，HTTP 狀態碼: {response.status_code}")
+        return None
+
+    data = response.json()
+
+    if data.get("stat") != "OK" or not data.get("data"):
+        return []
+
+    # 依欄位名稱取值（不同年份的欄位順序與數量不同）
+    fields = data["fields"]
+    date_iso = datetime.strptime(date, "%Y%m%d").strftime("%Y-%m-%d")
+    reports = []
+    for values in data["data"]:
+        row = dict(zip(fields, values))
+        reports.append((
+            str(row.get("證券代號", "")).strip(),
+            date_iso,
+            json.dumps(row, ensure_ascii=False),
+            row.get("證券名稱"),
+            _to_float(row.get("收盤價")),
+            _to_float(row.get("殖利率(%)")),
+            row.get("股利年度"),
+            _to_float(row.get("本益比")),
+            _to_float(row.get("股價淨值比")),
+            row.get("財報年/季"),
+        ))
+
+    return reports
+
+
+def ingest_bwibbu(start_date: str, end_date: str = None, delay: float = 3.0):
+    """
+    逐日下載全市場 BWIBBU 資料並批次寫入 financial_reports，已存在的日期會略過
+
+    :param start_date: 起始日期 (格式: YYYYMMDD)
+    :param end_date: 結束日期 (格式: YYYYMMDD)，預設與起始日期相同
+    :param delay: 每次請求間隔秒數 (TWSE 有請求頻率限制)
+    :return: 寫入的總筆數
+    """
+    init_db()
+    start = datetime.strptime(start_date, "%Y%m%d")
+    end = datetime.strptime(end_date or start_date, "%Y%m%d")
+    stored_dates = load_financial_report_dates()
+
+    total = 0
+    days = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+    for day in days:
+        # 略過週末與已寫入的日期
+        if day.weekday() >= 5 or day.strftime("%Y-%m-%d") in stored_dates:
+            continue
+
+        date_str = day.strftime("%Y%m%d")
+        reports = fetch_all_stock_bwibbu(date_str)
+        if reports:
+            save_financial_reports(reports)
+            total += len(reports)
+            print(f"✅ {date_str} 寫入 {len(reports)} 筆")
+        elif reports is not None:
+            print(f"📭 {date_str} 沒有資料（非交易日）")
+
+        time.sleep(delay)
+
+    return total
+
+
 def calculate_roe(financial_data):
     """
     計算 ROE (Return on Equity) 每一季數據
@@ -132,7 +218,8 @@ def fetch_stock_list():
     return stock_list
 
 
-if __name__ == "__main__":
+@profiled("getStockInfo")
+def main():
     init_db()  # 確保資料庫初始化
     stock_list = fetch_stock_list()
 
@@ -140,3 +227,13 @@ if __name__ == "__main__":
         print("\n📊 股票列表:")
         for stock in stock_list[:10]:  # 只顯示前 10 檔
             print(stock)
+
+
+if __name__ == "__main__":
+    # python getStockInfo.py bwibbu <起始日期 YYYYMMDD> [結束日期 YYYYMMDD]
+    if len(sys.argv) >= 3 and sys.argv[1] == "bwibbu":
+        total = profiled("getStockInfo_bwibbu")(ingest_bwibbu)(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)
+        print(f"✅ 共寫入 {total} 筆個股殖利率/本益比/股價淨值比資料")
+    else:
+        main()
+
@@ -1,57 +1,203 @@
-import requests
-import pandas as pd
-import time
-from dotenv import load_dotenv
+import argparse
+import asyncio
+import json
+import logging
 import os
+from datetime import date, datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+import aiohttp
+import pandas as pd
+
+from file_lock import locked
+from finmind_client import fetch_dataset, rate_controller
+from profiler import profiled
 
-load_dotenv()
-FINMIND_API_KEY = os.getenv("FINMIND_API_KEY")
+logger = logging.getLogger(__name__)
 
-url = "https://api.finmindtrade.com/api/v4/data"
-parameter = {
-    "dataset": "TaiwanStockInfo",
-    "token": FINMIND_API_KEY,
-}
-resp = requests.get(url, params=parameter)
-data = resp.json()
-stock_list = pd.DataFrame(data["data"])["stock_id"].tolist()
+OUTPUT_CSV = "all_stock_dividends.csv"
+STATE_FILE = "dividend_download_state.json"
 
 # 設定查詢區間
 START_DATE = "2019-01-01"
+MAX_CONCURRENT_REQUESTS = 5  # rate_controller 同時請求數的上限（實際值依延遲與額度自動調整）
 
-# 儲存所有股票的配息資料
-all_dividends = []
+DIVIDEND_COLUMNS = [
+    "date", "stock_id", "year", "StockEarningsDistribution", "StockStatutorySurplus",
+    "StockExDividendTradingDate", "TotalEmployeeStockDividend", "TotalEmployeeStockDividendAmount",
+    "RatioOfEmployeeStockDividendOfTotal", "RatioOfEmployeeStockDividend", "CashEarningsDistribution",
+    "CashStatutorySurplus", "CashExDividendTradingDate", "CashDividendPaymentDate",
+    "TotalEmployeeCashDividend", "TotalNumberOfCashCapitalIncrease", "CashIncreaseSubscriptionRate",
+    "CashIncreaseSubscriptionpRrice", "RemunerationOfDirectorsAndSupervisors",
+    "ParticipateDistributionOfTotalShares", "AnnouncementDate", "AnnouncementTime",
+]
 
-# 遍歷 stock_list，依序查詢每個股票的配息資料
-for stock_id in stock_list:
-    try:
-        parameter = {
-            "dataset": "TaiwanStockDividend",
-            "data_id": stock_id,
-            "start_date": START_DATE,
-            "token": FINMIND_API_KEY,
-        }
 
-        response = requests.get(url, params=parameter)
-        data = response.json()
+def load_state() -> Dict:
+    """讀取下載狀態（已完成、失敗清單與上次完成日期）"""
+    if os.path.exists(STATE_FILE):
+        try:
+            with open(STATE_FILE, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            logger.error(f"讀取下載狀態時發生錯誤: {str(e)}")
+    return {"run": None, "last_completed": None}
+
+
+def save_state(state: Dict) -> None:
+    """先寫入暫存檔再置換，避免中斷時留下損毀的狀態檔"""
+    tmp_file = STATE_FILE + ".tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_file, STATE_FILE)
+
+
+def load_existing_keys() -> Set[Tuple[str, str]]:
+    """讀取 CSV 中已存在的 (stock_id, date)，避免重複寫入"""
+    if not os.path.exists(OUTPUT_CSV):
+        return set()
+    existing = pd.read_csv(OUTPUT_CSV, usecols=["stock_id", "date"], dtype=str)
+    return set(zip(existing["stock_id"], existing["date"]))
+
+
+class DividendWriter:
+    """每支股票的資料一取得就追加寫入 CSV，程式中斷也不會遺失已下載的部分"""
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.existing_keys = load_existing_keys()
+        self.written = 0
+
+    async def write(self, rows: List[Dict]) -> int:
+        df = pd.DataFrame(rows).reindex(columns=DIVIDEND_COLUMNS)
+        df["stock_id"] = df["stock_id"].astype(str)
+        keys = list(zip(df["stock_id"], df["date"].astype(str)))
+
+        async with self.lock:
+            mask = [key not in self.existing_keys for key in keys]
+            df = df[mask]
+            if df.empty:
+                return 0
+            with locked(OUTPUT_CSV):
+                header = not os.path.exists(OUTPUT_CSV)
+                df.to_csv(OUTPUT_CSV, mode="a", header=header, index=False)
+            self.existing_keys.update(key for key, new in zip(keys, mask) if new)
+            self.written += len(df)
+            return len(df)
+
 
-        # 確保 API 回傳正確的資料
-        if "data" in data and isinstance(data["data"], list) and len(data["data"]) > 0:
-            df = pd.DataFrame(data["data"])
-            all_dividends.append(df)
+async def get_stock_list(session: aiohttp.ClientSession) -> List[str]:
+    rows = await fetch_dataset("TaiwanStockInfo", session=session)
+    # TaiwanStockInfo 同一代號可能出現多次（不同產業別），保留原順序去重
+    return list(dict.fromkeys(str(row["stock_id"]) for row in rows))
 
-        # 防止 API 過載，增加間隔時間
-        time.sleep(1)
 
+async def download_stock(session: aiohttp.ClientSession, writer: DividendWriter, state: Dict,
+                         done: Set[str], stock_id: str, start_date: str) -> None:
+    """:param done: run["done"] 的集合，用於判斷是否已記錄（重試時同一支股票不重複加入）"""
+    run = state["run"]
+    try:
+        rows = await fetch_dataset("TaiwanStockDividend", data_id=stock_id,
+                                   start_date=start_date, session=session)
+        if rows:
+            written = await writer.write(rows)
+            logger.info(f"股票 {stock_id} 取得 {len(rows)} 筆配息資料，寫入 {written} 筆")
+        run["failed"].pop(stock_id, None)
+        if stock_id not in done:
+            done.add(stock_id)
+            run["done"].append(stock_id)
     except Exception as e:
-        # print(f"查詢 {stock_id} 失敗: {e}")
-        pass
-
-# 合併所有配息資料
-if all_dividends:
-    final_df = pd.concat(all_dividends, ignore_index=True)
-    final_df.to_csv("all_stock_dividends.csv", index=False)
-    # print("所有股票的配息資料已儲存為 all_stock_dividends.csv")
-else:
-    # print("沒有獲取到任何配息資料")
-    pass
\ No newline at end of file
+        logger.error(f"查詢 {stock_id} 失敗: {str(e)}")
+        run["failed"][stock_id] = str(e) or type(e).__name__
+
+    # 每完成 20 支股票保存一次狀態
+    if (len(run["done"]) + len(run["failed"])) % 20 == 0:
+        save_state(state)
+
+
+async def download_market_since(session: aiohttp.ClientSession, writer: DividendWriter,
+                                start_date: str) -> Optional[int]:
+    """不帶 data_id 查詢全市場配息資料；API 不支援時回傳 None"""
+    try:
+        rows = await fetch_dataset("TaiwanStockDividend", start_date=start_date,
+                                   end_date=date.today().strftime("%Y-%m-%d"), session=session)
+    except Exception as e:
+        logger.warning(f"全市場配息查詢失敗，改為逐檔查詢: {str(e)}")
+        return None
+    return await writer.write(rows) if rows else 0
+
+
+@profiled("get_finMind_stock", per_task=False)  # 工作由 gather 的子任務執行，需記錄整個事件迴圈
+async def main(incremental: bool = False, retry_failed: bool = False, restart: bool = False,
+               concurrency: int = MAX_CONCURRENT_REQUESTS) -> None:
+    state = load_state()
+    writer = DividendWriter()
+    today = date.today().strftime("%Y-%m-%d")
+
+    async with aiohttp.ClientSession() as session:
+        if incremental and state.get("last_completed"):
+            # 增量模式：只查詢上次完成之後公告的配息資料
+            start_date = state["last_completed"]
+            written = await download_market_since(session, writer, start_date)
+            if written is not None:
+                state["last_completed"] = today
+                save_state(state)
+                logger.info(f"增量更新完成，自 {start_date} 起新增 {written} 筆配息資料")
+                return
+        else:
+            start_date = START_DATE
+
+        run = state.get("run")
+        if retry_failed:
+            if not run or not run["failed"]:
+                logger.info("沒有需要重試的股票")
+                return
+            stock_list = list(run["failed"])
+            start_date = run["start_date"]
+        elif run and not run.get("completed") and not restart:
+            # 斷點續傳：略過上次已完成的股票
+            done = set(run["done"])
+            stock_list = [s for s in run["stock_list"] if s not in done]
+            start_date = run["start_date"]
+            logger.info(f"從上次中斷處繼續，已完成 {len(run['done'])} 支，剩餘 {len(stock_list)} 支")
+        else:
+            stock_list = await get_stock_list(session)
+            run = {
+                "stock_list": stock_list,
+                "start_date": start_date,
+                "started_at": datetime.now().isoformat(),
+                "done": [],
+                "failed": {},
+                "completed": False,
+            }
+            state["run"] = run
+            save_state(state)
+
+        # 同時請求數由 rate_controller 依延遲與額度調整，concurrency 為其上限
+        rate_controller.set_max_limit(concurrency)
+        done = set(run["done"])
+        await asyncio.gather(*(
+            download_stock(session, writer, state, done, stock_id, start_date)
+            for stock_id in stock_list
+        ))
+
+    run["completed"] = not run["failed"]
+    if run["completed"]:
+        state["last_completed"] = run["started_at"][:10]
+    save_state(state)
+    logger.info(f"下載結束，新增 {writer.written} 筆配息資料，失敗 {len(run['failed'])} 支"
+                f"（可使用 --retry-failed 重試）")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        level=logging.INFO,
+    )
+    parser = argparse.ArgumentParser(description="下載全部股票的 TaiwanStockDividend 配息資料")
+    parser.add_argument("--incremental", action="store_true", help="只查詢上次完成後公告的配息資料")
+    parser.add_argument("--retry-failed", action="store_true", help="只重試上次失敗的股票")
+    parser.add_argument("--restart", action="store_true", help="忽略未完成的進度，重新開始")
+    parser.add_argument("--concurrency", type=int, default=MAX_CONCURRENT_REQUESTS, help="同時請求數上限")
+    args = parser.parse_args()
+    asyncio.run(main(args.incremental, args.retry_failed, args.restart, args.concurrency))
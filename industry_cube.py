@@ -0,0 +1,149 @@
+import argparse
+import logging
+import time
+from datetime import datetime
+from typing import Iterable, List, Optional, Tuple
+
+import pandas as pd
+
+from dbHelper import (INDUSTRY_PERCENTILE_COLUMNS, INDUSTRY_VALUATION_COLUMNS, init_db,
+                      load_industry_valuation, load_latest_industry_percentiles, load_stock_list,
+                      replace_industry_cube)
+from profiler import profiled
+from quarterly_rollup import load_rollups, quarterly_estimates
+
+logger = logging.getLogger(__name__)
+
+# 產業估值的指標 → quarterly_estimates 的欄位
+METRICS = {"PER": "PER", "PBR": "PBR", "ROE": "ROE"}
+QUANTILES = {"p10": 0.1, "p25": 0.25, "p50": 0.5, "p75": 0.75, "p90": 0.9}
+MIN_PEERS = 5  # 同產業同季少於此數量的股票時不計算百分位
+UNCLASSIFIED = {"", "None", "nan", "-"}
+
+
+def load_industries() -> pd.Series:
+    """
+    stock_list 表中的產業分類
+
+    :return: 以 stock_id 為索引的產業名稱
+    """
+    rows = load_stock_list() or []
+    stock_list = pd.DataFrame(rows, columns=["stock_id", "name", "industry", "market"])
+    stock_list["stock_id"] = stock_list["stock_id"].astype(str).str.strip()
+    stock_list["industry"] = stock_list["industry"].astype(str).str.strip()
+    stock_list = stock_list[~stock_list["industry"].isin(UNCLASSIFIED)]
+    return stock_list.drop_duplicates("stock_id").set_index("stock_id")["industry"]
+
+
+def build_cube(estimates: pd.DataFrame, industries: pd.Series) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    以一次 groupby 計算每個 (產業, 季度, 指標) 的分布，以及每支股票在同產業同季內的百分位；
+    PER <= 0（虧損）沒有意義，不列入 PER 的分布與排名
+
+    :param estimates: quarterly_estimates 的季度估值
+    :param industries: 以 stock_id 為索引的產業名稱
+    :return: (分布 DataFrame, 百分位 DataFrame)，欄位同 INDUSTRY_VALUATION_COLUMNS / INDUSTRY_PERCENTILE_COLUMNS（不含 built_at）
+    """
+    df = estimates[["stock_id", "quarter", *METRICS.values()]].copy()
+    df["industry"] = df["stock_id"].map(industries)
+    df = df.dropna(subset=["industry"])
+    df["quarter"] = df["quarter"].astype(str)
+    df = df.rename(columns={column: metric for metric, column in METRICS.items()})
+    metrics = list(METRICS)
+    ranked = df[["industry", "quarter", *metrics]].copy()
+    ranked["PER"] = ranked["PER"].where(ranked["PER"] > 0)
+
+    # 分布：長表後依 (產業, 季度, 指標) 一次計算分位數
+    long = ranked.melt(id_vars=["industry", "quarter"], value_vars=metrics, var_name="metric").dropna(subset=["value"])
+    grouped = long.groupby(["industry", "quarter", "metric"])["value"]
+    distributions = grouped.quantile(list(QUANTILES.values())).unstack()
+    distributions.columns = list(QUANTILES)
+    distributions.insert(0, "n", grouped.size())
+    distributions = distributions.reset_index()
+
+    # 百分位：同產業同季內的排名百分比（0~100，數值越大排名越高）
+    peers = ranked.groupby(["industry", "quarter"])[metrics]
+    ranks = peers.rank(pct=True) * 100
+    counts = peers.transform("count")
+    percentiles = df[["stock_id", "quarter", "industry", *metrics]].copy()
+    for metric in metrics:
+        percentiles[f"{metric.lower()}_pct"] = ranks[metric].where(counts[metric] >= MIN_PEERS)
+    percentiles = percentiles.rename(columns={metric: metric.lower() for metric in metrics})
+    return distributions, percentiles[INDUSTRY_PERCENTILE_COLUMNS]
+
+
+def _records(df: pd.DataFrame) -> List[tuple]:
+    return list(df.astype(object).where(df.notna(), None).itertuples(index=False, name=None))
+
+
+@profiled("industry_cube")
+def build_industry_cube() -> int:
+    """
+    以全部股票的季度彙總與 stock_list 的產業分類重建產業相對估值
+
+    :return: 有產業百分位的股票數
+    """
+    init_db()
+    started = time.perf_counter()
+    industries = load_industries()
+    if industries.empty:
+        logger.warning("stock_list 沒有產業分類，請先執行 getStockInfo.py")
+        return 0
+
+    estimates = quarterly_estimates(load_rollups())
+    distributions, percentiles = build_cube(estimates, industries)
+    distributions["built_at"] = datetime.now().isoformat(timespec="seconds")
+    replace_industry_cube(_records(distributions[INDUSTRY_VALUATION_COLUMNS]), _records(percentiles))
+
+    stock_count = percentiles["stock_id"].nunique()
+    logger.info(f"已建立 {distributions['industry'].nunique()} 個產業、{distributions['quarter'].nunique()} 季的估值分布，"
+                f"{stock_count} 支股票，耗時 {time.perf_counter() - started:.2f} 秒")
+    return stock_count
+
+
+def load_relative(stock_ids: Optional[Iterable[str]] = None) -> pd.DataFrame:
+    """
+    讀取每支股票最新一季的產業百分位與產業中位數
+
+    :return: 以 stock_id 為索引，欄位 industry, quarter, per, pbr, roe, per_pct, pbr_pct, roe_pct,
+             per_median, pbr_median, roe_median
+    """
+    init_db()
+    relative = pd.DataFrame(load_latest_industry_percentiles(stock_ids), columns=INDUSTRY_PERCENTILE_COLUMNS)
+    if relative.empty:
+        return pd.DataFrame()
+
+    medians = pd.DataFrame(load_industry_valuation(), columns=INDUSTRY_VALUATION_COLUMNS)
+    medians = medians.pivot_table(index=["industry", "quarter"], columns="metric", values="p50")
+    medians.columns = [f"{metric.lower()}_median" for metric in medians.columns]
+    relative = relative.join(medians, on=["industry", "quarter"])
+    return relative.set_index("stock_id")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        level=logging.INFO,
+    )
+    parser = argparse.ArgumentParser(description="預先計算各產業、各季的 PER/PBR/ROE 分布與個股產業百分位")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("build", help="重建產業估值")
+    show_parser = subparsers.add_parser("show", help="顯示股票最新一季的產業百分位")
+    show_parser.add_argument("stock_ids", nargs="+")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        build_industry_cube()
+    else:
+        relative = load_relative(args.stock_ids)
+        for stock_id in args.stock_ids:
+            if stock_id not in relative.index:
+                print(f"{stock_id}: 尚無產業百分位")
+                continue
+            row = relative.loc[stock_id]
+            print(f"{stock_id} {row['industry']}（{row['quarter']}）：" + "、".join(
+                f"{metric} {row[metric.lower()]:.2f}（產業中位數 {row[f'{metric.lower()}_median']:.2f}，"
+                f"第 {row[f'{metric.lower()}_pct']:.0f} 百分位）" if pd.notna(row[f"{metric.lower()}_pct"])
+                else f"{metric} {row[metric.lower()]:.2f}（虧損，不列入排名）" if metric == "PER" and row["per"] <= 0
+                else f"{metric} {row[metric.lower()]:.2f}（同業不足 {MIN_PEERS} 家）"
+                for metric in METRICS))
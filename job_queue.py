@@ -0,0 +1,268 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import socket
+from datetime import date
+from typing import Dict, Iterable, List, Optional
+
+import aiohttp
+import pandas as pd
+
+import negative_cache
+import ohlcv_store
+from dbHelper import (JOB_COLUMNS, ack_job, count_jobs, enqueue_jobs, fail_job, init_db,
+                      lease_job, renew_lease, retry_failed_jobs, take_rate_token)
+from finmind_client import fetch_dataset, get_taiwan_stock_list
+from get_finMind_stock import START_DATE as DIVIDEND_START_DATE, DividendWriter
+from profiler import profiled
+from quarterly_rollup import update_rollups
+from roe_data import ROE_CSV_FILE, ROE_START_DATE, append_roe_rows, load_existing_keys
+
+logger = logging.getLogger(__name__)
+
+# 工作種類與預設起始日期
+JOB_KINDS = {
+    "per": ROE_START_DATE,
+    "price": ROE_START_DATE,
+    "dividend": DIVIDEND_START_DATE,
+}
+
+LEASE_SECONDS = 300  # 租約到期未回報的工作視為 worker 已中斷，可被其他 worker 接手
+LEASE_RENEW_INTERVAL = LEASE_SECONDS / 3  # 執行中（含等待 API 額度）定期續約
+MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY = 30  # 第 n 次失敗後等待 RETRY_BASE_DELAY * 2^(n-1) 秒再重試
+RETRY_MAX_DELAY = 3600
+IDLE_SLEEP = 5
+ROLLUP_BATCH = 200  # 累積此數量的股票有新 PER 資料時先更新季度彙總，不必等佇列清空
+
+# 所有 worker（含其他程序）共用的 API 請求速率
+RATE_LIMIT_NAME = "finmind"
+RATE_PER_SECOND = float(os.getenv("JOB_RATE_PER_SECOND", "2"))
+RATE_BURST = float(os.getenv("JOB_RATE_BURST", "5"))
+
+
+def enqueue_universe(kinds: Iterable[str] = tuple(JOB_KINDS), start_date: Optional[str] = None,
+                     stock_list: Optional[List[str]] = None) -> int:
+    """
+    依 get_taiwan_stock_list 的股票清單，為每支股票、每種資料各建立一個工作。
+    已完成或失敗的相同工作會重新排入，尚未完成的不重複加入。
+
+    :param start_date: 起始日期 (YYYY-MM-DD)，None 時使用各種類的預設值
+    :return: 排入的工作數
+    """
+    init_db()
+    stock_list = stock_list if stock_list is not None else asyncio.run(get_taiwan_stock_list())
+    # 查無 PER 資料且尚未到重新檢查時間的股票不排入 per 工作
+    negative_cache.migrate_legacy()
+    no_per_data = negative_cache.blocked_ids("TaiwanStockPER")
+    jobs = []
+    for kind in kinds:
+        payload = json.dumps({"start_date": start_date or JOB_KINDS[kind]})
+        jobs.extend((kind, stock_id, payload) for stock_id in stock_list
+                    if not (kind == "per" and stock_id in no_per_data))
+    added = enqueue_jobs(jobs, MAX_ATTEMPTS)
+    logger.info(f"已排入 {added} 個工作（{len(stock_list)} 支股票 × {', '.join(kinds)}）")
+    return added
+
+
+class LeaseLost(RuntimeError):
+    """租約已被其他 worker 接手"""
+
+
+async def _throttle() -> None:
+    """等待共用 token bucket 的額度"""
+    while True:
+        wait = take_rate_token(RATE_LIMIT_NAME, RATE_PER_SECOND, RATE_BURST)
+        if wait <= 0:
+            return
+        await asyncio.sleep(wait)
+
+
+class IngestWorker:
+    """
+    領取並執行工作；CSV 已存在的鍵在每個程序內只讀取一次。
+    有新 PER 資料的股票先記錄下來，佇列清空（或累積 ROLLUP_BATCH 支）時才一次更新季度彙總，
+    避免每個工作都重新讀取全市場的歷史資料。
+    """
+
+    def __init__(self, session: aiohttp.ClientSession, owner: str):
+        self.session = session
+        self.owner = owner
+        self._per_keys = None
+        self._dividend_writer = None
+        self._pending_rollups: Dict[str, date] = {}  # {stock_id: 新資料的最早日期}
+
+    async def run_per(self, stock_id: str, start_date: str) -> int:
+        rows = await fetch_dataset("TaiwanStockPER", stock_id, start_date,
+                                   date.today().strftime("%Y-%m-%d"), session=self.session)
+        if not rows:
+            negative_cache.record([stock_id], "empty", "TaiwanStockPER")
+            return 0
+        negative_cache.clear([stock_id], "TaiwanStockPER")
+        if self._per_keys is None:
+            self._per_keys = load_existing_keys(ROE_CSV_FILE)
+        df = pd.DataFrame(rows)
+        df["stock_id"] = stock_id
+        # 追加前先找出尚未存在的日期（append_roe_rows 會更新 self._per_keys）
+        dates = pd.to_datetime(df["date"]).dt.strftime("%Y-%m-%d")
+        new_dates = [d for d in dates if stock_id not in self._per_keys.get(d, ())]
+        written = append_roe_rows(df, ROE_CSV_FILE, self._per_keys)
+        if written:
+            since = date.fromisoformat(min(new_dates))
+            self._pending_rollups[stock_id] = min(since, self._pending_rollups.get(stock_id, since))
+            if len(self._pending_rollups) >= ROLLUP_BATCH:
+                self.flush_rollups()
+        return written
+
+    def flush_rollups(self) -> int:
+        """
+        以一次全市場讀取更新所有有新 PER 資料的股票；
+        只重算新資料所在、尚未凍結的季度，保留已凍結季度的收盤價
+
+        :return: 更新的季度筆數
+        """
+        if not self._pending_rollups:
+            return 0
+        pending, self._pending_rollups = self._pending_rollups, {}
+        return update_rollups(min(pending.values()), list(pending))
+
+    async def run_price(self, stock_id: str, start_date: str) -> int:
+        return await ohlcv_store.ensure_range(stock_id, start_date, session=self.session)
+
+    async def run_dividend(self, stock_id: str, start_date: str) -> int:
+        rows = await fetch_dataset("TaiwanStockDividend", data_id=stock_id,
+                                   start_date=start_date, session=self.session)
+        if not rows:
+            return 0
+        if self._dividend_writer is None:
+            self._dividend_writer = DividendWriter()
+        return await self._dividend_writer.write(rows)
+
+    async def run(self, job: Dict) -> int:
+        handler = getattr(self, f"run_{job['kind']}", None)
+        if handler is None:
+            raise ValueError(f"未知的工作種類：{job['kind']}")
+        payload = json.loads(job["payload"] or "{}")
+        await _throttle()
+        return await handler(job["stock_id"], payload.get("start_date", JOB_KINDS[job["kind"]]))
+
+    async def run_leased(self, job: Dict) -> int:
+        """
+        執行工作並每 LEASE_RENEW_INTERVAL 秒續約一次，
+        rate_controller 因 402/429 暫停等待額度時租約也不會過期而被其他 worker 重複執行
+
+        :raises LeaseLost: 續約時發現租約已被接手（工作已取消）
+        """
+        task = asyncio.ensure_future(self.run(job))
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=LEASE_RENEW_INTERVAL)
+            if done:
+                return task.result()
+            if not renew_lease(job["id"], self.owner, LEASE_SECONDS):
+                task.cancel()
+                raise LeaseLost(f"{job['kind']} {job['stock_id']} 的租約已被其他 worker 接手")
+
+    async def loop(self, kinds: Optional[List[str]] = None, forever: bool = False) -> int:
+        """
+        持續領取工作直到佇列清空（forever 時閒置等待新工作）
+
+        :return: 完成的工作數
+        """
+        done = 0
+        while True:
+            row = lease_job(self.owner, LEASE_SECONDS, kinds)
+            if row is None:
+                self.flush_rollups()
+                if not forever:
+                    return done
+                await asyncio.sleep(IDLE_SLEEP)
+                continue
+
+            job = dict(zip(JOB_COLUMNS, row))
+            try:
+                written = await self.run_leased(job)
+            except LeaseLost as e:
+                logger.warning(f"[{self.owner}] {str(e)}，停止執行")
+                continue
+            except Exception as e:
+                attempt = job["attempts"] + 1
+                delay = min(RETRY_BASE_DELAY * 2 ** (attempt - 1), RETRY_MAX_DELAY)
+                status = fail_job(job["id"], self.owner, str(e) or type(e).__name__, delay)
+                if status is None:
+                    logger.warning(f"[{self.owner}] {job['kind']} {job['stock_id']} 失敗: {str(e)}，"
+                                   f"租約已被其他 worker 接手，不記錄失敗")
+                else:
+                    logger.error(f"[{self.owner}] {job['kind']} {job['stock_id']} 第 {attempt} 次失敗: {str(e)}"
+                                 + (f"，{delay} 秒後重試" if status == "pending" else "，已達重試上限"))
+                continue
+
+            if ack_job(job["id"], self.owner):
+                done += 1
+                logger.info(f"[{self.owner}] {job['kind']} {job['stock_id']} 完成，寫入 {written} 筆")
+            else:
+                logger.warning(f"[{self.owner}] {job['kind']} {job['stock_id']} 已寫入 {written} 筆，"
+                               f"但租約已被其他 worker 接手，無法標記完成")
+
+
+@profiled("job_queue", per_task=False)  # 工作由 gather 的子任務執行，需記錄整個事件迴圈
+async def run_worker(kinds: Optional[List[str]] = None, concurrency: int = 2, forever: bool = False) -> int:
+    """
+    在此程序內啟動 concurrency 個 worker；可同時在多個程序或機器（共用資料庫）執行。
+
+    :return: 此程序完成的工作數
+    """
+    init_db()
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    async with aiohttp.ClientSession() as session:
+        results = await asyncio.gather(*(
+            IngestWorker(session, f"{owner}:{i}").loop(kinds, forever)
+            for i in range(concurrency)
+        ))
+    logger.info(f"worker {owner} 結束，共完成 {sum(results)} 個工作")
+    return sum(results)
+
+
+def queue_status() -> Dict[str, Dict[str, int]]:
+    """回傳 {kind: {status: 數量}}"""
+    init_db()
+    status: Dict[str, Dict[str, int]] = {}
+    for (kind, state), count in count_jobs().items():
+        status.setdefault(kind, {})[state] = count
+    return status
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        level=logging.INFO,
+    )
+    parser = argparse.ArgumentParser(description="全市場資料匯入工作佇列")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    enqueue_parser = subparsers.add_parser("enqueue", help="為全部股票建立工作")
+    enqueue_parser.add_argument("--kinds", nargs="+", choices=list(JOB_KINDS), default=list(JOB_KINDS))
+    enqueue_parser.add_argument("--start", help="起始日期 (YYYY-MM-DD)")
+
+    work_parser = subparsers.add_parser("work", help="啟動 worker 執行工作")
+    work_parser.add_argument("--kinds", nargs="+", choices=list(JOB_KINDS))
+    work_parser.add_argument("--concurrency", type=int, default=2, help="此程序內的 worker 數")
+    work_parser.add_argument("--forever", action="store_true", help="佇列清空後繼續等待新工作")
+
+    retry_parser = subparsers.add_parser("retry", help="重新排入已達重試上限的工作")
+    retry_parser.add_argument("--kinds", nargs="+", choices=list(JOB_KINDS))
+
+    subparsers.add_parser("status", help="顯示各種工作的狀態數量")
+    args = parser.parse_args()
+
+    if args.command == "enqueue":
+        enqueue_universe(args.kinds, args.start)
+    elif args.command == "work":
+        asyncio.run(run_worker(args.kinds, args.concurrency, args.forever))
+    elif args.command == "retry":
+        init_db()
+        print(f"已重新排入 {retry_failed_jobs(args.kinds)} 個工作")
+    else:
+        for kind, counts in sorted(queue_status().items()):
+            print(f"{kind}: " + "、".join(f"{state} {count}" for state, count in sorted(counts.items())))
@@ -0,0 +1,126 @@
+import json
+import logging
+import os
+import time
+from collections import Counter
+from typing import Dict, Iterable, Optional, Set
+
+from dbHelper import (NEGATIVE_CACHE_COLUMNS, delete_negative_entries, init_db,
+                      load_negative_entries, save_negative_entries)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DATASET = "TaiwanStockPER"
+LEGACY_FILE = "no_data_stocks.json"
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+# 各原因的 (首次重新檢查間隔, 最長間隔)；連續失敗時間隔加倍
+REASON_TTLS = {
+    "http_error": (HOUR, DAY),       # 非 200 回應，多半是暫時性問題
+    "error": (HOUR, DAY),            # 連線錯誤或例外
+    "empty": (7 * DAY, 90 * DAY),    # API 正常回應但沒有資料（下市、代號無資料）
+    "legacy": (7 * DAY, 90 * DAY),   # 從 no_data_stocks.json 匯入，原因不明
+}
+
+_db_ready = False
+
+
+def _ensure_db() -> None:
+    global _db_ready
+    if not _db_ready:
+        init_db()
+        _db_ready = True
+
+
+def ttl_for(reason: str, failures: int) -> float:
+    """第 failures 次失敗後到下次重新檢查的秒數"""
+    base, cap = REASON_TTLS.get(reason, REASON_TTLS["error"])
+    return min(base * 2 ** max(failures - 1, 0), cap)
+
+
+def record(stock_ids: Iterable[str], reason: str, dataset: str = DEFAULT_DATASET,
+           now: Optional[float] = None) -> None:
+    """
+    記錄查無資料的股票；同一股票再次失敗時累加次數並延長重新檢查間隔
+
+    :param reason: http_error / error / empty
+    """
+    _ensure_db()
+    stock_ids = [str(stock_id) for stock_id in stock_ids]
+    if not stock_ids:
+        return
+    now = now or time.time()
+    existing = {row[0]: dict(zip(NEGATIVE_CACHE_COLUMNS, row)) for row in load_negative_entries(dataset, stock_ids)}
+
+    entries = []
+    for stock_id in stock_ids:
+        previous = existing.get(stock_id)
+        failures = previous["failures"] + 1 if previous else 1
+        first_seen = previous["first_seen"] if previous else now
+        entries.append((stock_id, dataset, reason, failures, first_seen, now, now + ttl_for(reason, failures)))
+    save_negative_entries(entries)
+
+
+def clear(stock_ids: Iterable[str], dataset: str = DEFAULT_DATASET) -> None:
+    """重新檢查取得資料後移除"""
+    _ensure_db()
+    delete_negative_entries(dataset, [str(stock_id) for stock_id in stock_ids])
+
+
+def blocked_ids(dataset: str = DEFAULT_DATASET, now: Optional[float] = None) -> Set[str]:
+    """尚未到重新檢查時間、應略過的股票"""
+    _ensure_db()
+    now = now or time.time()
+    return {row[0] for row in load_negative_entries(dataset) if row[6] > now}
+
+
+def summary(dataset: str = DEFAULT_DATASET, now: Optional[float] = None) -> Dict[str, int]:
+    """各原因的股票數，以及已到重新檢查時間的數量 (due)"""
+    _ensure_db()
+    now = now or time.time()
+    rows = load_negative_entries(dataset)
+    counts = Counter(row[2] for row in rows)
+    counts["due"] = sum(1 for row in rows if row[6] <= now)
+    return dict(counts)
+
+
+def migrate_legacy(json_file: str = LEGACY_FILE, dataset: str = DEFAULT_DATASET) -> int:
+    """
+    匯入舊的永久清單：原因記為 legacy，重新檢查時間平均分散在未來 7 天，
+    避免一次重查上千支股票。匯入後將檔案改名為 .migrated，不會重複匯入。
+
+    :return: 匯入的股票數
+    """
+    if not os.path.exists(json_file):
+        return 0
+    _ensure_db()
+    try:
+        with open(json_file, "r", encoding="utf-8") as f:
+            stock_ids = sorted(set(str(stock_id) for stock_id in json.load(f)))
+    except Exception as e:
+        logger.error(f"讀取 {json_file} 時發生錯誤: {str(e)}")
+        return 0
+
+    now = time.time()
+    existing = {row[0] for row in load_negative_entries(dataset)}
+    spread = REASON_TTLS["legacy"][0]
+    new_ids = [stock_id for stock_id in stock_ids if stock_id not in existing]
+    save_negative_entries([
+        (stock_id, dataset, "legacy", 1, now, now, now + spread * (i + 1) / len(new_ids))
+        for i, stock_id in enumerate(new_ids)
+    ])
+    os.replace(json_file, json_file + ".migrated")
+    logger.info(f"已從 {json_file} 匯入 {len(new_ids)} 支無數據股票，將於 7 天內分批重新檢查")
+    return len(new_ids)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        level=logging.INFO,
+    )
+    migrate_legacy()
+    for reason, count in sorted(summary().items()):
+        print(f"{reason}: {count}")
@@ -0,0 +1,170 @@
+import logging
+from datetime import date, datetime, timedelta
+from typing import Iterable, List, Optional, Tuple, Union
+
+import aiohttp
+import pandas as pd
+
+from dbHelper import (OHLCV_COLUMNS, add_ohlcv_coverage, init_db, load_ohlcv, load_ohlcv_coverage,
+                      save_ohlcv)
+from finmind_client import fetch_dataset
+
+logger = logging.getLogger(__name__)
+
+PRICE_DATASET = "TaiwanStockPrice"
+
+_db_ready = False
+
+DateLike = Union[str, date, datetime, pd.Timestamp]
+Interval = Tuple[date, date]
+
+
+def _ensure_db() -> None:
+    global _db_ready
+    if not _db_ready:
+        init_db()
+        _db_ready = True
+
+
+def _to_date(value: DateLike) -> date:
+    return pd.Timestamp(value).date()
+
+
+def merge_intervals(intervals: Iterable[Interval]) -> List[Interval]:
+    """合併重疊或相鄰（差一天）的日期區間"""
+    merged: List[Interval] = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1] + timedelta(days=1):
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def missing_ranges(coverage: List[Interval], start: date, end: date) -> List[Interval]:
+    """回傳 [start, end] 中尚未被 coverage 涵蓋的區間"""
+    gaps: List[Interval] = []
+    cursor = start
+    for covered_start, covered_end in merge_intervals(coverage):
+        if covered_end < cursor:
+            continue
+        if covered_start > end:
+            break
+        if covered_start > cursor:
+            gaps.append((cursor, covered_start - timedelta(days=1)))
+        cursor = max(cursor, covered_end + timedelta(days=1))
+    if cursor <= end:
+        gaps.append((cursor, end))
+    return gaps
+
+
+def _merge_iso(intervals: Iterable[Tuple[str, str]]) -> List[Tuple[str, str]]:
+    """合併資料庫中 YYYY-MM-DD 字串的區間"""
+    merged = merge_intervals((_to_date(start), _to_date(end)) for start, end in intervals)
+    return [(start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d")) for start, end in merged]
+
+
+def coverage(stock_id: str) -> List[Interval]:
+    """該股票已下載的日期區間"""
+    _ensure_db()
+    return [(_to_date(start), _to_date(end)) for start, end in load_ohlcv_coverage(stock_id)]
+
+
+def _rows(records: List[dict], stock_id: str) -> List[tuple]:
+    rows = []
+    for record in records:
+        record = {**record, "stock_id": str(record.get("stock_id", stock_id))}
+        rows.append(tuple(record.get(column) for column in OHLCV_COLUMNS))
+    return rows
+
+
+async def ensure_range(stock_id: str, start: DateLike, end: Optional[DateLike] = None,
+                       session: Optional[aiohttp.ClientSession] = None) -> int:
+    """
+    確保 [start, end] 的日 K 線已存在本機，只向 API 查詢缺少的區間。
+    今天的資料可能尚未收盤，只寫入資料但不標記為已涵蓋，下次會重新查詢。
+
+    :param end: 結束日期，預設為今天
+    :return: 本次寫入的筆數
+    :raises FinMindAPIError: API 請求失敗（已取得的區間仍會保存）
+    """
+    _ensure_db()
+    stock_id = str(stock_id)
+    today = date.today()
+    start = _to_date(start)
+    end = min(_to_date(end), today) if end is not None else today
+
+    covered = coverage(stock_id)
+    added: List[Interval] = []
+    written = 0
+    try:
+        for gap_start, gap_end in missing_ranges(covered, start, end):
+            records = await fetch_dataset(
+                PRICE_DATASET, stock_id,
+                gap_start.strftime("%Y-%m-%d"), gap_end.strftime("%Y-%m-%d"),
+                session=session,
+            )
+            if records:
+                save_ohlcv(_rows(records, stock_id))
+                written += len(records)
+
+            final_end = min(gap_end, today - timedelta(days=1))
+            if gap_start <= final_end:
+                added.append((gap_start, final_end))
+    finally:
+        # 只寫入本次新增的區間，於資料庫交易內與其他 worker 的紀錄合併
+        if added:
+            add_ohlcv_coverage(stock_id, [(s.strftime("%Y-%m-%d"), e.strftime("%Y-%m-%d")) for s, e in added],
+                               _merge_iso)
+
+    if written:
+        logger.info(f"股票 {stock_id} 新增 {written} 筆日 K 線")
+    return written
+
+
+def load_prices(stock_ids: Optional[Iterable[str]] = None, start: Optional[DateLike] = None,
+                end: Optional[DateLike] = None, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """只從本機讀取日 K 線（不查詢 API），date 為 datetime"""
+    _ensure_db()
+    columns = columns or OHLCV_COLUMNS
+    rows = load_ohlcv(
+        stock_ids,
+        _to_date(start).strftime("%Y-%m-%d") if start is not None else None,
+        _to_date(end).strftime("%Y-%m-%d") if end is not None else None,
+        columns,
+    )
+    df = pd.DataFrame(rows, columns=columns)
+    if "date" in df.columns:
+        df["date"] = pd.to_datetime(df["date"])
+    return df
+
+
+async def get_prices(stock_id: str, start: DateLike, end: Optional[DateLike] = None,
+                     session: Optional[aiohttp.ClientSession] = None) -> pd.DataFrame:
+    """補齊缺少的區間後，從本機讀取該股票的日 K 線"""
+    await ensure_range(stock_id, start, end, session=session)
+    return load_prices([str(stock_id)], start, end)
+
+
+def close_panel(stock_ids: Optional[Iterable[str]] = None, start: Optional[DateLike] = None,
+                end: Optional[DateLike] = None) -> pd.DataFrame:
+    """本機收盤價轉為 (日期 × 股票) 矩陣，供回測使用"""
+    df = load_prices(stock_ids, start, end, columns=["stock_id", "date", "close"])
+    return df.pivot(index="date", columns="stock_id", values="close")
+
+
+def closes_asof(stock_id: str, dates: Iterable[DateLike]) -> pd.Series:
+    """
+    各日期當天（或之前最近一個交易日）的本機收盤價，查無資料為 NaN。
+
+    :return: 與 dates 同順序的 Series
+    """
+    dates = pd.to_datetime(pd.Series(list(dates)))
+    if dates.empty:
+        return pd.Series(dtype="float64")
+    prices = load_prices([str(stock_id)], end=dates.max(), columns=["date", "close"]).dropna()
+    if prices.empty:
+        return pd.Series(float("nan"), index=dates.index)
+    query = pd.DataFrame({"date": dates, "order": range(len(dates))}).sort_values("date")
+    matched = pd.merge_asof(query, prices.sort_values("date"), on="date", direction="backward")
+    return matched.sort_values("order")["close"].reset_index(drop=True)
@@ -0,0 +1,270 @@
+import argparse
+import json
+import logging
+import os
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from file_lock import locked
+
+logger = logging.getLogger(__name__)
+
+PRICE_TABLE_FILE = "stock_prices.bin"
+STOCK_PRICE_FILE = "stock_prices.json"  # 匯出格式，與舊版相同 {stock_id: price}
+
+MAGIC = b"TWPT"
+LAYOUT_VERSION = 1
+INITIAL_CAPACITY = 4096
+READ_RETRIES = 100
+
+# 檔頭：moved 為 1 表示此檔已被擴充後的新檔取代，讀取端需重新開啟
+HEADER_DTYPE = np.dtype([
+    ("magic", "S4"), ("layout", "<u4"), ("capacity", "<u4"), ("count", "<u4"), ("moved", "<u4"), ("_pad", "<u4"),
+])
+# 每個 slot 固定 32 bytes；seq 為 seqlock 版本號，寫入中為奇數
+SLOT_DTYPE = np.dtype([
+    ("stock_id", "S12"), ("seq", "<u4"), ("price", "<f8"), ("updated_at", "<f8"),
+])
+HEADER_SIZE = HEADER_DTYPE.itemsize
+
+
+class PriceTable:
+    """
+    固定格式的記憶體映射股價表：stock_id → (price, updated_at)。
+
+    多個程序可同時開啟同一個檔案：讀取端直接讀取共享記憶體不需加鎖，
+    以每個 slot 的版本號 (seqlock) 判斷是否讀到寫入中的資料；
+    寫入端以 flock 互斥，只就地改寫有變動的 slot。
+    """
+
+    def __init__(self, path: str = PRICE_TABLE_FILE, writable: bool = False):
+        self.path = path
+        self.writable = writable
+        self._slot_of: Dict[str, int] = {}
+        self._open()
+
+    def _open(self) -> None:
+        if not os.path.exists(self.path):
+            if not self.writable:
+                raise FileNotFoundError(self.path)
+            with locked(self.path):
+                if not os.path.exists(self.path):
+                    self._create(self.path, INITIAL_CAPACITY, np.zeros(0, dtype=SLOT_DTYPE))
+
+        mode = "r+" if self.writable else "r"
+        self._header = np.memmap(self.path, dtype=HEADER_DTYPE, mode=mode, shape=(1,))
+        if self._header["magic"][0] != MAGIC or self._header["layout"][0] != LAYOUT_VERSION:
+            raise ValueError(f"{self.path} 不是股價表檔案或格式版本不符")
+        self._slots = np.memmap(self.path, dtype=SLOT_DTYPE, mode=mode, offset=HEADER_SIZE,
+                                shape=(int(self._header["capacity"][0]),))
+        self._slot_of = {}
+        self._index_new_slots()
+
+    @staticmethod
+    def _create(path: str, capacity: int, slots: np.ndarray) -> None:
+        """寫入暫存檔後以 os.replace 換上，讀取端不會看到不完整的檔案"""
+        header = np.zeros(1, dtype=HEADER_DTYPE)
+        header[0] = (MAGIC, LAYOUT_VERSION, capacity, len(slots), 0, 0)
+        body = np.zeros(capacity, dtype=SLOT_DTYPE)
+        body[:len(slots)] = slots
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(header.tobytes())
+            f.write(body.tobytes())
+        os.replace(tmp_path, path)
+
+    def _index_new_slots(self) -> None:
+        """將其他程序新增的 slot 加入 stock_id → slot 對照"""
+        count = int(self._header["count"][0])
+        for slot in range(len(self._slot_of), count):
+            self._slot_of[self._slots["stock_id"][slot].decode("ascii")] = slot
+
+    def refresh(self) -> None:
+        """檔案被擴充取代時重新開啟，否則只補上新增的 slot"""
+        if self._header["moved"][0]:
+            self._open()
+        elif int(self._header["count"][0]) != len(self._slot_of):
+            self._index_new_slots()
+
+    def __len__(self) -> int:
+        self.refresh()
+        return len(self._slot_of)
+
+    def __contains__(self, stock_id: str) -> bool:
+        self.refresh()
+        return str(stock_id) in self._slot_of
+
+    def stock_ids(self) -> List[str]:
+        self.refresh()
+        return list(self._slot_of)
+
+    def _read_slot(self, slot: int) -> Tuple[float, float]:
+        seqs = self._slots["seq"]
+        for _ in range(READ_RETRIES):
+            seq = int(seqs[slot])
+            if seq & 1:
+                time.sleep(0)
+                continue
+            price, updated_at = float(self._slots["price"][slot]), float(self._slots["updated_at"][slot])
+            if int(seqs[slot]) == seq:
+                return price, updated_at
+        # 持續與寫入衝突時（寫入端被排程中斷），改為等待寫入鎖後讀取
+        with locked(self.path):
+            return float(self._slots["price"][slot]), float(self._slots["updated_at"][slot])
+
+    def get(self, stock_id: str) -> Optional[Tuple[float, float]]:
+        """
+        :return: (price, updated_at)，查無此股票時回傳 None
+        """
+        stock_id = str(stock_id)
+        if self._header["moved"][0] or stock_id not in self._slot_of:
+            self.refresh()
+        slot = self._slot_of.get(stock_id)
+        return None if slot is None else self._read_slot(slot)
+
+    def price(self, stock_id: str) -> Optional[float]:
+        record = self.get(stock_id)
+        return record[0] if record else None
+
+    def snapshot(self) -> Dict[str, float]:
+        """
+        全部股票的價格 {stock_id: price}。
+        一次複製整個陣列，只有複製期間版本號改變的 slot 才逐筆重讀。
+        """
+        self.refresh()
+        count = len(self._slot_of)
+        before = np.array(self._slots["seq"][:count])
+        copied = np.array(self._slots[:count])
+        unstable = np.flatnonzero((before & 1) | (copied["seq"] != before))
+        prices = dict(zip(self._slot_of, copied["price"].tolist()))
+        stock_ids = list(self._slot_of)
+        for slot in unstable:
+            prices[stock_ids[slot]] = self._read_slot(int(slot))[0]
+        return prices
+
+    def update(self, prices: Dict[str, float], updated_at: Optional[float] = None) -> int:
+        """
+        就地更新價格；新股票附加到尾端，容量不足時建立兩倍大小的新檔並取代。
+
+        :return: 更新的股票數
+        """
+        if not self.writable:
+            raise PermissionError("股價表以唯讀模式開啟")
+        updated_at = updated_at or time.time()
+        with locked(self.path):
+            self.refresh()
+            new_ids = [str(stock_id) for stock_id in prices if str(stock_id) not in self._slot_of]
+            for stock_id in new_ids:
+                if len(stock_id.encode("ascii")) > SLOT_DTYPE["stock_id"].itemsize:
+                    raise ValueError(f"股票代號過長：{stock_id}")
+            count = len(self._slot_of)
+            if count + len(new_ids) > len(self._slots):
+                self._grow(count + len(new_ids))
+
+            for stock_id in new_ids:
+                self._slots["stock_id"][count] = stock_id.encode("ascii")
+                self._slot_of[stock_id] = count
+                count += 1
+
+            for stock_id, price in prices.items():
+                slot = self._slot_of[str(stock_id)]
+                self._slots["seq"][slot] += 1
+                self._slots["price"][slot] = price
+                self._slots["updated_at"][slot] = updated_at
+                self._slots["seq"][slot] += 1
+            # 新 slot 的資料寫好後才公開數量，讀取端不會看到空的 slot
+            self._header["count"][0] = count
+        return len(prices)
+
+    def _grow(self, needed: int) -> None:
+        capacity = len(self._slots)
+        while capacity < needed:
+            capacity *= 2
+        count = len(self._slot_of)
+        self._create(self.path, capacity, np.array(self._slots[:count]))
+        # 通知仍映射舊檔的讀取端重新開啟
+        self._header["moved"][0] = 1
+        self._header.flush()
+        logger.info(f"股價表擴充為 {capacity} 個 slot")
+        self._open()
+
+    def export_json(self, json_file: str = STOCK_PRICE_FILE) -> int:
+        """匯出為舊版的 stock_prices.json 格式"""
+        prices = self.snapshot()
+        tmp_file = f"{json_file}.tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(prices, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, json_file)
+        return len(prices)
+
+
+def open_table(writable: bool = False, path: str = PRICE_TABLE_FILE,
+               json_file: str = STOCK_PRICE_FILE) -> Optional[PriceTable]:
+    """
+    開啟股價表；尚未建立時從 stock_prices.json 匯入。
+
+    :return: 唯讀開啟且兩個檔案都不存在時回傳 None
+    """
+    if not os.path.exists(path):
+        if not os.path.exists(json_file):
+            return PriceTable(path, writable=True) if writable else None
+        with open(json_file, "r", encoding="utf-8") as f:
+            prices = json.load(f)
+        table = PriceTable(path, writable=True)
+        if len(table) == 0:
+            table.update(prices, updated_at=os.path.getmtime(json_file))
+            logger.info(f"已從 {json_file} 匯入 {len(prices)} 支股票的價格")
+        if writable:
+            return table
+    return PriceTable(path, writable=writable)
+
+
+def save_prices(prices: Dict[str, float], export: bool = True) -> int:
+    """
+    更新股價表中的價格，並同步匯出 stock_prices.json
+
+    :return: 更新的股票數
+    """
+    table = open_table(writable=True)
+    count = table.update(prices)
+    if export:
+        table.export_json()
+    return count
+
+
+def load_prices(stock_ids: Optional[Iterable[str]] = None) -> Dict[str, float]:
+    """讀取價格 {stock_id: price}；stock_ids 為 None 時回傳全部"""
+    table = open_table()
+    if table is None:
+        return {}
+    if stock_ids is None:
+        return table.snapshot()
+    return {stock_id: price for stock_id in map(str, stock_ids)
+            if (price := table.price(stock_id)) is not None}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        level=logging.INFO,
+    )
+    parser = argparse.ArgumentParser(description="記憶體映射股價表")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("export", help=f"匯出為 {STOCK_PRICE_FILE}")
+    get_parser = subparsers.add_parser("get", help="查詢股票價格")
+    get_parser.add_argument("stock_ids", nargs="+")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        table = open_table()
+        print(f"已匯出 {table.export_json() if table else 0} 支股票的價格到 {STOCK_PRICE_FILE}")
+    else:
+        table = open_table()
+        for stock_id in args.stock_ids:
+            record = table.get(stock_id) if table else None
+            if record is None:
+                print(f"{stock_id}: 查無價格")
+            else:
+                print(f"{stock_id}: {record[0]:g}（{time.strftime('%Y-%m-%d %H:%M', time.localtime(record[1]))}）")
@@ -0,0 +1,131 @@
+import cProfile
+import functools
+import inspect
+import io
+import logging
+import os
+import pstats
+import re
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# 以環境變數控制是否啟用效能分析（未設定時完全不包裝，沒有任何額外開銷）
+PROFILE_ENABLED = os.getenv("PROFILE_ENABLED", "").lower() in ("1", "true", "yes", "on")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_TOP_N = int(os.getenv("PROFILE_TOP_N", "15"))
+
+# 同一時間只能有一個 cProfile 在執行，重疊的呼叫直接執行不做分析
+_active = False
+
+
+def _profile_path(name: str) -> str:
+    """產生 <PROFILE_DIR>/<名稱>_<時間戳>.prof 路徑"""
+    safe_name = re.sub(r"[^\w.-]", "_", name)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    return os.path.join(PROFILE_DIR, f"{safe_name}_{timestamp}.prof")
+
+
+def _dump(profile: cProfile.Profile, name: str) -> None:
+    """將 profile 寫入磁碟，並在日誌中列出最耗時的函數"""
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = _profile_path(name)
+        profile.dump_stats(path)
+
+        stream = io.StringIO()
+        stats = pstats.Stats(profile, stream=stream)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(PROFILE_TOP_N)
+        logger.info(f"[profile] {name} 已寫入 {path}，前 {PROFILE_TOP_N} 名熱點函數：\n{stream.getvalue()}")
+    except Exception as e:
+        logger.error(f"[profile] 寫入 {name} 的效能分析結果時發生錯誤: {str(e)}")
+
+
+class _Suspend:
+    """將內層協程 yield 出的 future 原樣交給事件迴圈，恢復時把結果（或例外）帶回"""
+
+    def __init__(self, item):
+        self.item = item
+
+    def __await__(self):
+        return (yield self.item)
+
+
+async def _run_task_profiled(profile: cProfile.Profile, coro):
+    """
+    逐步執行協程，只在此協程本身執行的片段啟用 profile；
+    在 await 等待期間事件迴圈執行的其他任務（其他指令、網路回呼）不會被記錄
+    """
+    value, error = None, None
+    while True:
+        profile.enable()
+        try:
+            item = coro.send(value) if error is None else coro.throw(error)
+        except StopIteration as stop:
+            return stop.value
+        finally:
+            profile.disable()
+        try:
+            value, error = await _Suspend(item), None
+        except BaseException as e:  # 含取消，轉交給內層協程處理
+            value, error = None, e
+
+
+def profiled(name: str, enabled: bool = None, per_task: bool = True):
+    """
+    以 cProfile 包裝同步或異步函數。
+
+    :param name: 寫入檔名與日誌時使用的名稱（例如指令名稱）
+    :param enabled: 是否啟用，預設依 PROFILE_ENABLED 環境變數
+    :param per_task: 異步函數只記錄自身任務執行的片段（預設），不含同一事件迴圈上的其他任務，
+                     也不含此函數以 gather / create_task 建立的子任務；
+                     False 時記錄整段期間事件迴圈上的所有任務，適用於單獨以 asyncio.run 執行的 CLI 入口
+    :return: 裝飾器；停用時直接回傳原函數
+    """
+    if enabled is None:
+        enabled = PROFILE_ENABLED
+
+    def decorator(func):
+        if not enabled:
+            return func
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                global _active
+                if _active:
+                    logger.info(f"[profile] 已有分析在進行中，{name} 本次不分析")
+                    return await func(*args, **kwargs)
+                _active = True
+                profile = cProfile.Profile()
+                try:
+                    if per_task:
+                        return await _run_task_profiled(profile, func(*args, **kwargs))
+                    profile.enable()
+                    try:
+                        return await func(*args, **kwargs)
+                    finally:
+                        profile.disable()
+                finally:
+                    _active = False
+                    _dump(profile, name)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            global _active
+            if _active:
+                logger.info(f"[profile] 已有分析在進行中，{name} 本次不分析")
+                return func(*args, **kwargs)
+            _active = True
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profile.disable()
+                _active = False
+                _dump(profile, name)
+        return wrapper
+
+    return decorator
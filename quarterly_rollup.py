@@ -0,0 +1,160 @@
+import logging
+from datetime import date
+from typing import Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+from dbHelper import (QUARTERLY_ROLLUP_COLUMNS, init_db, load_frozen_quarters,
+                      load_quarterly_rollups, save_quarterly_rollups)
+from compact_history import load_history
+from roe_data import ROE_CSV_FILE
+from snapshot_store import store
+
+logger = logging.getLogger(__name__)
+
+_db_ready = False
+
+
+def _ensure_db() -> None:
+    global _db_ready
+    if not _db_ready:
+        init_db()
+        _db_ready = True
+
+
+def aggregate_quarters(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    將 PER/PBR 日資料依 (stock_id, 季度) 彙總。
+
+    :param df: 包含 stock_id, date, PER, PBR, close 的日資料
+    :return: QUARTERLY_ROLLUP_COLUMNS 欄位的季度彙總
+    """
+    df = df[[col for col in ["stock_id", "date", "PER", "PBR", "close"] if col in df.columns]].copy()
+    if "close" not in df.columns:
+        df["close"] = np.nan
+    df["stock_id"] = df["stock_id"].astype(str)
+    df["date"] = pd.to_datetime(df["date"], errors="coerce")
+    for col in ["PER", "PBR", "close"]:
+        df[col] = pd.to_numeric(df[col], errors="coerce")
+
+    # 過濾無效的 PER 和 PBR 數據
+    df = df[(df["PER"] > 0) & (df["PER"] < 100) & (df["PBR"] > 0) & (df["PBR"] < 10)]
+    if df.empty:
+        return pd.DataFrame(columns=QUARTERLY_ROLLUP_COLUMNS)
+
+    df = df.sort_values(["stock_id", "date"])
+    df["quarter"] = df["date"].dt.to_period("Q")
+    grouped = df.groupby(["stock_id", "quarter"], sort=True)
+
+    rollups = grouped.agg(
+        last_date=("date", "last"),
+        per_mean=("PER", "mean"),
+        pbr_median=("PBR", "median"),
+        n_days=("PER", "size"),
+    )
+    # 使用百分位數避免極端值
+    rollups["per_p95"] = grouped["PER"].quantile(0.95)
+    rollups["per_p5"] = grouped["PER"].quantile(0.05)
+    # 季度最後一個交易日的收盤價
+    rollups["prev_close"] = grouped.tail(1).set_index(["stock_id", "quarter"])["close"]
+    rollups = rollups.reset_index()
+
+    # 已結束且收盤價完整的季度凍結，之後不再重算
+    current_quarter = pd.Timestamp.now().to_period("Q")
+    rollups["frozen"] = ((rollups["quarter"] < current_quarter) & rollups["prev_close"].notna()).astype(int)
+    rollups["quarter"] = rollups["quarter"].astype(str)
+    rollups["last_date"] = rollups["last_date"].dt.strftime("%Y-%m-%d")
+    return rollups[QUARTERLY_ROLLUP_COLUMNS]
+
+
+def _save(rollups: pd.DataFrame) -> int:
+    if rollups.empty:
+        return 0
+    rows = rollups.astype(object).where(rollups.notna(), None).itertuples(index=False, name=None)
+    save_quarterly_rollups(list(rows))
+    return len(rollups)
+
+
+def rebuild_rollups(df: pd.DataFrame) -> int:
+    """以完整日資料重建（含已凍結的）季度彙總，用於回補或整批更新收盤價後"""
+    _ensure_db()
+    return _save(aggregate_quarters(df))
+
+
+def update_rollups(since: date, stock_ids: Optional[Iterable[str]] = None,
+                   csv_file: str = ROE_CSV_FILE) -> int:
+    """
+    新的日資料寫入後，只重算 since 所在季度之後、尚未凍結的季度。
+
+    :param since: 新資料的最早日期
+    :param stock_ids: 有新資料的股票，None 表示全部
+    :return: 更新的季度筆數
+    """
+    _ensure_db()
+    if not store(csv_file).exists():
+        return 0
+
+    quarter_start = pd.Timestamp(since).to_period("Q").start_time
+    df = load_history(csv_file).frame(since=quarter_start)
+    if stock_ids is not None:
+        df = df[df["stock_id"].isin(set(stock_ids))]
+
+    rollups = aggregate_quarters(df)
+    frozen = load_frozen_quarters()
+    if frozen and not rollups.empty:
+        keys = list(zip(rollups["stock_id"], rollups["quarter"]))
+        rollups = rollups[[key not in frozen for key in keys]]
+
+    updated = _save(rollups)
+    logger.info(f"已更新 {updated} 筆季度彙總（{quarter_start.date()} 起）")
+    return updated
+
+
+def load_rollups(stock_ids: Optional[Iterable[str]] = None) -> pd.DataFrame:
+    """讀取季度彙總為 DataFrame"""
+    _ensure_db()
+    return pd.DataFrame(load_quarterly_rollups(stock_ids), columns=QUARTERLY_ROLLUP_COLUMNS)
+
+
+def get_rollups(stock_id: str, csv_file: str = ROE_CSV_FILE) -> pd.DataFrame:
+    """讀取單一股票的季度彙總；尚未建立時從 CSV 回補"""
+    rollups = load_rollups([stock_id])
+    if rollups.empty and store(csv_file).exists():
+        rebuild_rollups(load_history(csv_file).frame(stock_id))
+        rollups = load_rollups([stock_id])
+    return rollups
+
+
+def quarterly_estimates(rollups: pd.DataFrame) -> pd.DataFrame:
+    """
+    由季度彙總計算季度 ROE、BVPS、推估 EPS 與三種股價（可同時處理多支股票）。
+
+    :return: 欄位同舊版 calculate_quarterly_stock_estimates 的季度資料
+    """
+    df = pd.DataFrame({
+        "stock_id": rollups["stock_id"],
+        "quarter": pd.PeriodIndex(rollups["quarter"], freq="Q"),
+        "date": pd.to_datetime(rollups["last_date"]),
+        "PER": rollups["per_mean"].astype(float),
+        "PBR": rollups["pbr_median"].astype(float),
+        "PER_最高值": rollups["per_p95"].astype(float),
+        "PER_平均值": rollups["per_mean"].astype(float),
+        "PER_最低值": rollups["per_p5"].astype(float),
+        "prev_close": rollups["prev_close"].astype(float),
+    })
+
+    # 計算季度 ROE (%)
+    df["ROE"] = np.where(
+        (df["PER"] != 0) & (df["PER"].notna()) & (df["PBR"].notna()),
+        (df["PBR"] / df["PER"]) * 100,
+        np.nan
+    )
+    df["BVPS"] = df["prev_close"] / df["PBR"]
+    df["推估EPS"] = df["BVPS"] * (df["ROE"] / 100)
+
+    # 計算三種股價（使用 PER 的百分位數）
+    df["高股價"] = df["PER_最高值"] * df["推估EPS"]
+    df["正常股價"] = df["PER_平均值"] * df["推估EPS"]
+    df["低股價"] = df["PER_最低值"] * df["推估EPS"]
+    return df
@@ -0,0 +1,152 @@
+import logging
+from datetime import date, datetime, timedelta
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+import pandas as pd
+
+from finmind_client import fetch_dataset
+from snapshot_store import store
+
+logger = logging.getLogger(__name__)
+
+ROE_CSV_FILE = "stock_roe_data.csv"
+ROE_START_DATE = "2020-01-01"
+ROE_COLUMNS = ["date", "stock_id", "dividend_yield", "PER", "PBR"]
+
+
+class IngestError(RuntimeError):
+    """全市場 PER 匯入在某個日期區間失敗；之前的區間已寫入，下次從失敗的區間繼續"""
+
+    def __init__(self, start: date, end: date, written: int, cause: Exception):
+        super().__init__(f"查詢 {start} ~ {end} 的全市場 PER 時發生錯誤: {str(cause)}")
+        self.start = start
+        self.end = end
+        self.written = written
+
+
+def latest_roe_date(csv_file: str = ROE_CSV_FILE) -> Optional[date]:
+    """回傳目前版本中最新一筆資料的日期（只讀取 date 欄位）"""
+    with store(csv_file).pin() as snapshot:
+        if snapshot is None:
+            return None
+        dates = snapshot.read_csv(usecols=["date"])["date"]
+    latest = pd.to_datetime(dates, errors="coerce").max()
+    return None if pd.isna(latest) else latest.date()
+
+
+def load_existing_keys(csv_file: str = ROE_CSV_FILE, start_date: Optional[date] = None,
+                       end_date: Optional[date] = None) -> Dict[str, Set[str]]:
+    """讀取目前版本中已存在的 {date: {stock_id, ...}}，可限定日期區間"""
+    with store(csv_file).pin() as snapshot:
+        if snapshot is None:
+            return {}
+        existing = snapshot.read_csv(usecols=["stock_id", "date"], dtype=str)
+    if start_date is not None:
+        existing = existing[existing["date"] >= start_date.strftime("%Y-%m-%d")]
+    if end_date is not None:
+        existing = existing[existing["date"] <= end_date.strftime("%Y-%m-%d")]
+    return {d: set(ids) for d, ids in existing.groupby("date")["stock_id"]}
+
+
+def append_roe_rows(df: pd.DataFrame, csv_file: str = ROE_CSV_FILE,
+                    existing_keys: Optional[Dict[str, Set[str]]] = None) -> int:
+    """
+    將 TaiwanStockPER 資料依 stock_id 排序後追加為新的快照版本，
+    欄位依現有欄位對齊，並略過已存在的 (stock_id, date)。
+
+    :param existing_keys: load_existing_keys() 的結果，None 時自動讀取；寫入後會一併更新
+    :return: 實際寫入的筆數
+    """
+    if df.empty:
+        return 0
+
+    df = df.copy()
+    df["stock_id"] = df["stock_id"].astype(str)
+    df["date"] = pd.to_datetime(df["date"]).dt.strftime("%Y-%m-%d")
+    for col in ["dividend_yield", "PER", "PBR"]:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors="coerce")
+
+    if existing_keys is None:
+        existing_keys = load_existing_keys(csv_file)
+
+    # 排除已存在的 (stock_id, date)，避免重複追加
+    duplicated = [stock_id in existing_keys.get(d, ()) for d, stock_id in zip(df["date"], df["stock_id"])]
+    df = df[~pd.Series(duplicated, index=df.index, dtype=bool)]
+    if df.empty:
+        return 0
+
+    # 欄位依目前版本對齊（可能已有 close、ROE 等後續欄位），尚無資料時使用 ROE_COLUMNS
+    store(csv_file).append(df.sort_values(["stock_id", "date"]), default_columns=ROE_COLUMNS)
+
+    for d, stock_id in zip(df["date"], df["stock_id"]):
+        existing_keys.setdefault(d, set()).add(stock_id)
+    return len(df)
+
+
+def _date_chunks(start: date, end: date, chunk_days: int):
+    """依 chunk_days 切割日期區間；單日模式略過週末"""
+    if chunk_days < 1:
+        raise ValueError(f"chunk_days 需至少為 1：{chunk_days}")
+    current = start
+    while current <= end:
+        if chunk_days == 1 and current.weekday() >= 5:
+            current += timedelta(days=1)
+            continue
+        chunk_end = min(current + timedelta(days=chunk_days - 1), end)
+        yield current, chunk_end
+        current = chunk_end + timedelta(days=1)
+
+
+async def ingest_market_per(start_date: Optional[date] = None, end_date: Optional[date] = None,
+                            chunk_days: int = 1,
+                            progress: Optional[Callable[[int, int, int], Awaitable[None]]] = None,
+                            csv_file: str = ROE_CSV_FILE) -> int:
+    """
+    以「日期」為單位查詢全市場 TaiwanStockPER（不帶 data_id），
+    每日更新只需一次請求，多年回補約每個交易日一次請求（速率由 finmind_client.rate_controller 控制）。
+    任一區間失敗即停止，避免之後的區間寫入後，下次從最新日期續傳而永久缺少失敗的日期。
+
+    :param start_date: 起始日期，None 時從 CSV 最新日期的隔天開始
+    :param end_date: 結束日期，None 時為今天
+    :param chunk_days: 每次請求涵蓋的天數（1 為逐日查詢）
+    :param progress: 進度回呼 (已完成請求數, 總請求數, 已寫入筆數)
+    :return: 寫入 CSV 的總筆數
+    :raises ValueError: chunk_days 小於 1
+    :raises IngestError: 某個區間查詢或寫入失敗（附失敗的區間與之前已寫入的筆數）
+    """
+    if chunk_days < 1:
+        raise ValueError(f"chunk_days 需至少為 1：{chunk_days}")
+    if start_date is None:
+        latest = latest_roe_date(csv_file)
+        start_date = latest + timedelta(days=1) if latest else datetime.strptime(ROE_START_DATE, "%Y-%m-%d").date()
+    if end_date is None:
+        end_date = date.today()
+
+    chunks = list(_date_chunks(start_date, end_date, chunk_days))
+    logger.info(f"全市場 PER 匯入：{start_date} ~ {end_date}，共 {len(chunks)} 次請求")
+
+    existing_keys = load_existing_keys(csv_file, start_date, end_date)
+    total_written = 0
+    for i, (chunk_start, chunk_end) in enumerate(chunks, 1):
+        try:
+            rows = await fetch_dataset(
+                "TaiwanStockPER",
+                start_date=chunk_start.strftime("%Y-%m-%d"),
+                end_date=chunk_end.strftime("%Y-%m-%d"),
+            )
+            if rows:
+                written = append_roe_rows(pd.DataFrame(rows), csv_file, existing_keys)
+                total_written += written
+                logger.info(f"{chunk_start} ~ {chunk_end} 取得 {len(rows)} 筆，寫入 {written} 筆")
+            else:
+                logger.info(f"{chunk_start} ~ {chunk_end} 沒有數據（非交易日）")
+        except Exception as e:
+            error = IngestError(chunk_start, chunk_end, total_written, e)
+            logger.error(str(error))
+            raise error from e
+
+        if progress:
+            await progress(i, len(chunks), total_written)
+
+    return total_written
@@ -0,0 +1,188 @@
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+SCREEN_CSV_FILE = "Calculated_Stock_Values.csv"
+PAGE_SIZE = 10
+
+# 常用欄位的簡寫
+COLUMN_ALIASES = {
+    "ROE": "平均ROE(%)",
+    "PER": "目前PER",
+    "PBR": "目前PBR",
+    "價格": "成交",
+    "股價": "成交",
+    "低價": "最低合理股價",
+    "合理價": "平均合理股價",
+    "高價": "最高合理股價",
+    "評分": "平均財報評分",
+}
+
+# 每筆結果固定顯示的欄位
+DISPLAY_COLUMNS = ["代號", "名稱", "成交", "平均ROE(%)", "目前PER", "目前PBR", "最低合理股價", "PER目前落點"]
+
+_CONDITION_PATTERN = re.compile(r"^(?P<column>.+?)(?P<op>>=|<=|!=|>|<|=)(?P<value>.+)$")
+
+
+class ScreenError(ValueError):
+    """篩選條件格式錯誤"""
+
+
+class _SortedIndex:
+    """單一數值欄位的排序索引：範圍查詢只需兩次二分搜尋"""
+
+    def __init__(self, values: np.ndarray):
+        self.order = np.argsort(values, kind="stable")  # NaN 排在最後
+        sorted_values = values[self.order]
+        self.valid = int(np.count_nonzero(~np.isnan(sorted_values)))
+        self.sorted_values = sorted_values[:self.valid]
+
+    def positions(self, op: str, value: float) -> np.ndarray:
+        """回傳符合條件的列位置"""
+        if op == ">":
+            return self.order[np.searchsorted(self.sorted_values, value, side="right"):self.valid]
+        if op == ">=":
+            return self.order[np.searchsorted(self.sorted_values, value, side="left"):self.valid]
+        if op == "<":
+            return self.order[:np.searchsorted(self.sorted_values, value, side="left")]
+        if op == "<=":
+            return self.order[:np.searchsorted(self.sorted_values, value, side="right")]
+        lo = np.searchsorted(self.sorted_values, value, side="left")
+        hi = np.searchsorted(self.sorted_values, value, side="right")
+        if op == "=":
+            return self.order[lo:hi]
+        return np.concatenate([self.order[:lo], self.order[hi:self.valid]])
+
+
+class FundamentalScreener:
+    """
+    Calculated_Stock_Values 的多條件篩選器。
+    數值欄位建立排序索引、類別欄位建立 bitmap，多個條件以 bitmap AND 合併。
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df.reset_index(drop=True)
+        self.size = len(self.df)
+        self.numeric: Dict[str, np.ndarray] = {}
+        self.indexes: Dict[str, _SortedIndex] = {}
+        self.bitmaps: Dict[str, Dict[str, np.ndarray]] = {}
+
+        for column in self.df.columns:
+            series = self.df[column]
+            if pd.api.types.is_numeric_dtype(series):
+                values = series.to_numpy(dtype="float64")
+                self.numeric[column] = values
+                self.indexes[column] = _SortedIndex(values)
+            elif column != "代號" and series.nunique() <= 32:
+                codes, uniques = pd.factorize(series)
+                self.bitmaps[column] = {str(value): codes == i for i, value in enumerate(uniques)}
+
+    def resolve_column(self, column: str) -> str:
+        """將簡寫轉為完整欄位名稱"""
+        column = COLUMN_ALIASES.get(column, column)
+        if column not in self.df.columns:
+            raise ScreenError(f"找不到欄位：{column}")
+        return column
+
+    def _pair_index(self, left: str, right: str) -> _SortedIndex:
+        """欄位對欄位比較（如 成交<最低合理股價）以差值建立索引並快取"""
+        key = f"{left}-{right}"
+        if key not in self.indexes:
+            self.indexes[key] = _SortedIndex(self.numeric[left] - self.numeric[right])
+        return self.indexes[key]
+
+    def condition_mask(self, column: str, op: str, value: str) -> np.ndarray:
+        column = self.resolve_column(column)
+        mask = np.zeros(self.size, dtype=bool)
+
+        if column in self.bitmaps:
+            if op not in ("=", "!="):
+                raise ScreenError(f"{column} 只支援 = 或 !=")
+            for item in value.split(","):
+                mask |= self.bitmaps[column].get(item, False)
+            return ~mask if op == "!=" else mask
+
+        if column not in self.indexes:
+            raise ScreenError(f"{column} 不是可篩選的欄位")
+
+        right = COLUMN_ALIASES.get(value, value)
+        if right in self.numeric:
+            mask[self._pair_index(column, right).positions(op, 0.0)] = True
+            return mask
+
+        try:
+            number = float(value)
+        except ValueError:
+            raise ScreenError(f"無法解析數值：{value}")
+        mask[self.indexes[column].positions(op, number)] = True
+        return mask
+
+    def query(self, conditions: List[Tuple[str, str, str]], sort_by: Optional[str] = None,
+              ascending: bool = False, page: int = 1, page_size: int = PAGE_SIZE) -> Tuple[int, pd.DataFrame]:
+        """
+        :param conditions: [(欄位, 運算子, 值), ...]
+        :param sort_by: 排序欄位，預設為平均ROE(%)
+        :return: (符合筆數, 該頁結果)
+        :raises ScreenError: 排序欄位不是數值、頁數小於 1 或超過總頁數
+        """
+        if page < 1:
+            raise ScreenError(f"頁數需至少為 1：{page}")
+        sort_column = self.resolve_column(sort_by or "平均ROE(%)")
+        if sort_column not in self.numeric:
+            raise ScreenError(f"{sort_column} 不是數值欄位，無法排序")
+
+        mask = np.ones(self.size, dtype=bool)
+        for column, op, value in conditions:
+            mask &= self.condition_mask(column, op, value)
+
+        # 利用已排序的索引輸出，不需要再對結果排序
+        index = self.indexes[sort_column]
+        order = index.order if ascending else np.concatenate([index.order[:index.valid][::-1], index.order[index.valid:]])
+        matched = order[mask[order]]
+
+        pages = (len(matched) - 1) // page_size + 1
+        if len(matched) and page > pages:
+            raise ScreenError(f"頁數超過範圍：共 {len(matched)} 支、{pages} 頁")
+        start = (page - 1) * page_size
+        return len(matched), self.df.iloc[matched[start:start + page_size]]
+
+
+def parse_screen_args(args: List[str]) -> Tuple[List[Tuple[str, str, str]], Dict[str, str]]:
+    """
+    解析 /screen 參數，例如：ROE>15 PBR<1.5 成交<最低合理股價 PER目前落點=破低,低 page=2 sort=PBR asc
+
+    :return: (條件列表, 選項 {page, sort, order})
+    """
+    conditions, options = [], {}
+    for arg in args:
+        if arg.lower() in ("asc", "desc"):
+            options["order"] = arg.lower()
+            continue
+        match = _CONDITION_PATTERN.match(arg)
+        if not match:
+            raise ScreenError(f"無法解析條件：{arg}")
+        column, op, value = match.group("column"), match.group("op"), match.group("value")
+        if column.lower() in ("page", "sort") and op == "=":
+            if column.lower() == "page" and not (value.isdigit() and int(value) >= 1):
+                raise ScreenError(f"頁數需為正整數：{value}")
+            options[column.lower()] = value
+        else:
+            conditions.append((column, op, value))
+    return conditions, options
+
+
+_cache: Dict[str, Tuple[float, FundamentalScreener]] = {}
+
+
+def load_screener(csv_file: str = SCREEN_CSV_FILE) -> FundamentalScreener:
+    """依檔案修改時間快取篩選器，來源 CSV 更新後才重建索引"""
+    mtime = os.path.getmtime(csv_file)
+    cached = _cache.get(csv_file)
+    if cached is None or cached[0] != mtime:
+        df = pd.read_csv(csv_file, dtype={"代號": str})
+        cached = (mtime, FundamentalScreener(df))
+        _cache[csv_file] = cached
+    return cached[1]
@@ -0,0 +1,129 @@
+import argparse
+import logging
+import os
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+SIMILAR_CSV_FILE = "Calculated_Stock_Values.csv"
+DEFAULT_TOP_K = 10
+MAX_TOP_K = 30
+CLIP = 3.0  # 標準化後的上下限，避免營收成長等極端值主導距離
+
+# 數值特徵（Calculated_Stock_Values 欄位）
+NUMERIC_FEATURES = [
+    "平均ROE(%)", "目前PER", "目前PBR",
+    "平均毛利(%)", "平均營益(%)", "平均淨利(%)",
+    "營收成長(%)", "淨利成長(%)", "平均財報評分",
+]
+# 落點欄位依高低轉為序數
+LANDING_FEATURES = ["股價目前落點", "PER目前落點", "PBR目前落點"]
+LANDING_LEVELS = {"破低": 0, "低": 1, "近低": 2, "近高": 3, "高": 4, "過高": 5}
+
+# 每筆結果顯示的欄位
+DISPLAY_COLUMNS = ["代號", "名稱", "成交", "平均ROE(%)", "目前PER", "目前PBR", "PER目前落點", "平均財報評分"]
+
+
+class SimilarError(ValueError):
+    """查詢的股票不在資料中"""
+
+
+def build_features(df: pd.DataFrame) -> Tuple[np.ndarray, List[str]]:
+    """
+    將各欄位以中位數與四分位距標準化（落點先轉為序數），缺值視為中位數
+
+    :return: (股票 × 特徵 的矩陣, 使用的特徵名稱)
+    """
+    columns = {}
+    for feature in NUMERIC_FEATURES:
+        if feature in df.columns:
+            columns[feature] = pd.to_numeric(df[feature], errors="coerce")
+    for feature in LANDING_FEATURES:
+        if feature in df.columns:
+            columns[feature] = df[feature].map(LANDING_LEVELS).astype(float)
+    features = pd.DataFrame(columns)
+
+    median = features.median()
+    spread = (features.quantile(0.75) - features.quantile(0.25)).replace(0, np.nan).fillna(features.std())
+    scaled = ((features - median) / spread.replace(0, np.nan)).clip(-CLIP, CLIP)
+    # 整欄沒有變異的特徵不影響距離
+    scaled = scaled.loc[:, spread.notna() & (spread > 0)]
+    return scaled.fillna(0.0).to_numpy(dtype="float64"), list(scaled.columns)
+
+
+class SimilarityIndex:
+    """
+    Calculated_Stock_Values 的相似股票索引。
+    特徵矩陣與各列的平方長度預先計算，查詢時以一次矩陣乘法算出與所有股票的距離。
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df.reset_index(drop=True)
+        self.vectors, self.features = build_features(self.df)
+        self.norms = np.einsum("ij,ij->i", self.vectors, self.vectors)
+        self.row_of: Dict[str, int] = {str(stock_id): i for i, stock_id in enumerate(self.df["代號"])}
+
+    def __contains__(self, stock_id: str) -> bool:
+        return str(stock_id) in self.row_of
+
+    def distances(self, stock_id: str) -> np.ndarray:
+        """與所有股票的歐氏距離"""
+        row = self.row_of.get(str(stock_id))
+        if row is None:
+            raise SimilarError(f"找不到股票：{stock_id}")
+        query = self.vectors[row]
+        squared = self.norms - 2 * self.vectors @ query + self.norms[row]
+        return np.sqrt(np.maximum(squared, 0.0))
+
+    def similar(self, stock_id: str, k: int = DEFAULT_TOP_K) -> pd.DataFrame:
+        """
+        :return: 最相似的 k 支股票（不含自己），依距離由近到遠，附 distance 欄位
+        """
+        k = max(1, min(int(k), MAX_TOP_K, len(self.df) - 1))
+        distances = self.distances(stock_id)
+        distances[self.row_of[str(stock_id)]] = np.inf
+        # 只對前 k 名排序
+        nearest = np.argpartition(distances, k - 1)[:k]
+        nearest = nearest[np.argsort(distances[nearest], kind="stable")]
+        result = self.df.iloc[nearest].copy()
+        result["distance"] = distances[nearest]
+        return result
+
+
+_cache: Dict[str, Tuple[float, SimilarityIndex]] = {}
+
+
+def load_similarity_index(csv_file: str = SIMILAR_CSV_FILE) -> SimilarityIndex:
+    """依檔案修改時間快取索引，來源 CSV 更新後才重建"""
+    mtime = os.path.getmtime(csv_file)
+    cached = _cache.get(csv_file)
+    if cached is None or cached[0] != mtime:
+        started = time.perf_counter()
+        df = pd.read_csv(csv_file, dtype={"代號": str})
+        cached = (mtime, SimilarityIndex(df))
+        _cache[csv_file] = cached
+        logger.info(f"已建立 {len(df)} 支股票的相似股票索引，耗時 {(time.perf_counter() - started) * 1000:.1f} ms")
+    return cached[1]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        level=logging.INFO,
+    )
+    parser = argparse.ArgumentParser(description="以估值特徵尋找相似的股票")
+    parser.add_argument("stock_id")
+    parser.add_argument("-k", type=int, default=DEFAULT_TOP_K, help="回傳的股票數")
+    parser.add_argument("--csv", default=SIMILAR_CSV_FILE)
+    args = parser.parse_args()
+
+    index = load_similarity_index(args.csv)
+    started = time.perf_counter()
+    peers = index.similar(args.stock_id, args.k)
+    elapsed = (time.perf_counter() - started) * 1000
+    print(peers[DISPLAY_COLUMNS + ["distance"]].to_string(index=False))
+    print(f"特徵：{', '.join(index.features)}；查詢耗時 {elapsed:.2f} ms")
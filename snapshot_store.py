@@ -0,0 +1,375 @@
+import argparse
+import contextvars
+import fcntl
+import json
+import logging
+import os
+import re
+import shutil
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+from file_lock import locked
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "snapshots")
+KEEP_VERSIONS = 3  # 除了目前版本外，未被讀取端鎖定的舊版本最多保留幾個
+MAX_SEGMENTS = 32  # 追加的區段超過此數量時合併相鄰的小區段
+CSV_ENCODING = "utf-8-sig"
+
+_MANIFEST_PATTERN = re.compile(r"^manifest-(\d+)\.json$")
+
+# 目前 context（指令）已鎖定的版本 {資料集目錄: Snapshot}，同一指令內的巢狀讀取共用同一版本
+_pinned: contextvars.ContextVar[Dict[str, "Snapshot"]] = contextvars.ContextVar("pinned_snapshots", default={})
+
+
+class SnapshotConflict(RuntimeError):
+    """讀取的版本之後資料已被整份改寫，無法安全地以該版本為基礎寫入"""
+
+
+class Snapshot:
+    """
+    一個不可變的資料版本：依序串接的 CSV 區段。
+
+    lineage 為依序追加過的原始區段名稱，合併區段時不變，
+    用來判斷某個版本是否為之後版本的前段（只有追加、沒有被整份改寫）。
+    """
+
+    def __init__(self, store: "SnapshotStore", manifest: Dict):
+        self.store = store
+        self.version: int = manifest["version"]
+        self.columns: List[str] = manifest["columns"]
+        self.segments: List[str] = manifest["segments"]
+        # 舊格式的 manifest 沒有筆數與 lineage
+        self.rows: List[Optional[int]] = manifest.get("rows") or [None] * len(self.segments)
+        self.lineage: List[str] = manifest.get("lineage") or self.segments
+
+    def paths(self) -> List[str]:
+        return [os.path.join(self.store.root, segment) for segment in self.segments]
+
+    def read_csv(self, **kwargs) -> pd.DataFrame:
+        """讀取此版本的全部資料，參數同 pd.read_csv"""
+        frames = [pd.read_csv(path, **kwargs) for path in self.paths()]
+        frames = [frame for frame in frames if not frame.empty] or frames[:1]
+        if not frames:
+            return pd.DataFrame(columns=self.columns)
+        return frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+
+
+class SnapshotStore:
+    """
+    CSV 資料集的版本化快照。
+
+    每個版本是一份 manifest（區段清單），區段檔寫入後不再修改；
+    寫入端在鎖內產生新區段與新 manifest，最後以 os.replace 切換 CURRENT 指標。
+    讀取端以共享 flock 鎖定 manifest 期間，該版本與其區段不會被清除，
+    因此讀取不會阻擋寫入，也不會讀到寫到一半的資料。
+    """
+
+    def __init__(self, csv_file: str):
+        self.csv_file = csv_file
+        self.root = os.path.join(SNAPSHOT_DIR, os.path.splitext(os.path.basename(csv_file))[0])
+        self.pointer = os.path.join(self.root, "CURRENT")
+
+    def _manifest_path(self, version: int) -> str:
+        return os.path.join(self.root, f"manifest-{version:06d}.json")
+
+    def _read_pointer(self) -> Optional[int]:
+        try:
+            with open(self.pointer, "r", encoding="utf-8") as f:
+                return int(f.read().strip())
+        except FileNotFoundError:
+            return None
+
+    def _write_atomic(self, path: str, content: str) -> None:
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _load_manifest(self, version: int) -> Dict:
+        with open(self._manifest_path(version), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _migrate_legacy(self) -> None:
+        """第一次使用時將既有的 CSV 以 hard link 匯入為第 1 版，匯入後改名為 .migrated"""
+        if not os.path.exists(self.csv_file):
+            return
+        with locked(self.pointer):
+            if self._read_pointer() is not None or not os.path.exists(self.csv_file):
+                return
+            segment = "seg-000001.csv"
+            segment_path = os.path.join(self.root, segment)
+            if os.path.exists(segment_path):
+                os.remove(segment_path)
+            try:
+                os.link(self.csv_file, segment_path)
+            except OSError:
+                shutil.copyfile(self.csv_file, segment_path)
+            columns = list(pd.read_csv(segment_path, nrows=0, encoding=CSV_ENCODING).columns)
+            self._publish(1, columns, [segment], [self._count_rows(segment)], [segment])
+            os.replace(self.csv_file, f"{self.csv_file}.migrated")
+            logger.info(f"已將 {self.csv_file} 匯入為快照第 1 版")
+
+    def current_version(self) -> Optional[int]:
+        """目前版本號；尚無任何版本時為 None"""
+        version = self._read_pointer()
+        if version is None:
+            os.makedirs(self.root, exist_ok=True)
+            self._migrate_legacy()
+            version = self._read_pointer()
+        return version
+
+    def exists(self) -> bool:
+        return self.current_version() is not None
+
+    @contextmanager
+    def pin(self) -> Iterator[Optional[Snapshot]]:
+        """
+        鎖定目前版本直到離開 with 區塊；同一指令（context）內的巢狀 pin 共用同一版本。
+
+        :return: Snapshot，尚無任何版本時為 None
+        """
+        pinned = _pinned.get()
+        if self.root in pinned:
+            yield pinned[self.root]
+            return
+
+        while True:
+            version = self.current_version()
+            if version is None:
+                yield None
+                return
+            try:
+                manifest_file = open(self._manifest_path(version), "r", encoding="utf-8")
+            except FileNotFoundError:
+                continue  # 讀取指標後該版本已被清除，重新讀取指標
+            try:
+                fcntl.flock(manifest_file, fcntl.LOCK_SH)
+                # 取得共享鎖前版本可能已被清除（檔案已刪除），此時重新讀取指標
+                if not os.path.exists(manifest_file.name):
+                    continue
+                snapshot = Snapshot(self, json.load(manifest_file))
+                token = _pinned.set({**pinned, self.root: snapshot})
+                try:
+                    yield snapshot
+                finally:
+                    _pinned.reset(token)
+                return
+            finally:
+                manifest_file.close()
+
+    def _publish(self, version: int, columns: List[str], segments: List[str], rows: List[int],
+                 lineage: List[str]) -> None:
+        manifest = {
+            "version": version,
+            "columns": columns,
+            "segments": segments,
+            "rows": rows,
+            "lineage": lineage,
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+        }
+        self._write_atomic(self._manifest_path(version), json.dumps(manifest, ensure_ascii=False))
+        self._write_atomic(self.pointer, str(version))
+
+    def _write_segment(self, version: int, df: pd.DataFrame) -> str:
+        segment = f"seg-{version:06d}.csv"
+        path = os.path.join(self.root, segment)
+        tmp_path = f"{path}.tmp"
+        df.to_csv(tmp_path, index=False, encoding=CSV_ENCODING)
+        os.replace(tmp_path, path)
+        return segment
+
+    def _count_rows(self, segment: str) -> int:
+        return len(pd.read_csv(os.path.join(self.root, segment), usecols=[0], dtype=str,
+                               keep_default_na=False, encoding=CSV_ENCODING))
+
+    def _rows(self, snapshot: Snapshot) -> List[int]:
+        """各區段的筆數；舊格式的 manifest 沒有記錄時讀取區段計算"""
+        return [self._count_rows(segment) if rows is None else rows
+                for segment, rows in zip(snapshot.segments, snapshot.rows)]
+
+    def append(self, df: pd.DataFrame, default_columns: Optional[List[str]] = None) -> int:
+        """
+        以目前版本加上一個新區段建立新版本；欄位依現有欄位對齊。
+
+        :param default_columns: 尚無任何版本時使用的欄位
+        :return: 新版本號
+        """
+        os.makedirs(self.root, exist_ok=True)
+        self.current_version()
+        with locked(self.pointer):
+            current = self._read_pointer()
+            if current is None:
+                columns = default_columns or list(df.columns)
+                segments, rows, lineage = [], [], []
+            else:
+                snapshot = Snapshot(self, self._load_manifest(current))
+                columns, segments, rows, lineage = snapshot.columns, snapshot.segments, self._rows(snapshot), snapshot.lineage
+            version = (current or 0) + 1
+            df = df.reindex(columns=columns)
+            segment = self._write_segment(version, df)
+            segments, rows, lineage = segments + [segment], rows + [len(df)], lineage + [segment]
+            if len(segments) > MAX_SEGMENTS:
+                segments, rows = self._compact(version, segments, rows)
+            self._publish(version, columns, segments, rows, lineage)
+            self._collect_garbage(version)
+        return version
+
+    def replace(self, df: pd.DataFrame, base: Optional[Snapshot] = None) -> int:
+        """
+        以 df 整份取代資料建立新版本。
+
+        :param base: df 所依據的版本；之後其他寫入端追加的區段會保留在新版本中，
+                     若之後資料已被整份改寫則拋出 SnapshotConflict
+        :return: 新版本號
+        """
+        os.makedirs(self.root, exist_ok=True)
+        self.current_version()
+        with locked(self.pointer):
+            current = self._read_pointer()
+            version = (current or 0) + 1
+            carried, carried_rows, carried_lineage = [], [], []
+            if base is not None and current is not None and current != base.version:
+                snapshot = Snapshot(self, self._load_manifest(current))
+                if snapshot.lineage[:len(base.lineage)] != base.lineage:
+                    raise SnapshotConflict(f"{self.csv_file} 在第 {base.version} 版之後已被改寫（目前第 {current} 版）")
+                # base 之後追加的區段可能已與 base 的區段合併，依筆數取出 base 之後的資料
+                carried, carried_rows = self._tail(version, snapshot.segments, self._rows(snapshot),
+                                                   sum(self._rows(base)))
+                carried_lineage = snapshot.lineage[len(base.lineage):]
+                logger.info(f"{self.csv_file} 保留第 {base.version} 版之後追加的 {sum(carried_rows)} 筆資料")
+
+            segment = self._write_segment(version, df)
+            self._publish(version, list(df.columns), [segment] + carried, [len(df)] + carried_rows,
+                          [segment] + carried_lineage)
+            self._collect_garbage(version)
+        return version
+
+    def _read_segment(self, segment: str) -> pd.DataFrame:
+        return pd.read_csv(os.path.join(self.root, segment), dtype=str, keep_default_na=False, encoding=CSV_ENCODING)
+
+    def _write_raw(self, name: str, df: pd.DataFrame) -> str:
+        path = os.path.join(self.root, name)
+        df.to_csv(f"{path}.tmp", index=False, encoding=CSV_ENCODING)
+        os.replace(f"{path}.tmp", path)
+        return name
+
+    def _tail(self, version: int, segments: List[str], rows: List[int], offset: int) -> Tuple[List[str], List[int]]:
+        """第 offset 筆之後的資料：完整落在之後的區段直接沿用，跨過 offset 的區段只取後半另存新區段"""
+        carried, carried_rows, start = [], [], 0
+        for segment, count in zip(segments, rows):
+            if start >= offset:
+                carried.append(segment)
+                carried_rows.append(count)
+            elif start + count > offset:
+                tail = self._read_segment(segment).iloc[offset - start:]
+                carried.append(self._write_raw(f"seg-{version:06d}-t.csv", tail))
+                carried_rows.append(len(tail))
+            start += count
+        return carried, carried_rows
+
+    @staticmethod
+    def _compaction_run(rows: List[int]) -> Tuple[int, int]:
+        """
+        選擇要合併的相鄰區段 [start, end)：
+        從最後往前合併筆數不超過其後區段總和的區段（分層合併，每筆資料只會被重寫約 log n 次）；
+        只剩最後一個區段時改為合併筆數總和最小的相鄰兩個區段
+        """
+        start, total = len(rows) - 1, rows[-1]
+        while start > 0 and rows[start - 1] <= total:
+            start -= 1
+            total += rows[start]
+        if start < len(rows) - 1:
+            return start, len(rows)
+        start = min(range(len(rows) - 1), key=lambda i: rows[i] + rows[i + 1])
+        return start, start + 2
+
+    def _compact(self, version: int, segments: List[str], rows: List[int]) -> Tuple[List[str], List[int]]:
+        """合併部分相鄰區段為一個新區段（舊區段由垃圾回收清除），只讀取被合併的區段"""
+        start, end = self._compaction_run(rows)
+        merged = pd.concat([self._read_segment(segment) for segment in segments[start:end]], ignore_index=True)
+        compacted = self._write_raw(f"seg-{version:06d}-c.csv", merged)
+        logger.info(f"已將 {end - start} 個區段（{len(merged)} 筆）合併為 {compacted}")
+        return segments[:start] + [compacted] + segments[end:], rows[:start] + [len(merged)] + rows[end:]
+
+    def _collect_garbage(self, current: int) -> None:
+        """
+        清除舊版本：保留目前版本與最近 KEEP_VERSIONS 個版本，
+        更舊且未被讀取端鎖定的版本刪除，不再被任何 manifest 引用的區段一併刪除。
+        須在寫入鎖內呼叫。
+        """
+        versions = sorted(
+            (int(match.group(1)) for match in map(_MANIFEST_PATTERN.match, os.listdir(self.root)) if match),
+            reverse=True,
+        )
+        for version in versions[KEEP_VERSIONS + 1:]:
+            if version == current:
+                continue
+            path = self._manifest_path(version)
+            with open(path, "r", encoding="utf-8") as f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue  # 讀取端仍在使用
+                os.remove(path)
+
+        referenced = set()
+        for name in os.listdir(self.root):
+            if _MANIFEST_PATTERN.match(name):
+                with open(os.path.join(self.root, name), "r", encoding="utf-8") as f:
+                    referenced.update(json.load(f)["segments"])
+        for name in os.listdir(self.root):
+            if name.startswith("seg-") and name.endswith(".csv") and name not in referenced:
+                os.remove(os.path.join(self.root, name))
+
+    def export(self, path: Optional[str] = None) -> int:
+        """將目前版本匯出為單一 CSV（預設為原本的檔名）"""
+        with self.pin() as snapshot:
+            if snapshot is None:
+                return 0
+            df = snapshot.read_csv(dtype=str, keep_default_na=False, encoding=CSV_ENCODING)
+        path = path or self.csv_file
+        df.to_csv(f"{path}.tmp", index=False, encoding=CSV_ENCODING)
+        os.replace(f"{path}.tmp", path)
+        return len(df)
+
+
+_stores: Dict[str, SnapshotStore] = {}
+
+
+def store(csv_file: str) -> SnapshotStore:
+    """取得 CSV 資料集的快照存放區"""
+    if csv_file not in _stores:
+        _stores[csv_file] = SnapshotStore(csv_file)
+    return _stores[csv_file]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        level=logging.INFO,
+    )
+    parser = argparse.ArgumentParser(description="CSV 資料集的版本化快照")
+    parser.add_argument("csv_file", help="資料集原本的 CSV 檔名，例如 stock_roe_data.csv")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("status", help="顯示目前版本與區段")
+    export_parser = subparsers.add_parser("export", help="匯出目前版本為單一 CSV")
+    export_parser.add_argument("--output", help="輸出路徑（預設為原本的檔名）")
+    args = parser.parse_args()
+
+    snapshot_store = store(args.csv_file)
+    if args.command == "export":
+        print(f"已匯出 {snapshot_store.export(args.output)} 筆資料")
+    else:
+        with snapshot_store.pin() as snapshot:
+            if snapshot is None:
+                print("尚無任何版本")
+            else:
+                print(f"第 {snapshot.version} 版，{len(snapshot.segments)} 個區段：{', '.join(snapshot.segments)}")
@@ -0,0 +1,130 @@
+import csv
+from typing import Dict, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+import pyarrow.dataset as ds
+
+# Goodinfo 匯出的 StockList*.csv 欄位型別宣告
+# id: ="1445" 形式的代號；name: 去除 * 註記；int/number: 去除千分位與正號；category: 落點欄位
+STOCK_LIST_SCHEMA: Dict[str, str] = {
+    "排名": "int",
+    "代號": "id",
+    "名稱": "name",
+    "成交": "number",
+    "漲跌價": "number",
+    "漲跌幅": "number",
+    "統計年數": "int",
+    # StockListPer / StockList1-4（本益比、股價淨值比）
+    "股價目前落點": "category",
+    "歷年股價平均": "number",
+    "歷年股價高點平均": "number",
+    "歷年股價低點平均": "number",
+    "股價高低價差(倍)": "number",
+    "平均EPS": "number",
+    "平均PER": "number",
+    "目前PER": "number",
+    "平均最低PER": "number",
+    "平均最高PER": "number",
+    "PER目前落點": "category",
+    "平均BPS": "number",
+    "目前PBR": "number",
+    "平均PBR": "number",
+    "平均最低PBR": "number",
+    "平均最高PBR": "number",
+    "PBR目前落點": "category",
+    # StockList（財報）
+    "平均營收(億)": "number",
+    "營收成長(%)": "number",
+    "平均毛利(億)": "number",
+    "毛利成長(%)": "number",
+    "平均毛利(%)": "number",
+    "平均營益(億)": "number",
+    "營益成長(%)": "number",
+    "平均營益(%)": "number",
+    "平均淨利(億)": "number",
+    "淨利成長(%)": "number",
+    "平均淨利(%)": "number",
+    "平均ROA(%)": "number",
+    "平均ROA增減": "number",
+    "平均ROE(%)": "number",
+    "平均ROE增減": "number",
+    "平均EPS(元)": "number",
+    "平均EPS增減": "number",
+    "平均財報評分": "number",
+}
+
+STOCK_LIST_SHARDS = ["StockList1.csv", "StockList2.csv", "StockList3.csv", "StockList4.csv"]
+
+_NUMBER_PATTERN = r"^-?\d+(\.\d+)?$"
+
+
+def _read_header(path: str) -> List[str]:
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        return next(csv.reader(f), [])
+
+
+def _convert_column(column: pa.ChunkedArray, kind: str) -> pa.ChunkedArray:
+    """依型別宣告以 Arrow 向量化運算轉換整欄字串"""
+    if kind == "id":
+        # ="1445" -> 1445
+        return pc.replace_substring_regex(column, r'^="?|"$', "")
+    if kind == "name":
+        return pc.replace_substring(column, "*", "")
+    if kind == "category":
+        return pc.dictionary_encode(column)
+    if kind in ("number", "int"):
+        # "2,024" -> 2024、"+1.92" -> 1.92、"-" / 空字串 -> null
+        cleaned = pc.replace_substring_regex(pc.utf8_trim_whitespace(column), r"^\+|,", "")
+        valid = pc.match_substring_regex(cleaned, _NUMBER_PATTERN)
+        numbers = pc.cast(pc.if_else(valid, cleaned, pa.scalar(None, pa.string())), pa.float64())
+        return pc.cast(numbers, pa.int64(), safe=False) if kind == "int" else numbers
+    return column
+
+
+def _to_frame(table: pa.Table, schema: Dict[str, str]) -> pd.DataFrame:
+    columns = [_convert_column(table[name], schema.get(name, "text")) for name in table.column_names]
+    converted = pa.Table.from_arrays(columns, names=table.column_names)
+    return converted.to_pandas()
+
+
+def _string_format(columns: List[str]) -> ds.CsvFileFormat:
+    """所有欄位先以字串讀入，轉換統一在 _convert_column 處理"""
+    return ds.CsvFileFormat(
+        read_options=pv.ReadOptions(encoding="utf-8"),
+        convert_options=pv.ConvertOptions(
+            column_types={name: pa.string() for name in columns},
+            strings_can_be_null=True,
+            quoted_strings_can_be_null=True,
+        ),
+    )
+
+
+def load_stock_list_csv(path: str, usecols: Optional[List[str]] = None,
+                        schema: Dict[str, str] = STOCK_LIST_SCHEMA) -> pd.DataFrame:
+    """
+    讀取單一 Goodinfo 匯出檔，並依 schema 轉換欄位型別。
+
+    :param path: CSV 路徑 (如 StockList.csv、StockListPer.csv)
+    :param usecols: 只讀取的欄位，None 表示全部
+    :return: 型別正確的 DataFrame（代號為字串、數值為 float、落點為 category）
+    """
+    return load_stock_list_shards([path], usecols, schema)
+
+
+def load_stock_list_shards(paths: Optional[List[str]] = None, usecols: Optional[List[str]] = None,
+                           schema: Dict[str, str] = STOCK_LIST_SCHEMA) -> pd.DataFrame:
+    """
+    一次讀取並串接多個相同格式的匯出檔（預設為 StockList1-4.csv）。
+
+    :param paths: CSV 路徑列表
+    :param usecols: 只讀取的欄位，None 表示全部
+    :return: 串接後型別正確的 DataFrame
+    """
+    paths = paths or STOCK_LIST_SHARDS
+    header = _read_header(paths[0])
+    dataset = ds.dataset(paths, format=_string_format(header))
+    table = dataset.to_table(columns=usecols or header)
+    return _to_frame(table, schema)
@@ -1,20 +1,34 @@
 import pandas as pd
 import logging
 import os
-import requests
 import signal
 import sys
 from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackContext
+from telegram.ext import Application, CommandHandler, MessageHandler, TypeHandler, filters, CallbackContext
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
 import numpy as np
 import asyncio
 import json
-import aiohttp
 import time
+import unicodedata
 from typing import Dict, List, Optional
 import pickle
+import industry_cube
+import negative_cache
+import ohlcv_store
+import price_table
+import snapshot_store
+import update_latency
+from finmind_client import FinMindAPIError, fetch_dataset, get_taiwan_stock_list
+from dividend_calendar import KIND_LABELS, CalendarError, parse_exdiv_args, upcoming
+from forecast_fundamentals import load_forward_estimates
+from profiler import profiled
+from roe_data import ROE_START_DATE, IngestError, ingest_market_per, latest_roe_date
+from quarterly_rollup import get_rollups, load_rollups, quarterly_estimates, rebuild_rollups, update_rollups
+from screener import ScreenError, load_screener, parse_screen_args, DISPLAY_COLUMNS, PAGE_SIZE
+from similarity import DEFAULT_TOP_K, SimilarError, load_similarity_index, DISPLAY_COLUMNS as SIMILAR_COLUMNS
+from watchlist import BAND_ALIASES, BAND_COLUMNS, WatchError, WatchIndex, describe, format_alert, parse_band
 
 # 設定日誌
 logging.basicConfig(
@@ -38,6 +52,7 @@ CACHE_EXPIRY_DAYS = 7  # 改為 7 天，因為基本面數據變化較慢
 BATCH_SIZE = 100  # 增加批次大小
 DELAY_BETWEEN_BATCHES = 1  # 減少批次間延遲到 30 秒
 MAX_CONCURRENT_REQUESTS = 10  # 增加並發請求數
+MAX_TICKERS = 30  # /stock_estimate、/etf 一次最多查詢的代號數
 
 # 緩存數據結構
 class StockDataCache:
@@ -68,7 +83,8 @@ class StockDataCache:
         try:
             with open(CACHE_FILE, 'rb') as f:
                 return pickle.load(f)
-        except (FileNotFoundError, pickle.PickleError):
+        except (FileNotFoundError, EOFError, AttributeError, pickle.PickleError):
+            # AttributeError：快取是在其他模組（例如以 __main__ 執行時）存檔的，類別路徑不同
             return cls()
 
 # 全局緩存對象
@@ -90,7 +106,6 @@ from telegram.ext import CallbackContext
 
 load_dotenv()
 FINMIND_API_KEY = os.getenv("FINMIND_API_KEY")
-FINMIND_URL = "https://api.finmindtrade.com/api/v4/data"
 
 # 讀取股票基本資訊 CSV
 CSV_FILE = "Calculated_Stock_Values.csv"
@@ -117,159 +132,566 @@ async def start(update: Update, context: CallbackContext) -> None:
 # Telegram Bot 指令：/stock_estimate 2330
 async def stock_estimate(update: Update, context: CallbackContext) -> None:
     if not context.args:
-        await update.message.reply_text("請輸入股票代號，例如：/stock_estimate 2330")
+        await update.message.reply_text("請輸入股票代號，例如：/stock_estimate 2330（可一次輸入多個代號）")
+        return
+
+    # 多個代號時以表格一次回覆
+    if len(context.args) > 1:
+        await stock_estimate_bulk(update, _parse_tickers(context.args))
         return
 
     stock_id = context.args[0]
-    df_result, now_price = await calculate_quarterly_stock_estimates(stock_id)
+    rows, _ = await compute_stock_estimates([stock_id])
 
-    if df_result is None:
+    if not rows:
         await update.message.reply_text(f"⚠️ 無法獲取 {stock_id} 的數據，請檢查 API 設定或股票代號")
         return
-
-    # 計算統計數據的平均值
-    avg_roe = df_result['ROE'].mean()
-    avg_per_high = df_result['PER_最高值'].mean()
-    avg_per_normal = df_result['PER_平均值'].mean()
-    avg_per_low = df_result['PER_最低值'].mean()
-
-    # 使用最新一筆的 BVPS 和平均 ROE 計算推估 EPS
-    latest_bvps = df_result.iloc[0]['BVPS']  # 最新一筆的 BVPS
-    estimated_eps = latest_bvps * (avg_roe / 100)  # 使用平均 ROE 計算
-
-    # 使用推估 EPS 和平均 PER 計算股價區間
-    low_price = estimated_eps * avg_per_low
-    normal_price = estimated_eps * avg_per_normal
-    high_price = estimated_eps * avg_per_high
+    row = rows[0]
 
     # 生成回應訊息
     message = f"📊 **{stock_id} 季度 ROE & 推估股價** 📊\n"
-    message += f"\n🔹 **當前股價**: {now_price:.2f} 元\n"
+    message += f"\n🔹 **當前股價**: {row['quarter_price']:.2f} 元\n"
     
     # 添加統計數據
     message += f"\n📈 **統計數據（近20季平均）**:\n"
-    message += f"📊 **平均 ROE**: {avg_roe:.2f}%\n"
-    message += f"📈 **平均 PER 區間**: {avg_per_low:.2f} ~ {avg_per_normal:.2f} ~ {avg_per_high:.2f}\n"
-    message += f"💰 **推估EPS**: {estimated_eps:.2f} 元 (使用最新 BVPS: {latest_bvps:.2f} × 平均 ROE: {avg_roe:.2f}%)\n"
-    message += f"📉 **推估股價區間**: {low_price:.2f} ~ {normal_price:.2f} ~ {high_price:.2f} 元\n"
+    message += f"📊 **平均 ROE**: {row['avg_roe']:.2f}%\n"
+    message += f"📈 **平均 PER 區間**: {row['avg_per_low']:.2f} ~ {row['avg_per_normal']:.2f} ~ {row['avg_per_high']:.2f}\n"
+    message += f"💰 **推估EPS**: {row['estimated_eps']:.2f} 元 (使用最新 BVPS: {row['latest_bvps']:.2f} × 平均 ROE: {row['avg_roe']:.2f}%)\n"
+    message += f"📉 **推估股價區間**: {row['low_price']:.2f} ~ {row['normal_price']:.2f} ~ {row['high_price']:.2f} 元\n"
+    message += _forward_band_message(row)
+    message += _industry_message(row)
 
     await update.message.reply_text(message, parse_mode="Markdown")
 
 
+async def compute_stock_estimates(stock_ids, current_prices=None):
+    """
+    /stock_estimate 的計算部分（不依賴 Telegram，CLI 批次模式共用）
+
+    :param current_prices: {stock_id: 最新股價}，None 時不查詢最新股價
+    :return: (每支股票的推估結果 [dict, ...], 無法取得數據的代號)
+    """
+    results = await calculate_quarterly_stock_estimates_bulk(stock_ids)
+    summary = summarize_estimates(results)
+    if summary.empty:
+        return [], list(stock_ids)
+    summary = summary.join(_forward_bands(summary)).join(_industry_relative(summary))
+
+    rows, failed = [], []
+    for stock_id in stock_ids:
+        if stock_id not in summary.index:
+            failed.append(stock_id)
+            continue
+        row = summary.loc[stock_id].to_dict()
+        row = {key: (None if pd.isna(value) else value) for key, value in row.items()}
+        current_price = (current_prices or {}).get(stock_id)
+        rows.append({"stock_id": stock_id, "current_price": current_price, **row})
+    return rows, failed
+
+
+FORWARD_COLUMNS = ["forward_quarter", "forward_model", "forward_roe", "forward_eps", "forward_eps_mae",
+                   "forward_low_price", "forward_normal_price", "forward_high_price"]
+
+
+def _forward_bands(summary):
+    """以 forecast_fundamentals 預先計算的 EPS 預測與平均 PER 組合前瞻股價區間（以 stock_id 為索引）"""
+    bands = pd.DataFrame(index=summary.index, columns=FORWARD_COLUMNS, dtype=object)
+    try:
+        forward = load_forward_estimates(list(summary.index))
+    except Exception as e:
+        logger.error(f"讀取基本面預測時發生錯誤: {str(e)}")
+        return bands
+    if "eps_forecast" not in forward:
+        return bands
+
+    forward = forward.reindex(summary.index)
+    eps = forward["eps_forecast"]
+    bands["forward_quarter"] = forward["quarter"]
+    bands["forward_model"] = forward["eps_model"]
+    bands["forward_roe"] = forward["roe_forecast"] if "roe_forecast" in forward else np.nan
+    bands["forward_eps"] = eps
+    bands["forward_eps_mae"] = forward["eps_mae"]
+    bands["forward_low_price"] = eps * summary["avg_per_low"]
+    bands["forward_normal_price"] = eps * summary["avg_per_normal"]
+    bands["forward_high_price"] = eps * summary["avg_per_high"]
+    return bands
+
+
+def _forward_band_message(row):
+    """前瞻股價區間的訊息，尚未預測時回傳空字串"""
+    if row.get("forward_eps") is None:
+        return ""
+
+    message = f"\n🔮 **前瞻預測（{row['forward_quarter']}，模型 {row['forward_model']}）**:\n"
+    if row.get("forward_roe") is not None:
+        message += f"📊 **預測 ROE**: {row['forward_roe']:.2f}%\n"
+    message += f"💰 **預測EPS**: {row['forward_eps']:.2f} 元"
+    if row.get("forward_eps_mae") is not None:
+        message += f" (回測誤差 ±{row['forward_eps_mae']:.2f})"
+    message += (f"\n📉 **前瞻股價區間**: {row['forward_low_price']:.2f} ~ {row['forward_normal_price']:.2f}"
+                f" ~ {row['forward_high_price']:.2f} 元\n")
+    return message
+
+
+INDUSTRY_COLUMNS = ["industry", "industry_quarter", "industry_per_pct", "industry_pbr_pct", "industry_roe_pct",
+                    "industry_per_median", "industry_pbr_median", "industry_roe_median"]
+
+
+def load_industry_relative(stock_ids=None):
+    """讀取 industry_cube 預先計算的產業百分位（以 stock_id 為索引、INDUSTRY_COLUMNS 欄位），讀取失敗時為空"""
+    try:
+        relative = industry_cube.load_relative(stock_ids)
+    except Exception as e:
+        logger.error(f"讀取產業相對估值時發生錯誤: {str(e)}")
+        return pd.DataFrame(columns=INDUSTRY_COLUMNS)
+    if relative.empty:
+        return pd.DataFrame(columns=INDUSTRY_COLUMNS)
+    relative = relative.rename(columns={
+        "quarter": "industry_quarter",
+        **{f"{metric}_pct": f"industry_{metric}_pct" for metric in ["per", "pbr", "roe"]},
+        **{f"{metric}_median": f"industry_{metric}_median" for metric in ["per", "pbr", "roe"]},
+    })
+    return relative.reindex(columns=INDUSTRY_COLUMNS)
+
+
+def _industry_relative(summary):
+    """股票在產業內的 PER/PBR/ROE 百分位（以 stock_id 為索引）"""
+    return load_industry_relative(list(summary.index)).reindex(summary.index).astype(object)
+
+
+def _industry_message(row):
+    """產業相對估值的訊息，尚未建立或同業不足時回傳空字串"""
+    if row.get("industry") is None:
+        return ""
+
+    lines = []
+    for metric, unit in [("per", ""), ("pbr", ""), ("roe", "%")]:
+        pct, median = row.get(f"industry_{metric}_pct"), row.get(f"industry_{metric}_median")
+        if pct is not None and median is not None:
+            lines.append(f"{metric.upper()} 第 {pct:.0f} 百分位（產業中位數 {median:.2f}{unit}）")
+    if not lines:
+        return ""
+    return f"\n🏭 **產業相對估值（{row['industry']}，{row['industry_quarter']}）**:\n" + "\n".join(lines) + "\n"
+
+
 async def etf(update: Update, context: CallbackContext) -> None:
     if not context.args:
-        await update.message.reply_text("請輸入 ETF 代號，例如：/etf 00713")
+        await update.message.reply_text("請輸入 ETF 代號，例如：/etf 00713（可一次輸入多個代號，如 /etf 0056 00878 00713）")
         return
     
-    # 🔹 查詢當前股價
+    # 多個代號時以表格一次回覆
+    if len(context.args) > 1:
+        await etf_bulk(update, _parse_tickers(context.args))
+        return
+
+    # 🔹 查詢當前股價，計算最近一年配息總額 & 殖利率
     stock_id = context.args[0]
-    current_price = await get_current_stock_price(stock_id)
+    rows, _ = await compute_etf([stock_id])
 
-    if current_price is None:
+    if not rows:
         await update.message.reply_text(f"無法獲取 {stock_id} 的最新股價，請稍後再試")
         return
-
-    # 🔹 計算最近一年配息總額 & 殖利率
-    # total_dividends, dividend_yield = calculate_dividend_yield(stock_id, current_price)
-    total_dividends, dividend_yield, dividends_count = calculate_all_dividend_yield(stock_id, current_price)
+    row = rows[0]
 
     # 🔹 回應訊息
     message = (
         f"📊 **ETF 資訊 - {stock_id}**\n"
-        f"🔹 **當前股價**: {current_price:.2f} 元\n"
-        f"💸 **最近一年配息總額**: {total_dividends:.2f} 元 💰\n"
-        f"📊 **殖利率**: {dividend_yield:.2f}%\n"
-        f"🔹 **配息筆數**: {dividends_count} 筆\n"
+        f"🔹 **當前股價**: {row['current_price']:.2f} 元\n"
+        f"💸 **最近一年配息總額**: {row['total_dividends']:.2f} 元 💰\n"
+        f"📊 **殖利率**: {row['dividend_yield']:.2f}%\n"
+        f"🔹 **配息筆數**: {row['dividends_count']} 筆\n"
     )
     
     await update.message.reply_text(message, parse_mode="Markdown")
 
 
-async def get_stock_price_from_date(stock_id, query_date):
+def _table_header(columns):
+    """等寬表格的表頭，中文字以兩格寬計算；columns 為 [(標題, 寬度, 靠左)]"""
+    header = ""
+    for title, width, left in columns:
+        padding = " " * max(width - sum(2 if unicodedata.east_asian_width(c) in "WF" else 1 for c in title), 0)
+        header += title + padding if left else padding + title
+    return header
+
+
+def _parse_tickers(args):
+    """去除重複代號（保留順序），最多 MAX_TICKERS 個"""
+    return list(dict.fromkeys(arg.strip().upper() for arg in args if arg.strip()))[:MAX_TICKERS]
+
+
+async def stock_estimate_bulk(update: Update, stock_ids) -> None:
+    """多支股票的推估股價：一次查詢全市場股價、一次讀取季度彙總，回覆一張表格"""
+    current_prices = await get_current_stock_prices(stock_ids)
+    rows, failed = await compute_stock_estimates(stock_ids, current_prices)
+
+    lines = [_table_header([("代號", 6, True), ("現價", 8, False), ("ROE%", 7, False),
+                            ("低價", 8, False), ("合理價", 8, False), ("高價", 8, False)])]
+    for row in rows:
+        price = row["current_price"] if row["current_price"] is not None else row["quarter_price"]
+        lines.append(
+            f"{row['stock_id']:<6}{price:>8.2f}{row['avg_roe']:>7.1f}"
+            f"{row['low_price']:>8.2f}{row['normal_price']:>8.2f}{row['high_price']:>8.2f}"
+        )
+
+    message = "📊 季度 ROE & 推估股價\n"
+    if len(lines) > 1:
+        message += "```\n" + "\n".join(lines) + "\n```\n"
+    if failed:
+        message += f"⚠️ 無法獲取數據：{', '.join(failed)}\n"
+    await update.message.reply_text(message, parse_mode="Markdown")
+
+
+async def compute_etf(stock_ids, current_prices=None):
     """
-    根據指定的 query_date (YYYY-MM-DD) 查詢該日期至今的股票每日價格資料，
-    並只回傳 "date", "stock_id" 與 "close" 三個欄位。
+    /etf 的計算部分（不依賴 Telegram，CLI 批次模式共用）
+
+    :param current_prices: {stock_id: 最新股價}，None 時一次查詢全市場股價
+    :return: (每支 ETF 的配息與殖利率 [dict, ...], 無法取得最新股價的代號)
+    """
+    if current_prices is None:
+        current_prices = await get_current_stock_prices(stock_ids)
+    found = {stock_id: current_prices[stock_id] for stock_id in stock_ids if stock_id in current_prices}
+    rows = [
+        {"stock_id": stock_id, "current_price": found[stock_id], "total_dividends": total_dividends,
+         "dividend_yield": dividend_yield, "dividends_count": dividends_count}
+        for stock_id, (total_dividends, dividend_yield, dividends_count) in calculate_all_dividend_yields(found).items()
+    ]
+    return rows, [stock_id for stock_id in stock_ids if stock_id not in found]
+
+
+async def etf_bulk(update: Update, stock_ids) -> None:
+    """多支 ETF 的殖利率：一次查詢全市場股價、一次掃描配息資料，回覆一張表格"""
+    rows, failed = await compute_etf(stock_ids)
+
+    lines = [_table_header([("代號", 7, True), ("現價", 8, False), ("年配息", 8, False),
+                            ("殖利率%", 8, False), ("筆數", 5, False)])]
+    for row in rows:
+        lines.append(f"{row['stock_id']:<7}{row['current_price']:>8.2f}{row['total_dividends']:>8.2f}"
+                     f"{row['dividend_yield']:>8.2f}{row['dividends_count']:>5}")
+
+    message = "📊 ETF 最近一年配息與殖利率\n"
+    if rows:
+        message += "```\n" + "\n".join(lines) + "\n```\n"
+    if failed:
+        message += f"⚠️ 無法獲取最新股價：{', '.join(failed)}\n"
+    await update.message.reply_text(message, parse_mode="Markdown")
+
+
+# 價格區間提醒
+WATCH_INTERVAL = int(os.getenv("WATCH_INTERVAL", "1800"))  # 檢查間隔（秒）
+watch_index = None
+_watch_bands = {"date": None, "checked": set(), "bands": pd.DataFrame()}
+
+
+def get_watch_index():
+    global watch_index
+    if watch_index is None:
+        watch_index = WatchIndex.load()
+    return watch_index
+
+
+async def load_watch_bands(stock_ids):
+    """訂閱股票的推估股價區間；區間依季度資料變動，每天只計算一次，新股票才補算"""
+    today = datetime.today().date()
+    if _watch_bands["date"] != today:
+        _watch_bands.update(date=today, checked=set(), bands=pd.DataFrame())
+
+    missing = [stock_id for stock_id in stock_ids if stock_id not in _watch_bands["checked"]]
+    if missing:
+        summary = summarize_estimates(await calculate_quarterly_stock_estimates_bulk(missing))
+        frames = [df for df in [_watch_bands["bands"], summary] if not df.empty]
+        if frames:
+            _watch_bands["bands"] = pd.concat(frames)
+        _watch_bands["checked"].update(missing)
+    return _watch_bands["bands"]
+
+
+async def watch(update: Update, context: CallbackContext) -> None:
+    """
+    訂閱價格區間提醒
+    例如：/watch 2330 low、/watch 2330 正常、/watch 0056 yield 6
     """
-    check_date = query_date  # 使用指定日期
-
-    date_str = check_date.strftime('%Y-%m-%d')
-    parameter = {
-        "dataset": "TaiwanStockPrice",
-        "data_id": stock_id,
-        "start_date": date_str,
-        "token": FINMIND_API_KEY,
+    if len(context.args) < 2:
+        await update.message.reply_text(
+            "用法：/watch <股票代號> <low|normal|high>，或 /watch <股票代號> yield <目標殖利率%>\n"
+            "股價穿越推估的低/正常/高股價，或殖利率穿越目標時通知"
+        )
+        return
+
+    stock_id = context.args[0].upper()
+    try:
+        band, target = parse_band(context.args[1:])
+    except WatchError as e:
+        await update.message.reply_text(f"⚠️ {str(e)}")
+        return
+
+    message = f"✅ 已訂閱 {stock_id} {describe(band, target)} 提醒"
+    if band in BAND_COLUMNS:
+        bands = await load_watch_bands([stock_id])
+        if stock_id not in bands.index:
+            await update.message.reply_text(f"⚠️ 無法計算 {stock_id} 的推估股價區間，無法訂閱")
+            return
+        message += f"（目前為 {bands.at[stock_id, BAND_COLUMNS[band]]:.2f} 元）"
+
+    get_watch_index().add(update.effective_chat.id, stock_id, band, target)
+    await update.message.reply_text(message)
+
+
+async def unwatch(update: Update, context: CallbackContext) -> None:
+    """取消訂閱：/unwatch 2330 [low|normal|high|yield]"""
+    if not context.args:
+        await update.message.reply_text("用法：/unwatch <股票代號> [low|normal|high|yield]")
+        return
+
+    stock_id = context.args[0].upper()
+    band = None
+    if len(context.args) > 1:
+        band = BAND_ALIASES.get(context.args[1], context.args[1].lower())
+    count = get_watch_index().remove(update.effective_chat.id, stock_id, band)
+    await update.message.reply_text(f"已取消 {count} 筆 {stock_id} 的訂閱" if count else f"沒有 {stock_id} 的訂閱")
+
+
+async def watchlist(update: Update, context: CallbackContext) -> None:
+    """列出目前的訂閱"""
+    subscriptions = get_watch_index().for_chat(update.effective_chat.id)
+    if not subscriptions:
+        await update.message.reply_text("目前沒有訂閱，使用 /watch <股票代號> <區間> 新增")
+        return
+    message = "🔔 價格提醒訂閱：\n" + "\n".join(
+        f"- {stock_id} {describe(band, target)}" for stock_id, band, target in subscriptions
+    )
+    await update.message.reply_text(message)
+
+
+async def check_watchlist(context: CallbackContext) -> None:
+    """定期工作：取一次全市場股價快照，透過反向索引判斷所有訂閱"""
+    index = get_watch_index()
+    stock_ids = index.stock_ids()
+    if not stock_ids:
+        return
+
+    prices = await get_current_stock_prices(stock_ids)
+    if not prices:
+        return
+    bands = await load_watch_bands(list(prices))
+    yield_ids = [stock_id for stock_id in index.yield_stock_ids() if stock_id in prices]
+    yields = {
+        stock_id: dividend_yield
+        for stock_id, (_, dividend_yield, count) in calculate_all_dividend_yields(
+            {stock_id: prices[stock_id] for stock_id in yield_ids}).items()
+        if count > 0
     }
-    async with aiohttp.ClientSession() as session:
-        async with session.get(FINMIND_URL, params=parameter) as response:
-            if response.status != 200:
-                logger.error(f"API 请求失败，狀態碼：{response.status}")
-                return None
-            data = await response.json()
-            if "data" in data and isinstance(data["data"], list) and len(data["data"]) > 0:
-                df_price = pd.DataFrame(data["data"])
-                # 只保留 date, stock_id, close 欄位
-                required_cols = ["date", "stock_id", "close"]
-                # 確保所有需要的欄位存在
-                for col in required_cols:
-                    if col not in df_price.columns:
-                        logger.error(f"數據中缺少必要欄位: {col}")
-                        return None
-                df_price = df_price[required_cols]
-                return df_price
-        return None
 
+    alerts = index.evaluate(prices, bands, yields)
+    for alert in alerts:
+        text = format_alert(alert)
+        for chat_id in alert["chat_ids"]:
+            try:
+                await context.bot.send_message(chat_id=chat_id, text=text)
+            except Exception as e:
+                logger.error(f"發送提醒給 {chat_id} 時發生錯誤: {str(e)}")
+    logger.info(f"價格提醒檢查完成：{len(prices)} 支股票，{index.size()} 筆訂閱，{len(alerts)} 個門檻被穿越")
+
+
+async def screen(update: Update, context: CallbackContext) -> None:
+    """
+    多條件篩選 Calculated_Stock_Values
+    例如：/screen ROE>15 PBR<1.5 成交<最低合理股價 PER目前落點=破低,低 page=2
+    """
+    if not context.args:
+        await update.message.reply_text(
+            "請輸入篩選條件，例如：/screen ROE>15 PBR<1.5 成交<最低合理股價 PER目前落點=破低,低\n"
+            "可加上 sort=欄位、asc/desc、page=頁數"
+        )
+        return
+
+    try:
+        conditions, options = parse_screen_args(context.args)
+        page = int(options.get("page", 1))
+        screener = load_screener(CSV_FILE)
+        total, df_page = screener.query(
+            conditions,
+            sort_by=options.get("sort"),
+            ascending=options.get("order") == "asc",
+            page=page,
+        )
+    except (ScreenError, ValueError) as e:
+        await update.message.reply_text(f"⚠️ {str(e)}")
+        return
+
+    if total == 0:
+        await update.message.reply_text("沒有符合條件的股票")
+        return
 
+    # 顯示固定欄位與條件中用到的欄位
+    extra_columns = [screener.resolve_column(column) for column, _, _ in conditions]
+    columns = list(dict.fromkeys(DISPLAY_COLUMNS + extra_columns))
+    pages = (total - 1) // PAGE_SIZE + 1
 
+    message = f"🔎 篩選結果：共 {total} 支（第 {page}/{pages} 頁）\n\n"
+    for _, row in df_page.iterrows():
+        message += f"{row['代號']} {row['名稱']}\n"
+        message += "   " + "、".join(
+            f"{column}: {row[column]:.2f}" if isinstance(row[column], float) else f"{column}: {row[column]}"
+            for column in columns[2:]
+        ) + "\n"
 
+    await update.message.reply_text(message)
 
-# 修改 get_current_stock_price 函數為異步函數
-async def get_current_stock_price(stock_id):
-    """获取股票当前价格，直接从 API 获取最近5天的数据"""
+
+def compute_similar(stock_id, k=DEFAULT_TOP_K):
+    """
+    /similar 的計算部分（不依賴 Telegram，CLI 批次模式共用）
+
+    :return: 與 stock_id 估值特徵最接近的 k 支股票 [dict, ...]，依距離由近到遠
+    :raises SimilarError: 找不到該股票
+    """
+    peers = load_similarity_index(CSV_FILE).similar(stock_id, k)
+    columns = [column for column in SIMILAR_COLUMNS if column in peers.columns] + ["distance"]
+    return [
+        {key: (None if pd.isna(value) else value) for key, value in row.items()}
+        for row in peers[columns].to_dict("records")
+    ]
+
+
+async def similar(update: Update, context: CallbackContext) -> None:
+    """
+    估值特徵（ROE、PER/PBR 與落點、利潤率、成長、財報評分）最接近的股票
+    例如：/similar 2603 或 /similar 2603 20
+    """
+    if not context.args:
+        await update.message.reply_text(f"請輸入股票代號，例如：/similar 2603（可加上數量，預設 {DEFAULT_TOP_K} 支）")
+        return
+
+    stock_id = context.args[0].strip().upper()
+    if len(context.args) > 1 and not context.args[1].isdigit():
+        await update.message.reply_text(f"⚠️ 數量需為正整數：{context.args[1]}")
+        return
     try:
-        # 获取最近5天的数据
-        parameter = {
-            "dataset": "TaiwanStockPrice",
-            "start_date": (datetime.today() - timedelta(days=5)).strftime('%Y-%m-%d'),
-            "token": FINMIND_API_KEY,
-        }
+        peers = compute_similar(stock_id, int(context.args[1]) if len(context.args) > 1 else DEFAULT_TOP_K)
+    except SimilarError as e:
+        await update.message.reply_text(f"⚠️ {str(e)}")
+        return
+
+    message = f"🧭 與 {stock_id} 估值特徵最相近的 {len(peers)} 支股票\n\n"
+    for i, row in enumerate(peers, 1):
+        message += f"{i}. {row['代號']} {row['名稱']}（距離 {row['distance']:.2f}）\n"
+        message += "   " + "、".join(
+            f"{column}: {row[column]:.2f}" if isinstance(row[column], float) else f"{column}: {row[column]}"
+            for column in SIMILAR_COLUMNS[2:] if row.get(column) is not None
+        ) + "\n"
+
+    await update.message.reply_text(message)
+
+
+EXDIV_MAX_ROWS = 30  # /exdiv 最多列出的事件數
+
+
+def compute_exdiv(days, min_yield=None, kind="ex", strict=False):
+    """
+    /exdiv 的計算部分（不依賴 Telegram，CLI 批次模式共用）
+
+    :return: 未來 days 天內的除權息或發放事件 [dict, ...]，依日期排序
+    """
+    events = upcoming(days, min_yield, kind, csv_file=DIVIDEND_CSV_FILE, strict=strict)
+    events["date"] = events["date"].astype(str)
+    return [
+        {key: (None if pd.isna(value) else value) for key, value in row.items()}
+        for row in events.to_dict("records")
+    ]
+
+
+async def exdiv(update: Update, context: CallbackContext) -> None:
+    """
+    即將除權息或發放股利的股票
+    例如：/exdiv、/exdiv 14 yield>5、/exdiv 30 pay
+    """
+    try:
+        days, min_yield, kind, strict = parse_exdiv_args(context.args or [])
+    except CalendarError as e:
+        await update.message.reply_text(f"⚠️ {str(e)}\n用法：/exdiv [天數] [yield>殖利率] [ex|cash|stock|pay]")
+        return
+
+    events = compute_exdiv(days, min_yield, kind, strict)
+    condition = f"、現金殖利率 {'>' if strict else '≥'} {min_yield:g}%" if min_yield is not None else ""
+    if not events:
+        await update.message.reply_text(f"未來 {days} 天內沒有符合條件{condition}的事件")
+        return
+
+    message = f"📅 未來 {days} 天{condition}：共 {len(events)} 筆\n\n"
+    for event in events[:EXDIV_MAX_ROWS]:
+        message += f"{event['date'][5:]} {KIND_LABELS[event['kind']]} {event['stock_id']}"
+        if event["kind"] == "stock_ex":
+            message += f" 股票股利 {event['stock']:g} 元"
+        else:
+            message += f" 現金 {event['cash']:g} 元"
+            if event["cash_yield"] is not None:
+                message += f"（殖利率 {event['cash_yield']:.2f}%）"
+        message += "\n"
+    if len(events) > EXDIV_MAX_ROWS:
+        message += f"...其餘 {len(events) - EXDIV_MAX_ROWS} 筆未列出\n"
+
+    await update.message.reply_text(message)
 
-        async with aiohttp.ClientSession() as session:
-            async with session.get(FINMIND_URL, params=parameter) as response:
-                if response.status != 200:
-                    logger.error(f"API 请求失败，状态码：{response.status}")
-                    return None
-
-                data = await response.json()
-
-                # 检查 API 回应是否有数据
-                if "data" in data and isinstance(data["data"], list) and len(data["data"]) > 0:
-                    df_price = pd.DataFrame(data["data"])
-                    
-                    # 确保日期格式正确
-                    df_price['date'] = pd.to_datetime(df_price['date'])
-                    
-                    # 确保数值字段为数值类型
-                    numeric_columns = ['Trading_Volume', 'Trading_money', 'open', 'max', 'min', 'close', 'spread', 'Trading_turnover']
-                    for col in numeric_columns:
-                        if col in df_price.columns:
-                            df_price[col] = pd.to_numeric(df_price[col], errors='coerce')
-                    
-                    # 获取指定股票的最新收盘价
-                    stock_data = df_price[df_price['stock_id'] == stock_id]
-                    if not stock_data.empty:
-                        latest_price = stock_data.sort_values('date').iloc[-1]['close']
-                        logger.info(f"成功获取股票 {stock_id} 的最新价格：{latest_price}")
-                        return latest_price
-                    else:
-                        logger.warning(f"未找到股票 {stock_id} 的价格数据")
-                else:
-                    logger.warning("API 返回数据为空")
 
+async def get_stock_price_from_date(stock_id, query_date):
+    """
+    根據指定的 query_date (YYYY-MM-DD) 查詢該日期至今的股票每日價格資料，
+    並只回傳 "date", "stock_id" 與 "close" 三個欄位。
+    資料存放於本機 ohlcv 表，只向 API 查詢尚未下載的日期區間。
+    """
+    try:
+        df_price = await ohlcv_store.get_prices(stock_id, query_date)
+    except FinMindAPIError as e:
+        logger.error(f"API 请求失败，{str(e)}")
+        return None
+
+    if df_price.empty:
         return None
+    df_price["date"] = df_price["date"].dt.strftime('%Y-%m-%d')
+    return df_price[["date", "stock_id", "close"]]
+
 
+async def get_current_stock_prices(stock_ids=None):
+    """
+    以一次全市場查詢取得最近 5 天的 TaiwanStockPrice，回傳各股票最新收盤價
+
+    :param stock_ids: 只回傳這些股票，None 表示全部
+    :return: {stock_id: 收盤價}，查詢失敗時回傳空 dict
+    """
+    try:
+        rows = await fetch_dataset(
+            "TaiwanStockPrice",
+            start_date=(datetime.today() - timedelta(days=5)).strftime('%Y-%m-%d'),
+        )
     except Exception as e:
-        logger.error(f"获取股票 {stock_id} 价格时发生错误: {str(e)}")
+        logger.error(f"获取股票价格时发生错误: {str(e)}")
+        return {}
+
+    if not rows:
+        logger.warning("API 返回数据为空")
+        return {}
+
+    df_price = pd.DataFrame(rows)
+    df_price["stock_id"] = df_price["stock_id"].astype(str)
+    df_price["date"] = pd.to_datetime(df_price["date"])
+    df_price["close"] = pd.to_numeric(df_price["close"], errors="coerce")
+    if stock_ids is not None:
+        df_price = df_price[df_price["stock_id"].isin(set(stock_ids))]
+
+    # 每支股票最新一天的收盤價
+    latest = df_price.dropna(subset=["close"]).sort_values("date").groupby("stock_id")["close"].last()
+    return latest.to_dict()
+
+
+async def get_current_stock_price(stock_id):
+    """获取股票当前价格，直接从 API 获取最近5天的数据"""
+    latest_price = (await get_current_stock_prices([stock_id])).get(stock_id)
+    if latest_price is None:
+        logger.warning(f"未找到股票 {stock_id} 的价格数据")
         return None
+    logger.info(f"成功获取股票 {stock_id} 的最新价格：{latest_price}")
+    return latest_price
     
 
 def calculate_dividend_yield(stock_id, current_price):
@@ -309,7 +731,26 @@ def calculate_all_dividend_yield(stock_id, current_price):
     """
     # 🔹 過濾該股票的配息資料
     stock_dividends = df_dividend[df_dividend["stock_id"] == stock_id].copy()
+    return _all_dividend_yield(stock_dividends, current_price)
+
+
+def calculate_all_dividend_yields(current_prices):
+    """
+    多支股票的完整殖利率，只掃描一次配息資料
+
+    :param current_prices: {stock_id: 當前股價}
+    :return: {stock_id: (總股利價值, 還原殖利率, 配息筆數)}
+    """
+    subset = df_dividend[df_dividend["stock_id"].isin(set(current_prices))]
+    groups = dict(tuple(subset.groupby("stock_id")))
+    return {
+        stock_id: _all_dividend_yield(groups.get(stock_id, subset.iloc[0:0]).copy(), price)
+        for stock_id, price in current_prices.items()
+    }
 
+
+def _all_dividend_yield(stock_dividends, current_price):
+    """由單一股票的配息資料計算完整殖利率"""
     # 確保 date 欄位是 datetime 格式
     stock_dividends["date"] = pd.to_datetime(stock_dividends["date"], errors="coerce", infer_datetime_format=True)
     
@@ -360,229 +801,159 @@ def calculate_all_dividend_yield(stock_id, current_price):
 
 # 修改 calculate_quarterly_stock_estimates 函數為異步函數
 async def calculate_quarterly_stock_estimates(stock_id, start_date="2020-01-01", end_date=None):
-    """ 從 CSV 文件讀取數據，計算季度 ROE、BVPS、推估股價 """
+    """ 從季度彙總表讀取數據，計算季度 ROE、BVPS、推估股價 """
     try:
-        # 讀取 CSV 文件
         csv_file = "stock_roe_data.csv"
-        if not os.path.exists(csv_file):
+        if not snapshot_store.store(csv_file).exists():
             logger.error(f"找不到 {csv_file} 文件")
-            return None
-
-        # 讀取數據並過濾指定股票
-        df = pd.read_csv(csv_file)
-        df['stock_id'] = df['stock_id'].astype(str)
-        df = df[df['stock_id'] == stock_id]
-
-        if df.empty:
-            logger.warning(f"股票 {stock_id} 在 CSV 中沒有數據")
-            return None
+            return None, None
 
-        # 確保日期格式正確
-        df["date"] = pd.to_datetime(df["date"], errors="coerce")
-        
-        # 確保數值欄位為數值類型
-        numeric_columns = ["PER", "PBR"]
-        for col in numeric_columns:
-            if col in df.columns:
-                df[col] = pd.to_numeric(df[col], errors="coerce")
-
-        # 過濾無效的 PER 和 PBR 數據
-        df = df[
-            (df['PER'] > 0) & (df['PER'] < 100) &  # 合理的 PER 範圍
-            (df['PBR'] > 0) & (df['PBR'] < 10)     # 合理的 PBR 範圍
-        ]
-
-        if df.empty:
+        # 讀取該股票的季度彙總（只需 O(季度數)，尚未建立時從 CSV 回補）
+        df_rollups = get_rollups(stock_id, csv_file)
+        if df_rollups.empty:
             logger.warning(f"股票 {stock_id} 沒有有效的 PER 和 PBR 數據")
-            return None
+            return None, None
 
-        # 依季度取數據
-        df["quarter"] = df["date"].dt.to_period("Q")
-        
-        # 計算季度 PER 統計數據（使用百分位數避免極端值）
-        df_per_stats = df.groupby("quarter").agg(
-            PER_最高值=("PER", lambda x: np.percentile(x, 95)),  # 95th percentile
-            PER_平均值=("PER", "mean"),
-            PER_最低值=("PER", lambda x: np.percentile(x, 5))    # 5th percentile
-        ).reset_index()
-
-        # 計算每季度的平均值
-        df_quarterly = df.groupby("quarter").agg(
-            date=("date", "last"),
-            PER=("PER", "mean"),
-            PBR=("PBR", "median"),
-            close=("close", "last")
-        ).reset_index()
-
-        # 合併 PER 統計數據
-        df_quarterly = df_quarterly.merge(df_per_stats, on="quarter", how="left")
-
-        # 計算季度 ROE (%)
-        df_quarterly["ROE"] = np.where(
-            (df_quarterly['PER'] != 0) & (df_quarterly['PER'].notna()) & (df_quarterly['PBR'].notna()),
-            (df_quarterly['PBR'] / df_quarterly['PER']) * 100,
-            np.nan
-        )
+        df_quarterly = quarterly_estimates(_fill_missing_closes(df_rollups))
+        return _validate_quarterly(stock_id, df_quarterly)
 
-        # 根據每個季度的最後日期從 CSV 中獲取當天收盤價，作為 prev_close
-        prev_closes = []
-        for _, row in df_quarterly.iterrows():
-            quarter_end_date = row["date"]  # 該季度最後一天的日期
-            # 從原始數據中獲取該日期的收盤價
-            price = df[df["date"] == quarter_end_date]["close"].iloc[0] if not df[df["date"] == quarter_end_date].empty else np.nan
-            if price is None or price == 0:
-                logger.warning(f"股票 {stock_id} 在 {quarter_end_date.strftime('%Y-%m-%d')} 的收盤價無效")
-                price = np.nan
-            prev_closes.append(price)
-        df_quarterly["prev_close"] = prev_closes
-
-        # 新增檢查：如果 prev_close 為 0 或 NaN，則過濾掉這些行
-        invalid_count = df_quarterly[(df_quarterly["prev_close"] == 0) | (df_quarterly["prev_close"].isna())].shape[0]
-        if invalid_count > 0:
-            logger.warning(f"股票 {stock_id} 有 {invalid_count} 行季度數據的 prev_close 為 0 或無效，將過濾掉這些數據")
-            return None
-        df_quarterly = df_quarterly[(df_quarterly["prev_close"] != 0) & (df_quarterly["prev_close"].notna())]
-
-        df_quarterly["BVPS"] = df_quarterly["prev_close"] / df_quarterly["PBR"]
-
-        # 計算推估EPS
-        df_quarterly["推估EPS"] = df_quarterly["BVPS"] * (df_quarterly["ROE"] / 100)
-
-        # 計算三種股價（使用 PER 的百分位數）
-        df_quarterly["高股價"] = df_quarterly["PER_最高值"] * df_quarterly["推估EPS"]
-        df_quarterly["正常股價"] = df_quarterly["PER_平均值"] * df_quarterly["推估EPS"]
-        df_quarterly["低股價"] = df_quarterly["PER_最低值"] * df_quarterly["推估EPS"]
-
-        # 按日期排序（最新的在前）
-        df_quarterly = df_quarterly.sort_values("date", ascending=False)
-
-        # 移除無效的估值
-        df_quarterly = df_quarterly[
-            df_quarterly[["ROE", "BVPS", "推估EPS", "高股價", "正常股價", "低股價"]].notna().all(axis=1)
-        ]
-
-        if df_quarterly.empty:
-            logger.warning(f"股票 {stock_id} 無有效的季度數據")
-            return None
-
-        # 檢查是否有足夠的季度數據
-        if len(df_quarterly) < 16:
-            logger.warning(f"股票 {stock_id} 的季度數據不足 4 年")
-            return None
-
-        # 檢查最新數據是否在最近一年內
-        latest_date = df_quarterly.iloc[0]["date"]
-        one_year_ago = pd.Timestamp.now() - pd.DateOffset(years=1)
-        
-        if latest_date < one_year_ago:
-            logger.warning(f"股票 {stock_id} 的最新數據過期（{latest_date.strftime('%Y-%m-%d')}）")
-            return None
+    except Exception as e:
+        logger.error(f"處理股票 {stock_id} 數據時發生錯誤: {str(e)}")
+        return None, None
 
-        # 檢查是否從2020年至今的每一季都有數據
-        start_date = pd.Timestamp("2020-01-01")
-        end_date = pd.Timestamp.now()
-        
-        # 生成所有應該有的季度
-        all_quarters = pd.period_range(start=start_date, end=end_date, freq='Q')
-        
-        # 檢查是否所有季度都有數據（除了當季）
-        existing_quarters = set(df_quarterly['quarter'])
-        current_quarter = pd.Timestamp.now().to_period('Q')
-        missing_quarters = [q for q in all_quarters if q not in existing_quarters and q < current_quarter]
-        
-        if missing_quarters:
-            logger.warning(f"股票 {stock_id} 缺少以下季度的數據: {missing_quarters}")
-            return None
 
-        # 將計算結果擴充到原始數據中
+async def calculate_quarterly_stock_estimates_bulk(stock_ids):
+    """
+    多支股票一次讀取季度彙總並以單次向量化計算季度估值
+
+    :return: {stock_id: (df_quarterly, price)}，無法計算的股票為 (None, None)
+    """
+    csv_file = "stock_roe_data.csv"
+    roe_store = snapshot_store.store(csv_file)
+    if not roe_store.exists():
+        logger.error(f"找不到 {csv_file} 文件")
+        return {stock_id: (None, None) for stock_id in stock_ids}
+
+    df_rollups = load_rollups(stock_ids)
+    # 尚未建立季度彙總的股票從 CSV 回補（全部使用同一個版本）
+    missing = [stock_id for stock_id in stock_ids if stock_id not in set(df_rollups["stock_id"])]
+    if missing:
+        with roe_store.pin():
+            backfilled = [get_rollups(stock_id, csv_file) for stock_id in missing]
+        frames = [df for df in [df_rollups] + backfilled if not df.empty]
+        if frames:
+            df_rollups = pd.concat(frames, ignore_index=True)
+
+    results = {stock_id: (None, None) for stock_id in stock_ids}
+    if df_rollups.empty:
+        return results
+
+    df_all = quarterly_estimates(_fill_missing_closes(df_rollups))
+    for stock_id, df_quarterly in df_all.groupby("stock_id", sort=False):
         try:
-            # 讀取原始 CSV 文件
-            df_original = pd.read_csv(csv_file)
-            df_original['stock_id'] = df_original['stock_id'].astype(str)
-            
-            # 為每個日期添加計算結果
-            for _, row in df_quarterly.iterrows():
-                mask = (df_original['stock_id'] == stock_id) & (df_original['date'] == row['date'])
-                if any(mask):
-                    # 更新現有行
-                    df_original.loc[mask, 'ROE'] = row['ROE']
-                    df_original.loc[mask, 'BVPS'] = row['BVPS']
-                    df_original.loc[mask, '推估EPS'] = row['推估EPS']
-                    df_original.loc[mask, '高股價'] = row['高股價']
-                    df_original.loc[mask, '正常股價'] = row['正常股價']
-                    df_original.loc[mask, '低股價'] = row['低股價']
-                else:
-                    # 添加新行
-                    new_row = pd.DataFrame([{
-                        'stock_id': stock_id,
-                        'date': row['date'],
-                        'ROE': row['ROE'],
-                        'BVPS': row['BVPS'],
-                        '推估EPS': row['推估EPS'],
-                        '高股價': row['高股價'],
-                        '正常股價': row['正常股價'],
-                        '低股價': row['低股價'],
-                        'PER': row['PER'],
-                        'PBR': row['PBR'],
-                        'PER_最高值': row['PER_最高值'],
-                        'PER_平均值': row['PER_平均值'],
-                        'PER_最低值': row['PER_最低值']
-                    }])
-                    df_original = pd.concat([df_original, new_row], ignore_index=True)
-
-            # 保存更新後的數據
-            df_original.to_csv(csv_file, index=False, encoding='utf-8-sig')
-            logger.info(f"已將股票 {stock_id} 的計算結果寫入 CSV 文件")
+            results[stock_id] = _validate_quarterly(stock_id, df_quarterly)
         except Exception as e:
-            logger.error(f"寫入 CSV 文件時發生錯誤: {str(e)}")
+            logger.error(f"處理股票 {stock_id} 數據時發生錯誤: {str(e)}")
+    return results
 
-        # 返回計算結果和當前股價
-        return df_quarterly, price
 
-    except Exception as e:
-        logger.error(f"處理股票 {stock_id} 數據時發生錯誤: {str(e)}")
-        return None
+def _fill_missing_closes(df_rollups):
+    """CSV 尚未合併收盤價的季度，改用本機日 K 線中季度最後一天的收盤價"""
+    missing_close = df_rollups["prev_close"].isna()
+    if not missing_close.any():
+        return df_rollups
+    df_rollups = df_rollups.copy()
+    for stock_id, dates in df_rollups.loc[missing_close, "last_date"].groupby(df_rollups.loc[missing_close, "stock_id"]):
+        df_rollups.loc[dates.index, "prev_close"] = ohlcv_store.closes_asof(stock_id, dates).to_numpy()
+    return df_rollups
 
-# 添加獲取台股代號列表的函數
-def get_taiwan_stock_list():
-    """從  FinMind API 獲取台股代號列表"""
-    parameter = {
-        "dataset": "TaiwanStockInfo",
-        "token": FINMIND_API_KEY,
-    }
 
-    try:
-        response = requests.get(FINMIND_URL, params=parameter)
-        data = response.json()
+def _validate_quarterly(stock_id, df_quarterly):
+    """
+    檢查單一股票的季度估值是否可用
 
-        if "data" not in data or not isinstance(data["data"], list):
-            logger.error("無法從 FinMind API 獲取股票列表")
-            return []
+    :return: (按日期由新到舊排序的季度數據, 最新一季收盤價)，不符合條件時為 (None, None)
+    """
+    # 新增檢查：如果 prev_close 為 0 或 NaN，則過濾掉這些行
+    invalid = df_quarterly[(df_quarterly["prev_close"] == 0) | (df_quarterly["prev_close"].isna())]
+    if not invalid.empty:
+        for quarter_end_date in invalid["date"]:
+            logger.warning(f"股票 {stock_id} 在 {quarter_end_date.strftime('%Y-%m-%d')} 的收盤價無效")
+        logger.warning(f"股票 {stock_id} 有 {len(invalid)} 行季度數據的 prev_close 為 0 或無效，將過濾掉這些數據")
+        return None, None
+
+    # 最新一季最後一天的收盤價
+    price = df_quarterly.sort_values("date").iloc[-1]["prev_close"]
+
+    # 按日期排序（最新的在前）
+    df_quarterly = df_quarterly.sort_values("date", ascending=False)
+
+    # 移除無效的估值
+    df_quarterly = df_quarterly[
+        df_quarterly[["ROE", "BVPS", "推估EPS", "高股價", "正常股價", "低股價"]].notna().all(axis=1)
+    ]
+
+    if df_quarterly.empty:
+        logger.warning(f"股票 {stock_id} 無有效的季度數據")
+        return None, None
+
+    # 檢查是否有足夠的季度數據
+    if len(df_quarterly) < 16:
+        logger.warning(f"股票 {stock_id} 的季度數據不足 4 年")
+        return None, None
+
+    # 檢查最新數據是否在最近一年內
+    latest_date = df_quarterly.iloc[0]["date"]
+    one_year_ago = pd.Timestamp.now() - pd.DateOffset(years=1)
+    
+    if latest_date < one_year_ago:
+        logger.warning(f"股票 {stock_id} 的最新數據過期（{latest_date.strftime('%Y-%m-%d')}）")
+        return None, None
 
-        # 轉換為 DataFrame
-        df_stocks = pd.DataFrame(data["data"])
-        
-        # 確保 stock_id 欄位為字串
-        df_stocks["stock_id"] = df_stocks["stock_id"].astype(str)
-        
-        # 過濾掉非上市股票（通常股票代碼長度為 4 位）
-        df_stocks = df_stocks[df_stocks["stock_id"].str.len() == 4]
+    # 檢查是否從2020年至今的每一季都有數據
+    start_date = pd.Timestamp("2020-01-01")
+    end_date = pd.Timestamp.now()
+    
+    # 生成所有應該有的季度
+    all_quarters = pd.period_range(start=start_date, end=end_date, freq='Q')
+    
+    # 檢查是否所有季度都有數據（除了當季）
+    existing_quarters = set(df_quarterly['quarter'])
+    current_quarter = pd.Timestamp.now().to_period('Q')
+    missing_quarters = [q for q in all_quarters if q not in existing_quarters and q < current_quarter]
+    
+    if missing_quarters:
+        logger.warning(f"股票 {stock_id} 缺少以下季度的數據: {missing_quarters}")
+        return None, None
 
-        # 過濾掉特殊股票（如權證、期貨等）
-        df_stocks = df_stocks[~df_stocks["stock_id"].str.startswith(('0', '9'))]
+    # 返回計算結果和當前股價
+    return df_quarterly, price
 
-        
-        # 添加日誌記錄
-        logger.info(f"從 API 獲取的股票總數：{len(df_stocks)}")
-        logger.info(f"股票代碼範圍：{df_stocks['stock_id'].min()} 到 {df_stocks['stock_id'].max()}")
-        
-        stock_list = df_stocks["stock_id"].tolist()
-        logger.info(f"成功獲取 {len(stock_list)} 支上市股票")
-        return stock_list
-        
-    except Exception as e:
-        logger.error(f"獲取股票列表時發生錯誤: {str(e)}")
-        return []
+
+def summarize_estimates(results):
+    """
+    將多支股票的季度數據彙總為推估股價區間（與 /stock_estimate 相同算法，以 groupby 一次計算）
+
+    :param results: calculate_quarterly_stock_estimates_bulk 的結果
+    :return: 以 stock_id 為索引的 DataFrame
+    """
+    frames = [df_quarterly for df_quarterly, _ in results.values() if df_quarterly is not None]
+    if not frames:
+        return pd.DataFrame()
+    grouped = pd.concat(frames).groupby("stock_id", sort=False)
+    summary = grouped.agg(
+        avg_roe=("ROE", "mean"),
+        avg_per_high=("PER_最高值", "mean"),
+        avg_per_normal=("PER_平均值", "mean"),
+        avg_per_low=("PER_最低值", "mean"),
+        latest_bvps=("BVPS", "first"),  # 已按日期由新到舊排序
+    )
+    summary["estimated_eps"] = summary["latest_bvps"] * (summary["avg_roe"] / 100)
+    summary["low_price"] = summary["estimated_eps"] * summary["avg_per_low"]
+    summary["normal_price"] = summary["estimated_eps"] * summary["avg_per_normal"]
+    summary["high_price"] = summary["estimated_eps"] * summary["avg_per_high"]
+    summary["quarter_price"] = pd.Series({stock_id: price for stock_id, (_, price) in results.items()})
+    return summary
 
 # 添加斷點續傳相關變量
 progress_file = "recommend_v2_progress.json"
@@ -637,6 +1008,141 @@ async def cancel_recommend(update: Update, context: CallbackContext) -> None:
     is_processing = False
     await update.message.reply_text("已發送取消指令，正在等待任務結束...")
 
+async def compute_recommendations(should_stop=None, progress=None):
+    """
+    /recommend_v2 的計算部分（不依賴 Telegram，CLI 批次模式共用）
+
+    :param should_stop: 回傳 True 時停止處理（取消指令）
+    :param progress: async progress(processed, total, filtered, no_quarter_data)，每 100 支符合條件的股票呼叫一次
+    :return: {total, no_quarter_data, filtered, cancelled, results}；尚未同步股價時為 None
+    """
+    # 開啟共享的股價表（不需解析整個 JSON 文件）
+    stock_prices = price_table.open_table()
+    if stock_prices is None:
+        logger.error(f"找不到股價數據文件：{price_table.PRICE_TABLE_FILE}")
+        return None
+    logger.info(f"成功開啟股價表，共 {len(stock_prices)} 支股票")
+
+    # 獲取所有股票代碼
+    stock_list = stock_prices.stock_ids()
+    logger.info(f"開始處理股票，總共 {len(stock_list)} 支股票")
+
+    # 產業百分位一次讀取，之後每支股票只需查表
+    industry_relative = load_industry_relative()
+
+    # 處理每支股票
+    all_results = []
+    total_stocks = len(stock_list)
+    processed_count = 0
+    filtered_count = 0
+    no_quarter_data_count = 0
+    cancelled = False
+
+    for stock_id in stock_list:
+        if should_stop is not None and should_stop():
+            logger.info("收到取消指令，停止處理")
+            cancelled = True
+            break
+
+        try:
+            # 使用 calculate_quarterly_stock_estimates 獲取季度數據
+            df_quarterly, now_price = await calculate_quarterly_stock_estimates(stock_id)
+            if df_quarterly is None or df_quarterly.empty:
+                no_quarter_data_count += 1
+                continue
+
+            # 計算統計數據的平均值
+            avg_roe = df_quarterly['ROE'].mean()
+            avg_per_high = df_quarterly['PER_最高值'].mean()
+            avg_per_normal = df_quarterly['PER_平均值'].mean()
+            avg_per_low = df_quarterly['PER_最低值'].mean()
+
+            # 使用最新一筆的 BVPS 和平均 ROE 計算推估 EPS
+            latest_bvps = df_quarterly.iloc[0]['BVPS']  # 最新一筆的 BVPS
+            estimated_eps = latest_bvps * (avg_roe / 100)  # 使用平均 ROE 計算
+
+            # 使用推估 EPS 和平均 PER 計算股價區間
+            low_price = estimated_eps * avg_per_low
+            normal_price = estimated_eps * avg_per_normal
+            high_price = estimated_eps * avg_per_high
+
+            # 取得該股票最新季度數據
+            if avg_roe < 15:
+                logger.info(f"股票 {stock_id} 的 ROE 為 {avg_roe}，不符合 ROE 15% 以下的條件")
+                continue
+
+            # 獲取當前股價
+            current_price = stock_prices.price(stock_id)
+            if current_price is None or current_price <= 0:
+                continue
+
+            # 計算價值分數
+            # 1. 計算股價相對低價的折扣程度（越低越好）
+            price_discount = (low_price - current_price) / low_price
+
+            # 2. 計算 PER 的折扣程度（越低越好）
+            per_discount = 1 / df_quarterly.iloc[0]['PER']
+
+            # 3. 綜合計算價值分數（考慮股價折扣和 PER 折扣）
+            value_score = (price_discount * 0.6 + per_discount * 0.4) * 100
+
+            # 確保分數在合理範圍內
+            value_score = max(0, min(100, value_score))
+
+            # value_score <= 0 不推薦
+            if value_score <= 0:
+                logger.info(f"股票 {stock_id} 的價值分數為 {value_score}，不符合價值分數 30 以上的條件")
+                continue
+
+            result = {
+                "stock_id": stock_id,
+                "current_price": current_price,
+                "value_score": value_score,
+                "roe": df_quarterly.iloc[0]['ROE'],
+                "price_discount": price_discount * 100,  # 轉換為百分比
+                "current_per": df_quarterly.iloc[0]['PER'],
+                "roe_trend": True,  # calculate_quarterly_stock_estimates 已經確保了 ROE 趨勢
+                "roe_volatility": 0,  # 這裡可以根據需要計算波動率
+                "低股價": low_price,
+                "正常股價": normal_price,
+                "高股價": high_price,
+                "推估EPS": estimated_eps,
+                "industry": None,
+                "industry_per_pct": None,
+                "industry_roe_pct": None,
+            }
+            if stock_id in industry_relative.index:
+                relative = industry_relative.loc[stock_id]
+                for column in ["industry", "industry_per_pct", "industry_roe_pct"]:
+                    result[column] = None if pd.isna(relative[column]) else relative[column]
+
+            all_results.append(result)
+            filtered_count += 1
+
+            processed_count += 1
+            # 每處理 100 支股票回報一次進度
+            if processed_count % 100 == 0:
+                progress_pct = (processed_count / total_stocks) * 100
+                logger.info(f"處理進度：{progress_pct:.1f}%，已處理 {processed_count} 支股票，符合條件 {filtered_count} 支，無四季資料 {no_quarter_data_count} 支")
+                if progress is not None:
+                    await progress(processed_count, total_stocks, filtered_count, no_quarter_data_count)
+
+        except Exception as e:
+            logger.error(f"處理股票 {stock_id} 時發生錯誤: {str(e)}", exc_info=True)
+            continue
+
+    # 根據價值分數排序
+    all_results.sort(key=lambda x: x["value_score"], reverse=True)
+    logger.info(f"篩選完成，共有 {len(all_results)} 支股票符合條件，{no_quarter_data_count} 支股票無四季資料")
+    return {
+        "total": total_stocks,
+        "no_quarter_data": no_quarter_data_count,
+        "filtered": filtered_count,
+        "cancelled": cancelled,
+        "results": all_results,
+    }
+
+
 async def recommend_v2(update: Update, context: CallbackContext) -> None:
     """推薦股票 v2 版本"""
     global is_processing, should_cancel
@@ -650,125 +1156,24 @@ async def recommend_v2(update: Update, context: CallbackContext) -> None:
         is_processing = True
         should_cancel = False
         logger.info("開始執行股票推薦任務")
-        
-        # 讀取股價數據
-        if not os.path.exists(STOCK_PRICE_FILE):
-            logger.error(f"找不到股價數據文件：{STOCK_PRICE_FILE}")
-            await update.message.reply_text("找不到股價數據文件，請先執行 /sync_stock_prices 命令")
-            return
-
-        logger.info("開始讀取股價數據文件")
-        with open(STOCK_PRICE_FILE, 'r', encoding='utf-8') as f:
-            stock_prices = json.load(f)
-        logger.info(f"成功讀取股價數據，共 {len(stock_prices)} 支股票")
-
-        # 獲取所有股票代碼
-        stock_list = list(stock_prices.keys())
-        logger.info(f"開始處理股票，總共 {len(stock_list)} 支股票")
-
-        # 處理每支股票
-        all_results = []
-        total_stocks = len(stock_list)
-        processed_count = 0
-        filtered_count = 0
-        no_quarter_data_count = 0
-        
-        for stock_id in stock_list:
-            if should_cancel:
-                logger.info("收到取消指令，停止處理")
-                await update.message.reply_text("任務已取消")
-                break
-                
-            try:
-                # 使用 calculate_quarterly_stock_estimates 獲取季度數據
-                df_quarterly, now_price = await calculate_quarterly_stock_estimates(stock_id)
-                if df_quarterly is None or df_quarterly.empty:
-                    no_quarter_data_count += 1
-                    continue
-
-                    # 計算統計數據的平均值
-                avg_roe = df_quarterly['ROE'].mean()
-                avg_per_high = df_quarterly['PER_最高值'].mean()
-                avg_per_normal = df_quarterly['PER_平均值'].mean()
-                avg_per_low = df_quarterly['PER_最低值'].mean()
-
-                # 使用最新一筆的 BVPS 和平均 ROE 計算推估 EPS
-                latest_bvps = df_quarterly.iloc[0]['BVPS']  # 最新一筆的 BVPS
-                estimated_eps = latest_bvps * (avg_roe / 100)  # 使用平均 ROE 計算
 
-                # 使用推估 EPS 和平均 PER 計算股價區間
-                low_price = estimated_eps * avg_per_low
-                normal_price = estimated_eps * avg_per_normal
-                high_price = estimated_eps * avg_per_high
-
-                # 取得該股票最新季度數據
-                if avg_roe < 15:
-                    logger.info(f"股票 {stock_id} 的 ROE 為 {avg_roe}，不符合 ROE 15% 以下的條件")
-                    continue
-
-
-                # 獲取當前股價
-                current_price = stock_prices.get(stock_id)
-                if current_price is None or current_price <= 0:
-                    continue
+        async def report_progress(processed_count, total_stocks, filtered_count, no_quarter_data_count):
+            progress = (processed_count / total_stocks) * 100
+            await update.message.reply_text(f"處理進度：{progress:.1f}% ({processed_count}/{total_stocks})\n符合條件：{filtered_count} 支\n無四季資料：{no_quarter_data_count} 支")
 
-                # 計算價值分數
-                # 1. 計算股價相對低價的折扣程度（越低越好）
-                price_discount = (low_price - current_price) / low_price
-                
-                # 2. 計算 PER 的折扣程度（越低越好）
-                per_discount = 1 / df_quarterly.iloc[0]['PER']
-                
-                # 3. 綜合計算價值分數（考慮股價折扣和 PER 折扣）
-                value_score = (price_discount * 0.6 + per_discount * 0.4) * 100
-                
-                # 確保分數在合理範圍內
-                value_score = max(0, min(100, value_score))
-
-                # value_score <= 0 不推薦
-                if value_score <= 0:
-                    logger.info(f"股票 {stock_id} 的價值分數為 {value_score}，不符合價值分數 30 以上的條件")
-                    continue
-                
-                result = {
-                    "stock_id": stock_id,
-                    "current_price": current_price,
-                    "value_score": value_score,
-                    "roe": df_quarterly.iloc[0]['ROE'],
-                    "price_discount": price_discount * 100,  # 轉換為百分比
-                    "current_per": df_quarterly.iloc[0]['PER'],
-                    "roe_trend": True,  # calculate_quarterly_stock_estimates 已經確保了 ROE 趨勢
-                    "roe_volatility": 0,  # 這裡可以根據需要計算波動率
-                    "低股價": low_price,
-                    "正常股價": normal_price,
-                    "高股價": high_price,
-                    "推估EPS": estimated_eps
-                }
-                
-                all_results.append(result)
-                filtered_count += 1
+        outcome = await compute_recommendations(lambda: should_cancel, report_progress)
+        if outcome is None:
+            await update.message.reply_text("找不到股價數據文件，請先執行 /sync_stock_prices 命令")
+            return
+        if outcome["cancelled"]:
+            await update.message.reply_text("任務已取消")
 
-                processed_count += 1
-                # 每處理 50 支股票發送一次進度更新
-                if processed_count % 100 == 0:
-                    progress = (processed_count / total_stocks) * 100
-                    logger.info(f"處理進度：{progress:.1f}%，已處理 {processed_count} 支股票，符合條件 {filtered_count} 支，無四季資料 {no_quarter_data_count} 支")
-                    await update.message.reply_text(f"處理進度：{progress:.1f}% ({processed_count}/{total_stocks})\n符合條件：{filtered_count} 支\n無四季資料：{no_quarter_data_count} 支")
-                
-            except Exception as e:
-                logger.error(f"處理股票 {stock_id} 時發生錯誤: {str(e)}", exc_info=True)
-                continue
-        
+        all_results = outcome["results"]
         if not all_results:
             logger.warning("沒有找到符合條件的股票")
             await update.message.reply_text("沒有找到符合條件的股票")
             return
 
-        logger.info(f"篩選完成，共有 {len(all_results)} 支股票符合條件，{no_quarter_data_count} 支股票無四季資料")
-
-        # 根據價值分數排序
-        all_results.sort(key=lambda x: x["value_score"], reverse=True)
-        
         # 選取前 10 支股票
         top_10 = all_results[:10]
         logger.info("前 10 名股票（依價值分數排序）：" + ", ".join([f"{stock['stock_id']}({stock['value_score']:.2f})" for stock in top_10]))
@@ -776,9 +1181,9 @@ async def recommend_v2(update: Update, context: CallbackContext) -> None:
         # 生成推薦訊息
         message = "📊 股票推薦 (v2)\n\n"
         message += f"🔹 處理統計：\n"
-        message += f"- 總股票數：{total_stocks} 支\n"
-        message += f"- 無四季資料：{no_quarter_data_count} 支\n"
-        message += f"- 符合條件：{filtered_count} 支\n\n"
+        message += f"- 總股票數：{outcome['total']} 支\n"
+        message += f"- 無四季資料：{outcome['no_quarter_data']} 支\n"
+        message += f"- 符合條件：{outcome['filtered']} 支\n\n"
         message += "🔹 根據價值分數排序：\n"
         for i, stock in enumerate(top_10, 1):
             message += f"{i}. {stock['stock_id']}\n"
@@ -790,6 +1195,8 @@ async def recommend_v2(update: Update, context: CallbackContext) -> None:
             message += f"   正常股價: {stock['正常股價']:.2f}\n"
             message += f"   高股價: {stock['高股價']:.2f}\n"
             message += f"   本益比: {stock['current_per']:.2f}\n"
+            if stock["industry_per_pct"] is not None:
+                message += f"   產業 PER 百分位: {stock['industry_per_pct']:.0f}（{stock['industry']}）\n"
             message += f"   ROE趨勢: {'上升' if stock['roe_trend'] else '下降'}\n"
             message += f"   ROE波動率: {stock['roe_volatility']:.2f}%\n\n"
         
@@ -811,7 +1218,7 @@ async def get_stock_roe_data(update: Update, context: CallbackContext) -> None:
     """获取所有台股的 ROE 数据并保存為 CSV"""
     try:
         # 获取所有台股代码
-        stock_list = get_taiwan_stock_list()
+        stock_list = await get_taiwan_stock_list()
         if not stock_list:
             await update.message.reply_text("無法獲取台股列表，請稍後再試")
             return
@@ -820,33 +1227,26 @@ async def get_stock_roe_data(update: Update, context: CallbackContext) -> None:
 
         # 创建 CSV 文件
         csv_file = "stock_roe_data.csv"
-        no_data_file = "no_data_stocks.json"  # 记录没有数据的股票
         processed_count = 0
         existing_stocks = set()
-        no_data_stocks = set()
 
-        # 读取没有数据的股票列表
-        if os.path.exists(no_data_file):
-            try:
-                with open(no_data_file, 'r', encoding='utf-8') as f:
-                    no_data_stocks = set(json.load(f))
-                    logger.info(f"讀取到 {len(no_data_stocks)} 支沒有數據的股票")
-            except Exception as e:
-                logger.error(f"讀取無數據股票列表時發生錯誤: {str(e)}")
-                no_data_stocks = set()
-
-        # 检查现有的 CSV 文件
-        if os.path.exists(csv_file):
-            try:
-                df_existing = pd.read_csv(csv_file)
-                # 确保 stock_id 为字符串类型
-                df_existing['stock_id'] = df_existing['stock_id'].astype(str)
-                existing_stocks = set(df_existing['stock_id'].unique())
-                logger.info(f"現有 CSV 文件中已有 {len(existing_stocks)} 支股票的數據")
-                logger.info(f"CSV 中的股票示例：{list(existing_stocks)[:5]}")
-            except Exception as e:
-                logger.error(f"讀取現有 CSV 文件時發生錯誤: {str(e)}")
-                existing_stocks = set()
+        # 读取尚未到重新檢查時間的無數據股票（舊的 no_data_stocks.json 會先匯入）
+        negative_cache.migrate_legacy()
+        no_data_stocks = negative_cache.blocked_ids("TaiwanStockPER")
+        logger.info(f"略過 {len(no_data_stocks)} 支尚未到重新檢查時間的無數據股票")
+
+        # 检查现有的資料（讀取目前版本）
+        roe_store = snapshot_store.store(csv_file)
+        with roe_store.pin() as snapshot:
+            if snapshot is not None:
+                try:
+                    df_existing = snapshot.read_csv(usecols=["stock_id"], dtype={"stock_id": str})
+                    existing_stocks = set(df_existing['stock_id'].unique())
+                    logger.info(f"現有 CSV 文件中已有 {len(existing_stocks)} 支股票的數據")
+                    logger.info(f"CSV 中的股票示例：{list(existing_stocks)[:5]}")
+                except Exception as e:
+                    logger.error(f"讀取現有 CSV 文件時發生錯誤: {str(e)}")
+                    existing_stocks = set()
 
         logger.info(f"本次將處理前 {len(stock_list)} 支股票")
 
@@ -861,78 +1261,70 @@ async def get_stock_roe_data(update: Update, context: CallbackContext) -> None:
 
         # 处理缺失的股票
         new_no_data_stocks = set()  # 记录本次执行中发现没有数据的股票
+        found_stocks = set()  # 本次取得資料的股票（先前記錄為無數據的會移出快取）
         for stock_id in missing_stocks:
             try:
                 logger.info(f"正在查詢股票 {stock_id} 的 ROE 數據...")
-                # 设置 API 参数
-                parameter = {
-                    "dataset": "TaiwanStockPER",
-                    "data_id": stock_id,
-                    "start_date": "2020-01-01",
-                    "end_date": datetime.now().strftime('%Y-%m-%d'),
-                    "token": FINMIND_API_KEY,
-                }
-
-                # 获取 ROE 数据
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(FINMIND_URL, params=parameter) as response:
-                        if response.status != 200:
-                            logger.error(f"API 請求失敗，股票 {stock_id}，狀態碼：{response.status}")
-                            new_no_data_stocks.add(stock_id)
-                            continue
-
-                        data = await response.json()
-                        if "data" not in data or not isinstance(data["data"], list) or len(data["data"]) == 0:
-                            logger.warning(f"股票 {stock_id} 沒有數據")
-                            new_no_data_stocks.add(stock_id)
-                            continue
-
-                        logger.info(f"成功獲取股票 {stock_id} 的 ROE 數據")
-
-                        # 转换数据为 DataFrame
-                        df = pd.DataFrame(data["data"])
-                        
-                        # 确保日期格式正确
-                        df["date"] = pd.to_datetime(df["date"])
-                        
-                        # 确保数值字段为数值类型
-                        numeric_columns = ["PER", "PBR", "ROE"]
-                        for col in numeric_columns:
-                            if col in df.columns:
-                                df[col] = pd.to_numeric(df[col], errors="coerce")
-
-                        # 添加股票代码列
-                        df["stock_id"] = stock_id
-
-                        # 将数据写入 CSV
-                        if processed_count == 0 and not os.path.exists(csv_file):
-                            # 第一次写入，创建文件并写入表头
-                            df.to_csv(csv_file, index=False, encoding='utf-8-sig')
-                        else:
-                            # 后续写入，追加数据（不包含表头）
-                            df.to_csv(csv_file, mode='a', header=False, index=False, encoding='utf-8-sig')
-
-                        processed_count += 1
-
-                        # 每处理 10 支股票发送一次进度更新
-                        if processed_count % 10 == 0:
-                            logger.info(f"已處理 {processed_count}/{len(missing_stocks)} 支股票")
-                            await update.message.reply_text(f"已處理 {processed_count}/{len(missing_stocks)} 支股票")
-
-                        # 等待 0.5 秒再处理下一支股票
-                        await asyncio.sleep(0.5)
+                # 获取 ROE 数据（請求速率由 finmind_client 的 rate_controller 控制）
+                try:
+                    rows = await fetch_dataset(
+                        "TaiwanStockPER", stock_id, "2020-01-01", datetime.now().strftime('%Y-%m-%d')
+                    )
+                except FinMindAPIError as e:
+                    logger.error(f"API 請求失敗，股票 {stock_id}，狀態碼：{e.status}")
+                    negative_cache.record([stock_id], "http_error")
+                    new_no_data_stocks.add(stock_id)
+                    continue
+
+                if not rows:
+                    logger.warning(f"股票 {stock_id} 沒有數據")
+                    negative_cache.record([stock_id], "empty")
+                    new_no_data_stocks.add(stock_id)
+                    continue
+
+                found_stocks.add(stock_id)
+
+                logger.info(f"成功獲取股票 {stock_id} 的 ROE 數據")
+
+                # 转换数据为 DataFrame
+                df = pd.DataFrame(rows)
+                
+                # 确保日期格式正确
+                df["date"] = pd.to_datetime(df["date"])
+                
+                # 确保数值字段为数值类型
+                numeric_columns = ["PER", "PBR", "ROE"]
+                for col in numeric_columns:
+                    if col in df.columns:
+                        df[col] = pd.to_numeric(df[col], errors="coerce")
+
+                # 添加股票代码列
+                df["stock_id"] = stock_id
+
+                # 将数据追加為新版本（讀取中的指令不受影響）
+                roe_store.append(df)
+
+                # 建立該股票的季度彙總
+                rebuild_rollups(df)
+
+                processed_count += 1
+
+                # 每处理 10 支股票发送一次进度更新
+                if processed_count % 10 == 0:
+                    logger.info(f"已處理 {processed_count}/{len(missing_stocks)} 支股票")
+                    await update.message.reply_text(f"已處理 {processed_count}/{len(missing_stocks)} 支股票")
 
             except Exception as e:
                 logger.error(f"處理股票 {stock_id} 時發生錯誤: {str(e)}")
+                negative_cache.record([stock_id], "error")
                 new_no_data_stocks.add(stock_id)
                 continue
 
-        # 更新没有数据的股票列表
+        # 重新檢查後有資料的股票移出快取
+        if found_stocks:
+            negative_cache.clear(found_stocks)
         if new_no_data_stocks:
-            no_data_stocks.update(new_no_data_stocks)
-            with open(no_data_file, 'w', encoding='utf-8') as f:
-                json.dump(list(no_data_stocks), f, ensure_ascii=False, indent=2)
-            logger.info(f"新增 {len(new_no_data_stocks)} 支沒有數據的股票到記錄中")
+            logger.info(f"{len(new_no_data_stocks)} 支股票沒有數據，已記錄並排定重新檢查時間")
 
         await update.message.reply_text(f"完成！共處理 {processed_count} 支股票數據")
 
@@ -940,49 +1332,83 @@ async def get_stock_roe_data(update: Update, context: CallbackContext) -> None:
         logger.error(f"獲取股票 ROE 數據時發生錯誤: {str(e)}")
         await update.message.reply_text("處理過程中發生錯誤，請稍後再試")
 
-# 添加新的常量
-STOCK_PRICE_FILE = "stock_prices.json"
+async def get_stock_roe_data_bulk(update: Update, context: CallbackContext) -> None:
+    """
+    以日期為單位查詢全市場 TaiwanStockPER 並寫入 CSV
+    用法：/get_roe_data_bulk [起始日期 YYYY-MM-DD] [結束日期 YYYY-MM-DD] [每次請求天數]
+    未指定起始日期時，從 CSV 最新日期的隔天開始（每日更新只需一次請求）
+    """
+    try:
+        start_date = datetime.strptime(context.args[0], '%Y-%m-%d').date() if len(context.args) > 0 else None
+        end_date = datetime.strptime(context.args[1], '%Y-%m-%d').date() if len(context.args) > 1 else None
+        chunk_days = int(context.args[2]) if len(context.args) > 2 else 1
+        if chunk_days < 1:
+            raise ValueError("每次請求天數需至少為 1")
+    except ValueError:
+        await update.message.reply_text("用法：/get_roe_data_bulk [起始日期 YYYY-MM-DD] [結束日期 YYYY-MM-DD] [每次請求天數]")
+        return
 
-async def sync_stock_prices(update: Update, context: CallbackContext) -> None:
-    """同步所有股票的最新價格並保存到 JSON 文件"""
     try:
-        # 使用 get_taiwan_stock_list() 獲取股票列表
-        stock_list = get_taiwan_stock_list()
-        if not stock_list:
-            await update.message.reply_text("無法獲取股票列表，請稍後再試")
+        status_message = await update.message.reply_text("開始匯入全市場 PER 數據...")
+
+        async def report_progress(done, total, written):
+            # 每 20 次請求更新一次進度
+            if done % 20 == 0 or done == total:
+                await status_message.edit_text(f"匯入進度：{done}/{total} 次請求，已寫入 {written} 筆")
+
+        since = start_date or (latest_roe_date() or datetime.strptime(ROE_START_DATE, '%Y-%m-%d').date())
+        try:
+            written = await ingest_market_per(start_date, end_date, chunk_days, progress=report_progress)
+        except IngestError as e:
+            # 失敗前已寫入的區間仍需更新季度彙總
+            if e.written:
+                update_rollups(since)
+            resume = f"/get_roe_data_bulk {e.start}"
+            if end_date or chunk_days != 1:
+                resume += f" {end_date or datetime.now().date()}"
+            if chunk_days != 1:
+                resume += f" {chunk_days}"
+            await update.message.reply_text(
+                f"⚠️ 匯入在 {e.start} ~ {e.end} 失敗，之前已寫入 {e.written} 筆\n請稍後再執行 {resume} 從失敗的日期繼續")
             return
 
-        logger.info(f"需要更新 {len(stock_list)} 支股票的價格")
+        # 只重算新資料所在、尚未凍結的季度
+        if written:
+            update_rollups(since)
+        await update.message.reply_text(f"完成！共寫入 {written} 筆全市場 PER 數據")
 
-        # 發送開始更新的訊息
-        status_message = await update.message.reply_text("開始更新股票價格...")
-        processed_count = 0
-        updated_prices = {}
+    except Exception as e:
+        logger.error(f"匯入全市場 PER 數據時發生錯誤: {str(e)}")
+        await update.message.reply_text("處理過程中發生錯誤，請稍後再試")
 
-        # 處理每支股票
-        for stock_id in stock_list:
-            try:
-                # 使用 get_current_stock_price 獲取價格
-                current_price = await get_current_stock_price(stock_id)
-                if current_price is not None:
-                    updated_prices[stock_id] = current_price
-                    processed_count += 1
+async def compute_sync_stock_prices():
+    """
+    /sync_stock_prices 的計算部分（不依賴 Telegram，CLI 批次模式共用）：
+    一次查詢全市場最近的收盤價並保存到股價表
 
-                # 每處理 100 支股票更新一次進度
-                if processed_count % 100 == 0:
-                    progress = (processed_count / len(stock_list)) * 100
-                    await status_message.edit_text(f"更新進度：{progress:.1f}% ({processed_count}/{len(stock_list)})")
+    :return: (股票清單數量, {stock_id: price})
+    """
+    stock_list = await get_taiwan_stock_list()
+    if not stock_list:
+        return 0, {}
+    logger.info(f"需要更新 {len(stock_list)} 支股票的價格")
 
-                # 每支股票處理完後暫停一下
-                await asyncio.sleep(0.1)
+    updated_prices = await get_current_stock_prices(stock_list)
+    price_table.save_prices(updated_prices)
+    return len(stock_list), updated_prices
 
-            except Exception as e:
-                logger.error(f"處理股票 {stock_id} 時發生錯誤: {str(e)}")
-                continue
 
-        # 保存更新後的價格數據
-        with open(STOCK_PRICE_FILE, 'w', encoding='utf-8') as f:
-            json.dump(updated_prices, f, ensure_ascii=False, indent=2)
+async def sync_stock_prices(update: Update, context: CallbackContext) -> None:
+    """同步所有股票的最新價格並保存到股價表（同時匯出 JSON 文件）"""
+    try:
+        # 發送開始更新的訊息
+        status_message = await update.message.reply_text("開始更新股票價格...")
+
+        total, updated_prices = await compute_sync_stock_prices()
+        if not total:
+            await status_message.edit_text("無法獲取股票列表，請稍後再試")
+            return
+        await status_message.edit_text(f"已取得 {len(updated_prices)}/{total} 支股票的價格")
 
         # 發送完成訊息
         await update.message.reply_text(f"股票價格更新完成！共更新 {len(updated_prices)} 支股票的價格")
@@ -996,15 +1422,17 @@ async def update_csv_with_close(update: Update, context: CallbackContext) -> Non
     讀取 stock_roe_data.csv，對於每一個唯一的 (stock_id, date) 組合，
     呼叫 API 獲取該日的收盤價 (close)，
     並將結果合併進 CSV（依據 stock_id 與 date 匹配），更新後存回 CSV 文件。
-    同時更新 stock_prices.json 中的最新價格。
+    同時更新股價表（stock_prices.bin）中的最新價格。
     """
     csv_file = "stock_roe_data.csv"
-    if not os.path.exists(csv_file):
-        logger.error(f"找不到 {csv_file} 文件")
-        return
+    roe_store = snapshot_store.store(csv_file)
 
-    # 讀取 CSV
-    df = pd.read_csv(csv_file)
+    # 讀取目前版本；寫回時以此版本為基礎，保留期間其他指令追加的資料
+    with roe_store.pin() as snapshot:
+        if snapshot is None:
+            logger.error(f"找不到 {csv_file} 文件")
+            return
+        df = snapshot.read_csv()
     
     # 將 date 欄位轉換為 datetime（若尚未轉換）
     df["date"] = pd.to_datetime(df["date"].str.strip(), format="%Y-%m-%d", errors="coerce")
@@ -1022,38 +1450,32 @@ async def update_csv_with_close(update: Update, context: CallbackContext) -> Non
     # 建立一個列表來存放所有收盤價資料
     all_price_dfs = []
     
-    # 用於更新 stock_prices.json 的最新價格
+    # 用於更新股價表的最新價格
     latest_prices = {}
 
     # 取得df中的第一筆資料的date
     query_date = df["date"].iloc[0]
     
-    # 遍歷每個股票代碼
-    for stock_id in stock_ids:
+    async def fetch_close(stock_id):
         try:
-            # 獲取該股票的所有日期
-            stock_dates = df[df["stock_id"] == stock_id]["date"].unique()
-
             logger.info(f"正在查詢股票 {stock_id} 在 {query_date.strftime('%Y-%m-%d')} 的收盤價")
-                
-            # 呼叫 API 獲取收盤價
-            price_df = await get_stock_price_from_date(stock_id, query_date)
-            if price_df is not None and not price_df.empty:
-                # 確保 price_df 的 stock_id 也是字串類型
-                price_df["stock_id"] = price_df["stock_id"].astype(str)
-                all_price_dfs.append(price_df)
-                
-                # 獲取最新價格並更新到 latest_prices
-                latest_price = price_df.sort_values("date").iloc[-1]["close"]
-                if latest_price > 0:  # 確保價格有效
-                    latest_prices[stock_id] = latest_price
-                
-            # 適當延遲，避免 API 請求過快
-            await asyncio.sleep(0.1)
-                
+            # 呼叫 API 獲取收盤價（同時請求數與速率由 finmind_client 的 rate_controller 控制）
+            return stock_id, await get_stock_price_from_date(stock_id, query_date)
         except Exception as e:
             logger.error(f"處理股票 {stock_id} 時發生錯誤: {str(e)}")
-            continue
+            return stock_id, None
+
+    # 同時查詢所有股票代碼
+    for stock_id, price_df in await asyncio.gather(*(fetch_close(stock_id) for stock_id in stock_ids)):
+        if price_df is not None and not price_df.empty:
+            # 確保 price_df 的 stock_id 也是字串類型
+            price_df["stock_id"] = price_df["stock_id"].astype(str)
+            all_price_dfs.append(price_df)
+            
+            # 獲取最新價格並更新到 latest_prices
+            latest_price = price_df.sort_values("date").iloc[-1]["close"]
+            if latest_price > 0:  # 確保價格有效
+                latest_prices[stock_id] = latest_price
 
     if not all_price_dfs:
         logger.warning("沒有獲取到任何收盤價數據")
@@ -1073,15 +1495,22 @@ async def update_csv_with_close(update: Update, context: CallbackContext) -> Non
         df_updated["close"] = df_updated["close_new"]
         df_updated.drop(columns=["close_new"], inplace=True)
 
-    # 保存更新後的 CSV 文件
-    df_updated.to_csv(csv_file, index=False, encoding='utf-8-sig')
-    logger.info(f"已將收盤價數據更新並合併到 {csv_file} 文件中")
+    # 保存為新版本（讀取中的指令仍使用原本的版本）
+    try:
+        version = roe_store.replace(df_updated, base=snapshot)
+    except snapshot_store.SnapshotConflict as e:
+        logger.error(f"更新收盤價時發生衝突: {str(e)}")
+        await update.message.reply_text("資料在更新期間已被其他指令改寫，請重新執行")
+        return
+    logger.info(f"已將收盤價數據更新並合併到 {csv_file}（第 {version} 版）")
+
+    # 收盤價更新後重建季度彙總
+    rebuild_rollups(df_updated)
 
-    # 更新 stock_prices.json
+    # 更新股價表（只改寫有新價格的股票）並匯出 stock_prices.json
     if latest_prices:
-        with open(STOCK_PRICE_FILE, 'w', encoding='utf-8') as f:
-            json.dump(latest_prices, f, ensure_ascii=False, indent=2)
-        logger.info(f"已更新 {len(latest_prices)} 支股票的最新價格到 stock_prices.json")
+        price_table.save_prices(latest_prices)
+        logger.info(f"已更新 {len(latest_prices)} 支股票的最新價格到股價表")
 
     # 發送完成訊息
     await update.message.reply_text(
@@ -1098,24 +1527,71 @@ def main():
     BOT_TOKEN = os.getenv("BOT_TOKEN")
     if not BOT_TOKEN:
         raise ValueError("未找到 BOT_TOKEN，請在 Heroku 環境變數設定 BOT_TOKEN")
+
+    # 接收模式：polling（預設）或 webhook
+    BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+    CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "1"))
     
     signal.signal(signal.SIGTERM, signal_handler)
     signal.signal(signal.SIGINT, signal_handler)
     
     try:
-        app = Application.builder().token(BOT_TOKEN).build()
-
-        app.add_handler(CommandHandler("start", start))
-        app.add_handler(CommandHandler("get_roe_data", get_stock_roe_data))
-        app.add_handler(CommandHandler("recommend_v2", recommend_v2))
-        app.add_handler(CommandHandler("cancel_recommend", cancel_recommend))
-        app.add_handler(CommandHandler("etf", etf))
-        app.add_handler(CommandHandler("stock_estimate", stock_estimate))
-        app.add_handler(CommandHandler("update_csv_with_close", update_csv_with_close))
-        app.add_handler(CommandHandler("sync_stock_prices", sync_stock_prices))
-
-        logger.info("Bot 已啟動並開始運行...")
-        app.run_polling()
+        builder = Application.builder().token(BOT_TOKEN)
+        if CONCURRENT_UPDATES > 1:
+            # 同時處理多個 update（例如 /recommend_v2 執行中仍可回應其他指令）
+            builder = builder.concurrent_updates(CONCURRENT_UPDATES)
+        app = builder.build()
+
+        # 記錄每個 update 的送達延遲與處理時間，比較 polling 與 webhook
+        update_latency.mode = BOT_MODE
+        app.add_handler(TypeHandler(Update, update_latency.mark_received), group=-1)
+        app.add_handler(TypeHandler(Update, update_latency.mark_handled), group=1)
+
+        # 指令處理函數（PROFILE_ENABLED 開啟時以 cProfile 包裝）
+        commands = {
+            "start": start,
+            "get_roe_data": get_stock_roe_data,
+            "get_roe_data_bulk": get_stock_roe_data_bulk,
+            "recommend_v2": recommend_v2,
+            "cancel_recommend": cancel_recommend,
+            "etf": etf,
+            "stock_estimate": stock_estimate,
+            "screen": screen,
+            "similar": similar,
+            "exdiv": exdiv,
+            "update_csv_with_close": update_csv_with_close,
+            "sync_stock_prices": sync_stock_prices,
+            "watch": watch,
+            "unwatch": unwatch,
+            "watchlist": watchlist,
+        }
+        for command, handler in commands.items():
+            app.add_handler(CommandHandler(command, profiled(command)(handler)))
+
+        # 定期檢查價格區間提醒（需安裝 python-telegram-bot[job-queue]）
+        if app.job_queue is not None:
+            app.job_queue.run_repeating(check_watchlist, interval=WATCH_INTERVAL, first=60)
+        else:
+            logger.warning("未安裝 job-queue 套件，價格提醒不會執行")
+
+        if BOT_MODE == "webhook":
+            WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+            if not WEBHOOK_URL:
+                raise ValueError("webhook 模式需要設定 WEBHOOK_URL（例如 https://<app>.herokuapp.com）")
+            WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+            PORT = int(os.getenv("PORT", "8443"))
+
+            logger.info(f"Bot 已啟動（webhook 模式，port {PORT}，同時處理 {CONCURRENT_UPDATES} 個 update）...")
+            app.run_webhook(
+                listen="0.0.0.0",
+                port=PORT,
+                url_path=WEBHOOK_PATH,
+                webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+                secret_token=os.getenv("WEBHOOK_SECRET"),
+            )
+        else:
+            logger.info("Bot 已啟動並開始運行...")
+            app.run_polling()
         
     except Exception as e:
         logger.error(f"運行時發生錯誤: {str(e)}")
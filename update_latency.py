@@ -0,0 +1,69 @@
+import logging
+import time
+from collections import deque
+from typing import Deque, Dict, Tuple
+
+import numpy as np
+from telegram import Update
+from telegram.ext import CallbackContext
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_EVERY = 50
+
+# 模式名稱（polling / webhook），由 main() 設定，方便比較兩種模式的紀錄
+mode = "polling"
+
+_received: Dict[int, Tuple[float, float]] = {}
+_delivery: Deque[float] = deque(maxlen=500)
+_handling: Deque[float] = deque(maxlen=500)
+_count = 0
+
+
+async def mark_received(update: Update, context: CallbackContext) -> None:
+    """
+    handler group -1：收到 update 時記錄時間。
+    送達延遲 = 收到時間 - 訊息時間；Telegram 的訊息時間只到秒，適合比較多筆的統計而非單筆。
+    """
+    message_time = update.effective_message.date.timestamp() if update.effective_message else None
+    _received[update.update_id] = (time.perf_counter(), time.time() - message_time if message_time else np.nan)
+
+
+async def mark_handled(update: Update, context: CallbackContext) -> None:
+    """最後一個 handler group：指令處理完成後記錄處理時間，每 SUMMARY_EVERY 筆輸出統計"""
+    global _count
+    received = _received.pop(update.update_id, None)
+    if received is None:
+        return
+    started, delivery = received
+    handling = time.perf_counter() - started
+    _delivery.append(delivery)
+    _handling.append(handling)
+    _count += 1
+    logger.debug(f"[{mode}] update {update.update_id}：送達 {delivery:.3f} 秒，處理 {handling:.3f} 秒")
+
+    if _count % SUMMARY_EVERY == 0:
+        stats = summary()
+        logger.info(
+            f"[{mode}] 最近 {stats['samples']} 筆 update："
+            f"送達延遲 p50 {stats['delivery_p50']:.3f} / p95 {stats['delivery_p95']:.3f} 秒，"
+            f"處理時間 p50 {stats['handling_p50']:.3f} / p95 {stats['handling_p95']:.3f} 秒"
+        )
+
+
+def summary() -> Dict[str, float]:
+    """最近的送達延遲與處理時間百分位數（秒）"""
+    delivery = np.array(_delivery, dtype=float)
+    handling = np.array(_handling, dtype=float)
+    delivery = delivery[~np.isnan(delivery)]
+
+    def percentile(values: np.ndarray, q: float) -> float:
+        return float(np.percentile(values, q)) if len(values) else float("nan")
+
+    return {
+        "samples": len(handling),
+        "delivery_p50": percentile(delivery, 50),
+        "delivery_p95": percentile(delivery, 95),
+        "handling_p50": percentile(handling, 50),
+        "handling_p95": percentile(handling, 95),
+    }
@@ -0,0 +1,168 @@
+import logging
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+import pandas as pd
+
+from dbHelper import (delete_watch_subscriptions, init_db, load_watch_subscriptions,
+                      save_watch_subscription, update_watch_sides)
+
+logger = logging.getLogger(__name__)
+
+# 訂閱的區間 → summarize_estimates 的欄位（yield 使用殖利率目標）
+BAND_COLUMNS = {"low": "low_price", "normal": "normal_price", "high": "high_price"}
+BAND_LABELS = {"low": "低股價", "normal": "正常股價", "high": "高股價", "yield": "殖利率"}
+BAND_ALIASES = {
+    "低": "low", "低價": "low", "低股價": "low",
+    "正常": "normal", "合理": "normal", "合理價": "normal", "正常股價": "normal",
+    "高": "high", "高價": "high", "高股價": "high",
+    "殖利率": "yield",
+}
+
+# (band, target)：價格區間的 target 為 0
+Threshold = Tuple[str, float]
+
+
+class WatchError(ValueError):
+    """訂閱參數格式錯誤"""
+
+
+def parse_band(args: List[str]) -> Threshold:
+    """
+    解析 /watch 的區間參數，例如 [low]、[正常]、[yield, 6]
+
+    :return: (band, target)
+    """
+    if not args:
+        raise WatchError("請指定區間：low、normal、high 或 yield <目標殖利率%>")
+    band = BAND_ALIASES.get(args[0], args[0].lower())
+    if band in BAND_COLUMNS:
+        return band, 0.0
+    if band == "yield":
+        try:
+            target = float(args[1].rstrip("%"))
+        except (IndexError, ValueError):
+            raise WatchError("請指定目標殖利率，例如：/watch 0056 yield 6")
+        if target <= 0:
+            raise WatchError("目標殖利率需大於 0")
+        return band, target
+    raise WatchError(f"未知的區間：{args[0]}")
+
+
+def describe(band: str, target: float) -> str:
+    return f"殖利率 {target:g}%" if band == "yield" else BAND_LABELS[band]
+
+
+class WatchIndex:
+    """
+    價格區間提醒訂閱的反向索引：stock_id → {(band, target): {chat_id, ...}}。
+    每次檢查只需走訪有人訂閱的股票，同一門檻的多個訂閱者只判斷一次。
+    """
+
+    def __init__(self):
+        self.by_stock: Dict[str, Dict[Threshold, Set[int]]] = defaultdict(lambda: defaultdict(set))
+        # 每個 (stock_id, band, target) 上次價格在門檻的哪一側（below / above）
+        self.sides: Dict[Tuple[str, str, float], str] = {}
+
+    @classmethod
+    def load(cls) -> "WatchIndex":
+        init_db()
+        index = cls()
+        for chat_id, stock_id, band, target, last_side, _ in load_watch_subscriptions():
+            index.by_stock[stock_id][(band, target)].add(chat_id)
+            if last_side:
+                index.sides[(stock_id, band, target)] = last_side
+        logger.info(f"載入 {index.size()} 筆價格提醒訂閱，共 {len(index.by_stock)} 支股票")
+        return index
+
+    def size(self) -> int:
+        return sum(len(chats) for thresholds in self.by_stock.values() for chats in thresholds.values())
+
+    def add(self, chat_id: int, stock_id: str, band: str, target: float) -> None:
+        self.by_stock[stock_id][(band, target)].add(chat_id)
+        # 沿用同一門檻目前的側別，避免新訂閱立即收到舊的穿越提醒
+        save_watch_subscription(chat_id, stock_id, band, target, self.sides.get((stock_id, band, target)),
+                                datetime.now().isoformat(timespec="seconds"))
+
+    def remove(self, chat_id: int, stock_id: str, band: Optional[str] = None) -> int:
+        count = delete_watch_subscriptions(chat_id, stock_id, band)
+        thresholds = self.by_stock.get(stock_id, {})
+        for threshold in list(thresholds):
+            if band is None or threshold[0] == band:
+                thresholds[threshold].discard(chat_id)
+                if not thresholds[threshold]:
+                    del thresholds[threshold]
+                    self.sides.pop((stock_id, *threshold), None)
+        if stock_id in self.by_stock and not thresholds:
+            del self.by_stock[stock_id]
+        return count
+
+    def for_chat(self, chat_id: int) -> List[Tuple[str, str, float]]:
+        """該聊天室的訂閱 [(stock_id, band, target), ...]"""
+        return sorted(
+            (stock_id, band, target)
+            for stock_id, thresholds in self.by_stock.items()
+            for (band, target), chats in thresholds.items()
+            if chat_id in chats
+        )
+
+    def stock_ids(self) -> List[str]:
+        return list(self.by_stock)
+
+    def yield_stock_ids(self) -> List[str]:
+        return [stock_id for stock_id, thresholds in self.by_stock.items()
+                if any(band == "yield" for band, _ in thresholds)]
+
+    def evaluate(self, prices: Dict[str, float], bands: pd.DataFrame,
+                 yields: Dict[str, float]) -> List[Dict]:
+        """
+        以一次市場快照判斷各門檻是否被穿越
+
+        :param prices: {stock_id: 最新股價}
+        :param bands: summarize_estimates 的結果（以 stock_id 為索引）
+        :param yields: {stock_id: 以最新股價計算的殖利率 (%)}
+        :return: 穿越的門檻 [{stock_id, band, target, price, value, side, chat_ids}, ...]
+        """
+        alerts, changed = [], []
+        for stock_id, price in prices.items():
+            thresholds = self.by_stock.get(stock_id)
+            if not thresholds or price is None or pd.isna(price):
+                continue
+            for (band, target), chats in thresholds.items():
+                if band == "yield":
+                    value = yields.get(stock_id)
+                    if value is None:
+                        continue
+                    side = "above" if value >= target else "below"
+                else:
+                    if stock_id not in bands.index or pd.isna(bands.at[stock_id, BAND_COLUMNS[band]]):
+                        continue
+                    value = float(bands.at[stock_id, BAND_COLUMNS[band]])
+                    side = "below" if price < value else "above"
+
+                key = (stock_id, band, target)
+                previous = self.sides.get(key)
+                if previous == side:
+                    continue
+                self.sides[key] = side
+                changed.append((side, stock_id, band, target))
+                # 第一次檢查只記錄側別，之後側別改變才提醒
+                if previous is not None:
+                    alerts.append({"stock_id": stock_id, "band": band, "target": target, "price": price,
+                                   "value": value, "side": side, "chat_ids": sorted(chats)})
+
+        if changed:
+            update_watch_sides(changed)
+        return alerts
+
+
+def format_alert(alert: Dict) -> str:
+    """組合提醒訊息"""
+    stock_id, band, price, value = alert["stock_id"], alert["band"], alert["price"], alert["value"]
+    if band == "yield":
+        direction = "升至" if alert["side"] == "above" else "降至"
+        return (f"🔔 {stock_id} 殖利率{direction} {value:.2f}%（目標 {alert['target']:g}%）\n"
+                f"目前股價 {price:.2f} 元")
+    direction = "跌破" if alert["side"] == "below" else "站上"
+    return f"🔔 {stock_id} 股價 {price:.2f} 元{direction}{BAND_LABELS[band]} {value:.2f} 元"
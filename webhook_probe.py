@@ -0,0 +1,75 @@
+import argparse
+import asyncio
+import os
+import time
+from typing import Dict, List
+
+import aiohttp
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def synthetic_update(update_id: int, chat_id: int, text: str) -> Dict:
+    """組合與 Telegram 相同格式的 Update JSON（指令需標記 bot_command entity）"""
+    command = text.split()[0]
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "probe"},
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(command)}] if command.startswith("/") else [],
+        },
+    }
+
+
+async def _post(session: aiohttp.ClientSession, semaphore: asyncio.Semaphore, url: str,
+                headers: Dict, update: Dict) -> float:
+    async with semaphore:
+        started = time.perf_counter()
+        async with session.post(url, json=update, headers=headers) as response:
+            await response.read()
+            if response.status != 200:
+                raise RuntimeError(f"webhook 回應狀態碼 {response.status}")
+        return time.perf_counter() - started
+
+
+async def probe(url: str, secret: str, count: int, concurrency: int, chat_id: int, text: str) -> List[float]:
+    """
+    對本機 webhook 端點送出 count 個合成 Update，回傳每次 HTTP 回應時間（秒）。
+    webhook 伺服器在 update 放入佇列後即回應，指令處理時間請見 bot 的 update_latency 紀錄。
+    """
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+    semaphore = asyncio.Semaphore(concurrency)
+    base_id = int(time.time() * 1000) % 1_000_000_000
+    async with aiohttp.ClientSession() as session:
+        return await asyncio.gather(*(
+            _post(session, semaphore, url, headers, synthetic_update(base_id + i, chat_id, text))
+            for i in range(count)
+        ))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="對 webhook 模式的 bot 送出合成 Update 並量測延遲")
+    parser.add_argument("--url", default=f"http://127.0.0.1:{os.getenv('PORT', '8443')}/{os.getenv('WEBHOOK_PATH', 'telegram')}")
+    parser.add_argument("--secret", default=os.getenv("WEBHOOK_SECRET", ""))
+    parser.add_argument("--count", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--chat-id", type=int, default=int(os.getenv("PROBE_CHAT_ID", "1")),
+                        help="回覆訊息送往的聊天室（預設值無法收到回覆，只量測延遲）")
+    parser.add_argument("--text", default="/start")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    latencies = np.array(asyncio.run(probe(args.url, args.secret, args.count, args.concurrency,
+                                           args.chat_id, args.text)))
+    elapsed = time.perf_counter() - started
+
+    print(f"送出 {len(latencies)} 個 update，耗時 {elapsed:.2f} 秒（{len(latencies) / elapsed:.1f} 個/秒）")
+    print(f"HTTP 回應時間 p50 {np.percentile(latencies, 50) * 1000:.1f} ms、"
+          f"p95 {np.percentile(latencies, 95) * 1000:.1f} ms、max {latencies.max() * 1000:.1f} ms")
+    print("指令的送達延遲與處理時間請見 bot 紀錄中的 update_latency 統計，與 polling 模式比較")